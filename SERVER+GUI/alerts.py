@@ -0,0 +1,302 @@
+import argparse
+import json
+import os
+import threading
+import numpy as np
+from jsonl_index import record_time
+from metrics import REGISTRY
+
+# --- CONFIGURACIÓN ---
+ALERTS_FILE = "alerts.jsonl"        # Eventos FIRING / RESOLVED (una línea por transición)
+RULES_FILE = "alert_rules.json"     # Reglas propias; si no existe se usan DEFAULT_RULES
+CLOCK_RESET = 1.0                   # Segundos que puede retroceder el reloj antes de reiniciar una serie
+ALERT_PROTOCOL = "ALERT"
+
+# Una regla:
+#   name       identificador (y título en la GUI)
+#   field      campo del registro que se evalúa ("temp", "rms", "loss_rate", ...)
+#   sensor     solo registros de este sensor (opcional)
+#   kind       "threshold" (valor) o "rate" (|cambio| por segundo)
+#   op         ">" o "<"  (rate siempre es ">")
+#   threshold  valor que dispara la alerta
+#   clear      histéresis: la alerta se despeja recién al cruzar este valor (por defecto = threshold)
+#   for_s      debounce: segundos que la condición debe sostenerse para disparar (0 = en la primera muestra)
+#   clear_for_s segundos que debe sostenerse el despeje para resolverla
+#   ignore     valores centinela que no se evalúan (p.ej. 0 = sensor sin lectura)
+#   severity   "warning" / "critical"
+#   message    texto con {value} (p.ej. "CALOR: {value:.1f}°C")
+DEFAULT_RULES = [
+    {"name": "CALOR", "sensor": "BME688", "field": "temp", "op": ">", "threshold": 30, "clear": 29.5,
+     "clear_for_s": 5, "ignore": [0], "severity": "warning", "message": "CALOR: {value:.1f}°C"},
+    {"name": "FRIO", "sensor": "BME688", "field": "temp", "op": "<", "threshold": 10, "clear": 10.5,
+     "clear_for_s": 5, "ignore": [0], "severity": "warning", "message": "FRÍO: {value:.1f}°C"},
+    {"name": "HUMEDAD", "sensor": "BME688", "field": "hum", "op": ">", "threshold": 70, "clear": 68,
+     "clear_for_s": 5, "ignore": [0], "severity": "warning", "message": "HUMEDAD: {value:.1f}%"},
+    {"name": "SECO", "sensor": "BME688", "field": "hum", "op": "<", "threshold": 20, "clear": 22,
+     "clear_for_s": 5, "ignore": [0], "severity": "warning", "message": "SECO: {value:.1f}%"},
+    {"name": "AIRE_SUCIO", "sensor": "BME688", "field": "gas", "op": "<", "threshold": 5000, "clear": 6000,
+     "for_s": 2, "clear_for_s": 10, "ignore": [0], "severity": "critical", "message": "AIRE SUCIO ({value:.0f} Ω)"},
+    {"name": "CAMBIO_TEMP", "sensor": "BME688", "field": "temp", "kind": "rate", "threshold": 1.0, "clear": 0.5,
+     "clear_for_s": 10, "ignore": [0], "severity": "warning", "message": "CAMBIO BRUSCO: {value:.2f}°C/s"},
+]
+
+
+# --- REGLA ---
+class Rule:
+    def __init__(self, name, field, threshold, op=">", kind="threshold", clear=None, for_s=0.0,
+                 clear_for_s=0.0, sensor=None, ignore=(), severity="warning", message=None):
+        if kind not in ("threshold", "rate"):
+            raise ValueError(f"Regla {name}: kind debe ser 'threshold' o 'rate'")
+        if op not in (">", "<"):
+            raise ValueError(f"Regla {name}: op debe ser '>' o '<'")
+        self.name = name
+        self.field = field
+        self.kind = kind
+        self.above = op == ">" or kind == "rate"
+        self.threshold = float(threshold)
+        self.clear = float(threshold if clear is None else clear)
+        self.for_s = float(for_s)
+        self.clear_for_s = float(clear_for_s)
+        self.sensor = sensor
+        self.ignore = tuple(ignore)
+        self.severity = severity
+        self.message = message or f"{name}: {{value:.3g}}"
+
+
+def load_rules(path=RULES_FILE):
+    """Reglas desde un JSON (lista de objetos); DEFAULT_RULES si el archivo no existe"""
+    specs = DEFAULT_RULES
+    if path and os.path.exists(path):
+        with open(path) as f:
+            specs = json.load(f)
+    return [Rule(**spec) for spec in specs]
+
+
+def _ffill_index(mask, n):
+    """Para cada i, el último índice j <= i con mask[j] (o -1)"""
+    idx = np.where(mask, np.arange(n), -1)
+    return np.maximum.accumulate(idx)
+
+
+_NO_TRANSITIONS = np.empty(0, dtype=np.intp)
+
+
+# --- ESTADO DE UNA SERIE (regla x source_ip) ---
+class _Stream:
+    __slots__ = ("raw", "state", "run_start", "last_t", "last_v", "event")
+
+    def __init__(self):
+        self.raw = 0                  # Condición con histéresis
+        self.state = 0                # Condición con histéresis y debounce (la alerta)
+        self.run_start = -np.inf      # Desde cuándo 'raw' tiene su valor actual
+        self.last_t = None
+        self.last_v = None
+        self.event = None             # Último FIRING mientras está activa
+
+    def evaluate(self, rule, t, v):
+        """
+        Procesa un lote ordenado por t; devuelve (índices con transición,
+        estado tras cada muestra, valor evaluado). Todo vectorizado: la
+        histéresis y el debounce se resuelven con 'forward fill' de índices.
+        """
+        n = len(t)
+        if self.last_t is not None and t[0] < self.last_t - CLOCK_RESET:
+            # El dispositivo se reinició: la serie empieza de nuevo, la alerta se mantiene
+            self.run_start = -np.inf
+            self.last_t = self.last_v = None
+
+        if rule.kind == "rate":
+            t_prev = np.concatenate(([t[0] if self.last_t is None else self.last_t], t[:-1]))
+            v_prev = np.concatenate(([v[0] if self.last_v is None else self.last_v], v[:-1]))
+            dt = t - t_prev
+            x = np.abs(np.divide(v - v_prev, dt, out=np.zeros(n), where=dt > 0))
+        else:
+            x = v
+        self.last_t, self.last_v = t[-1], v[-1]
+
+        # Histéresis: dispara al pasar threshold, se despeja al volver más allá de clear
+        if rule.above:
+            on, off = x > rule.threshold, x <= rule.clear
+        else:
+            on, off = x < rule.threshold, x >= rule.clear
+        if self.raw == self.state and not (off if self.state else on).any():
+            # Caso habitual: nada cruza el umbral contrario y la alerta sigue como estaba
+            return _NO_TRANSITIONS, None, x
+        last_event = _ffill_index(on | off, n)
+        raw = np.where(last_event >= 0, on[np.maximum(last_event, 0)], bool(self.raw)).astype(np.int8)
+
+        # Debounce: un valor de 'raw' cuenta recién cuando se sostuvo for_s / clear_for_s
+        prev_raw = np.concatenate(([self.raw], raw[:-1]))
+        run_idx = _ffill_index(raw != prev_raw, n)
+        run_start = np.where(run_idx >= 0, t[np.maximum(run_idx, 0)], self.run_start)
+        hold = np.where(raw == 1, rule.for_s, rule.clear_for_s)
+        settled = _ffill_index(t - run_start >= hold, n)
+        state = np.where(settled >= 0, raw[np.maximum(settled, 0)], self.state)
+
+        prev_state = np.concatenate(([self.state], state[:-1]))
+        self.raw, self.run_start, self.state = int(raw[-1]), float(run_start[-1]), int(state[-1])
+        return np.flatnonzero(state != prev_state), state, x
+
+
+# --- MOTOR (SINK PARA BatchedWriter) ---
+class AlertEngine:
+    """
+    Evalúa las reglas sobre cada registro que pasa por el BatchedWriter
+    (por lote y con NumPy), guarda cada transición FIRING / RESOLVED en
+    alerts.jsonl y la entrega a 'publish' (la GUI la recibe como señal).
+    El lote se recorre una sola vez para agruparlo por (sensor, source_ip);
+    cada campo se extrae una vez y lo comparten todas sus reglas.
+    """
+
+    def __init__(self, rules=None, path=ALERTS_FILE, publish=None, registry=REGISTRY):
+        self.rules = load_rules() if rules is None else list(rules)
+        self.by_sensor = self._index(self.rules)
+        self.path = path
+        self.publish = publish
+        self.streams = {}     # (regla, source_ip) -> _Stream
+        self.file = open(path, "a") if path else None
+        self._lock = threading.Lock()
+        self.fired = None
+        if registry is not None:
+            self.fired = registry.counter("alerts_fired_total", "Alertas disparadas", ("rule", "source_ip"))
+            registry.callback("alerts_active", "Alertas activas", lambda: len(self.active()))
+
+    def set_rules(self, rules):
+        with self._lock:
+            self.rules = list(rules)
+            self.by_sensor = self._index(self.rules)
+            self.streams = {}
+
+    @staticmethod
+    def _index(rules):
+        """sensor (None = cualquiera) -> campo -> reglas que lo evalúan"""
+        by_sensor = {}
+        for rule in rules:
+            by_sensor.setdefault(rule.sensor or None, {}).setdefault(rule.field, []).append(rule)
+        return by_sensor
+
+    def active(self):
+        """Eventos FIRING de las alertas que siguen activas"""
+        with self._lock:
+            return [s.event for s in self.streams.values() if s.state and s.event]
+
+    # --- INTERFAZ DE SINK ---
+    def write_batch(self, records):
+        with self._lock:
+            by_sensor = self.by_sensor
+            groups = {}
+            for r in records:
+                sensor = r.get("sensor")
+                if sensor in by_sensor:
+                    groups.setdefault((sensor, r.get("source_ip", "")), []).append(r)
+                if sensor is not None and None in by_sensor:
+                    groups.setdefault((None, r.get("source_ip", "")), []).append(r)
+            events = []
+            for (sensor, ip), recs in groups.items():
+                events.extend(self._evaluate_group(by_sensor[sensor], ip, recs))
+        for event in events:
+            if self.file:
+                self.file.write(json.dumps(event) + "\n")
+            if self.publish:
+                self.publish(event)
+
+    def _evaluate_group(self, fields, ip, recs):
+        """Registros de un sensor y una placa: se ordenan una vez y cada campo se lee una vez"""
+        # Reloj del dispositivo si viene (las muestras de un lote llegan juntas), si no el del servidor
+        t = np.array([r["uptime_ms"] / 1000.0 if "uptime_ms" in r else (record_time(r) or 0.0) for r in recs])
+        order = np.argsort(t, kind="stable")
+        t = t[order]
+        recs = [recs[i] for i in order]
+        events = []
+        for field, rules in fields.items():
+            values = [r.get(field) for r in recs]
+            valid = np.fromiter((v.__class__ in (int, float) for v in values), bool, len(values))
+            if not valid.any():
+                continue
+            v = np.array([x if ok else 0.0 for x, ok in zip(values, valid)], dtype=float)
+            for rule in rules:
+                mask = valid
+                for sentinel in rule.ignore:
+                    mask = mask & (v != sentinel)
+                idx = np.flatnonzero(mask)
+                if len(idx):
+                    events.extend(self._evaluate(rule, ip, t[idx], v[idx], recs, idx))
+        return events
+
+    def _evaluate(self, rule, ip, t, v, recs, idx):
+        stream = self.streams.get((rule.name, ip))
+        if stream is None:
+            stream = self.streams[(rule.name, ip)] = _Stream()
+        trans, state, x = stream.evaluate(rule, t, v)
+
+        events = []
+        for i in trans:
+            src = recs[idx[i]]
+            firing = bool(state[i])
+            event = {"sensor": "ALERT", "type": "FIRING" if firing else "RESOLVED", "rule": rule.name,
+                     "severity": rule.severity, "field": rule.field, "value": round(float(x[i]), 4),
+                     "threshold": rule.threshold if firing else rule.clear,
+                     "message": rule.message.format(value=float(x[i])), "source_ip": ip}
+            for k in ("timestamp_server", "timestamp", "uptime_ms"):
+                if k in src:
+                    event[k] = src[k]
+            event["protocol"] = ALERT_PROTOCOL
+            if firing:
+                stream.event = event
+                if self.fired is not None:
+                    self.fired.inc(rule.name, ip)
+            else:
+                stream.event = None
+            events.append(event)
+        return events
+
+    def flush(self, fsync=False):
+        if self.file:
+            self.file.flush()
+            if fsync:
+                os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reglas de alerta y eventos guardados")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_rules = sub.add_parser("rules", help="Mostrar las reglas (o escribir las de fábrica a un JSON)")
+    p_rules.add_argument("--file", default=RULES_FILE)
+    p_rules.add_argument("--write-defaults", action="store_true")
+    p_ev = sub.add_parser("events", help="Eventos de alerts.jsonl")
+    p_ev.add_argument("--file", default=ALERTS_FILE)
+    p_ev.add_argument("--active", action="store_true", help="Solo las que siguen activas")
+    args = parser.parse_args()
+
+    if args.cmd == "rules":
+        if args.write_defaults:
+            with open(args.file, "w") as f:
+                json.dump(DEFAULT_RULES, f, indent=2, ensure_ascii=False)
+            print(f"✅ Reglas de fábrica escritas en {args.file}")
+        for rule in load_rules(args.file):
+            cond = f"|d{rule.field}/dt|" if rule.kind == "rate" else rule.field
+            op = ">" if rule.above else "<"
+            print(f"📏 {rule.name}: {rule.sensor or '*'} {cond} {op} {rule.threshold:g} "
+                  f"(despeja en {rule.clear:g}, debounce {rule.for_s:g}/{rule.clear_for_s:g} s)")
+    else:
+        active = {}
+        with open(args.file) as f:
+            for line in f:
+                ev = json.loads(line)
+                key = (ev["rule"], ev["source_ip"])
+                if ev["type"] == "FIRING":
+                    active[key] = ev
+                else:
+                    active.pop(key, None)
+                if not args.active:
+                    icon = "🔴" if ev["type"] == "FIRING" else "🟢"
+                    print(f"{icon} {ev.get('timestamp_server') or ev.get('timestamp')} {ev['source_ip']} "
+                          f"{ev['rule']}: {ev['message']}")
+        if args.active:
+            for ev in active.values():
+                print(f"🔴 {ev['source_ip']} {ev['rule']}: {ev['message']}")
@@ -0,0 +1,202 @@
+import threading
+import numpy as np
+from jsonl_index import record_time
+
+# --- CONFIGURACIÓN ---
+CHANNELS = ("ax", "ay", "az", "gx", "gy", "gz")
+ACCEL = slice(0, 3)          # ax, ay, az dentro de CHANNELS
+DEFAULT_WINDOW = 256         # Muestras por ventana (window_size)
+DEFAULT_THRESHOLD = 1000     # Umbral de picos en milésimas: 1000 = 1.0 m/s² sobre la media
+HOP_FRACTION = 0.5           # Se calcula cada window_size * HOP_FRACTION muestras nuevas
+RESYNC_HOPS = 64             # Cada cuántos saltos se recalculan exactas las sumas acumuladas
+
+# Registros derivados (protocol = "ANALYTICS"):
+#   RMS_SRV: {"sensor":"BMI270","type":"RMS_SRV","rms_srv":..,"N":..}
+#         mismo cálculo que el RMS del firmware (sqrt(rms_x² + rms_y² + rms_z²)), pero con
+#         tipo y campo propios para no mezclarse con él al guardar ni al graficar
+#   FFT : {"sensor":"BMI270","type":"FFT","N":..,"fs":..,"df":..,"peak_hz":..,"mag":[..]}
+#         espectro de |a| sin media, ventana de Hann, rfft; mag[k] corresponde a k * df Hz
+#   PEAK: {"sensor":"BMI270","type":"PEAK","channel":"az","peak":..,"threshold":..}
+#         cada vez que |x - media de la ventana| cruza el umbral hacia arriba
+DERIVED_PROTOCOL = "ANALYTICS"
+
+
+# --- VENTANA DESLIZANTE DE UN DISPOSITIVO ---
+class _DeviceWindow:
+    """
+    Últimas 'size' muestras de los 6 canales en un buffer espejado (como
+    RingBuffer): la ventana completa siempre es una vista contigua.
+    Mantiene sumas acumuladas de la aceleración para RMS y media en O(salto).
+    """
+
+    def __init__(self, size, hop, threshold):
+        self.size = size
+        self.hop = hop
+        self.threshold = threshold / 1000.0
+        self.t = np.zeros(2 * size)
+        self.x = np.zeros((2 * size, len(CHANNELS)))
+        self.head = 0
+        self.pending = 0            # Muestras desde el último cálculo
+        self.hops = 0
+        self.sum = np.zeros(len(CHANNELS))
+        self.sumsq = np.zeros(len(CHANNELS))
+        self.above = np.zeros(len(CHANNELS), dtype=bool)  # Estado del umbral (cruces entre lotes)
+
+    def count(self):
+        return min(self.head, self.size)
+
+    def view(self):
+        n = self.count()
+        i = (self.head - n) % self.size
+        return self.t[i:i + n], self.x[i:i + n]
+
+    def extend(self, t, x):
+        """Agrega k <= size muestras actualizando las sumas con las que entran y salen"""
+        k = len(t)
+        evicted = max(0, self.count() + k - self.size)
+        if evicted:
+            _, old = self.view()
+            out = old[:evicted]
+            self.sum -= out.sum(axis=0)
+            self.sumsq -= (out * out).sum(axis=0)
+        self.sum += x.sum(axis=0)
+        self.sumsq += (x * x).sum(axis=0)
+
+        i = self.head % self.size
+        first = min(k, self.size - i)
+        for base in (i, i + self.size):
+            self.t[base:base + first] = t[:first]
+            self.x[base:base + first] = x[:first]
+        if first < k:
+            rest = k - first
+            for base in (0, self.size):
+                self.t[base:base + rest] = t[first:]
+                self.x[base:base + rest] = x[first:]
+        self.head += k
+        self.pending += k
+
+    def resync(self):
+        _, x = self.view()
+        self.sum = x.sum(axis=0)
+        self.sumsq = (x * x).sum(axis=0)
+
+
+# --- ETAPA DE ANÁLISIS (SINK PARA BatchedWriter) ---
+class AnalyticsStage:
+    """
+    Consume los registros RAW del BMI270, mantiene una ventana deslizante por
+    source_ip y cada 'hop' muestras publica RMS, espectro FFT y picos como
+    registros derivados. Se usa como sink del BatchedWriter: el cálculo corre
+    en el hilo escritor, por lotes, y 'publish' recibe cada registro derivado
+    (normalmente writer.put, para que también se persista).
+    """
+
+    def __init__(self, publish, window_size=DEFAULT_WINDOW, threshold=DEFAULT_THRESHOLD):
+        self.publish = publish
+        self.defaults = {"window_size": window_size, "threshold": threshold}
+        self.overrides = {}   # source_ip -> {"window_size": .., "threshold": ..}
+        self.devices = {}     # source_ip -> _DeviceWindow
+        self._lock = threading.Lock()
+
+    def configure(self, source_ip=None, window_size=None, threshold=None):
+        """Cambia window_size/threshold de un dispositivo (o de todos con source_ip=None)"""
+        changes = {k: v for k, v in (("window_size", window_size), ("threshold", threshold)) if v is not None}
+        with self._lock:
+            if source_ip is None:
+                self.defaults.update(changes)
+                self.overrides = {}
+                self.devices = {}
+            else:
+                self.overrides.setdefault(source_ip, {}).update(changes)
+                self.devices.pop(source_ip, None)
+
+    def _device(self, ip):
+        dev = self.devices.get(ip)
+        if dev is None:
+            cfg = dict(self.defaults, **self.overrides.get(ip, {}))
+            size = max(8, int(cfg["window_size"]))
+            dev = self.devices[ip] = _DeviceWindow(size, max(1, int(size * HOP_FRACTION)), cfg["threshold"])
+        return dev
+
+    # --- INTERFAZ DE SINK ---
+    def write_batch(self, records):
+        groups = {}
+        for r in records:
+            if r.get("sensor") == "BMI270" and r.get("type") == "RAW" and "ax" in r:
+                groups.setdefault(r.get("source_ip", ""), []).append(r)
+        with self._lock:
+            for ip, recs in groups.items():
+                self._process(ip, recs)
+
+    def flush(self, fsync=False):
+        pass
+
+    def close(self):
+        pass
+
+    # --- CÁLCULO ---
+    def _process(self, ip, recs):
+        dev = self._device(ip)
+        x = np.array([[r.get(c, 0.0) for c in CHANNELS] for r in recs], dtype=float)
+        # Tiempo del dispositivo si viene (uptime_ms), si no el del servidor
+        t = np.array([r["uptime_ms"] / 1000.0 if "uptime_ms" in r else (record_time(r) or 0.0)
+                      for r in recs])
+
+        pos = 0
+        while pos < len(recs):
+            # Trozos que terminan justo en el próximo salto
+            k = min(len(recs) - pos, dev.hop - dev.pending % dev.hop)
+            self._peaks(dev, recs, x[pos:pos + k], pos)
+            dev.extend(t[pos:pos + k], x[pos:pos + k])
+            pos += k
+            if dev.pending >= dev.hop and dev.head >= dev.size:
+                dev.pending = 0
+                dev.hops += 1
+                if dev.hops % RESYNC_HOPS == 0:
+                    dev.resync()
+                self._emit_window(dev, recs[pos - 1])
+
+    def _peaks(self, dev, recs, x, offset):
+        """Cruces hacia arriba del umbral, vectorizado sobre las muestras nuevas"""
+        n = dev.count()
+        if not n or dev.threshold <= 0:
+            return
+        mean = dev.sum / n
+        above = np.abs(x - mean) > dev.threshold
+        prev = np.vstack((dev.above, above[:-1]))
+        rows, cols = np.nonzero(above & ~prev)
+        dev.above = above[-1]
+        for row, col in zip(rows, cols):
+            src = recs[offset + row]
+            self.publish(self._derived(src, "PEAK", channel=CHANNELS[col],
+                                       peak=float(x[row, col]), threshold=dev.threshold))
+
+    def _emit_window(self, dev, last):
+        n = dev.size
+        # RMS: desde las sumas acumuladas, sin recorrer la ventana
+        rms = float(np.sqrt(np.maximum(dev.sumsq[ACCEL], 0).sum() / n))
+        self.publish(self._derived(last, "RMS_SRV", rms_srv=round(rms, 4), N=n))
+
+        # FFT del módulo de la aceleración (sin media) con ventana de Hann
+        t, x = dev.view()
+        mag = np.sqrt((x[:, ACCEL] ** 2).sum(axis=1))
+        mag -= mag.mean()
+        hann = np.hanning(n)
+        spectrum = np.abs(np.fft.rfft(mag * hann)) * (2.0 / hann.sum())
+        span = t[-1] - t[0]
+        fs = (n - 1) / span if span > 0 else 0.0
+        df = fs / n
+        peak = int(np.argmax(spectrum[1:])) + 1 if len(spectrum) > 1 else 0
+        self.publish(self._derived(last, "FFT", N=n, fs=round(fs, 3), df=round(df, 5),
+                                   peak_hz=round(peak * df, 3),
+                                   mag=[round(float(v), 5) for v in spectrum]))
+
+    @staticmethod
+    def _derived(src, dtype, **fields):
+        rec = {"sensor": "BMI270", "type": dtype}
+        rec.update(fields)
+        for k in ("timestamp_server", "timestamp", "uptime_ms", "source_ip"):
+            if k in src:
+                rec[k] = src[k]
+        rec["protocol"] = DERIVED_PROTOCOL
+        return rec
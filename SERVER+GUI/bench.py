@@ -0,0 +1,399 @@
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from jsonl_index import record_time
+import protocol
+from protocol import decode_fast_json, decode_payload, encode_json
+from segments import list_segments, open_log
+from simulator import Fleet, PORT
+
+# --- CONFIGURACIÓN ---
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVER_SCRIPT = os.path.join(HERE, "server_unificado.py")
+RESULTS_FILE = "bench_results.jsonl"
+DATA_FILE = "sensor_data.jsonl"
+READY_TIMEOUT = 10.0      # Segundos esperando a que el receptor abra el puerto
+WARMUP = 2.0              # Segundos de envío antes de empezar a medir
+DRAIN = 2.0               # Segundos tras detener la flota para que se vacíen las colas
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+DECODE_MAX = 200000       # Registros usados por --decode
+DECODE_REPEAT = 5         # Pasadas por variante (se toma la mejor)
+
+# Modos de ingesta: argumentos del receptor y configuración de la flota
+MODES = {
+    "udp-json":    {"server": [], "protocol": "UDP", "fmt": "JSON", "batch": 1},
+    "udp-bin":     {"server": [], "protocol": "UDP", "fmt": "BIN", "batch": 1},
+    "udp-batch":   {"server": [], "protocol": "UDP", "fmt": "BIN", "batch": 16},
+    "tcp-json":    {"server": [], "protocol": "TCP", "fmt": "JSON", "batch": 1},
+    "udp-workers": {"server": ["--workers", "2"], "protocol": "UDP", "fmt": "JSON", "batch": 1},
+    "gui":         {"gui": True, "protocol": "UDP", "fmt": "JSON", "batch": 1},
+}
+DEFAULT_MODES = ("udp-json", "udp-bin", "udp-batch", "tcp-json", "udp-workers")
+
+
+# --- PROCESO BAJO PRUEBA ---
+def gui_worker_main():
+    """
+    Modo 'gui': el núcleo sin interfaz más el CoreWorker de gui.py sin ventana,
+    adjunto al feed compartido y leyéndolo a 30 cuadros/s como la GUI real
+    """
+    from PyQt5.QtCore import QCoreApplication, QTimer
+    from gui import CoreWorker
+    core = subprocess.Popen([sys.executable, "-u", SERVER_SCRIPT, "--rotate-minutes", "0"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    app = QCoreApplication(sys.argv)
+    worker = CoreWorker(spawn=False)
+    worker.signals.log_message.connect(print)
+    worker.start()
+    signal.signal(signal.SIGINT, lambda *_: app.quit())
+    # El mismo drenado por cuadro que MainWindow.timed_update (y deja a Python atender la señal)
+    timer = QTimer()
+    timer.timeout.connect(worker.poll_feed)
+    timer.start(33)
+    app.exec_()
+    worker.stop()
+    core.send_signal(signal.SIGINT)
+    core.wait(timeout=10)
+
+
+def start_target(mode, workdir):
+    if mode.get("gui"):
+        cmd = [sys.executable, "-u", os.path.abspath(__file__), "--gui-worker"]
+    else:
+        cmd = [sys.executable, "-u", SERVER_SCRIPT, "--rotate-minutes", "0"] + mode["server"]
+    env = dict(os.environ, PYTHONPATH=HERE)
+    return subprocess.Popen(cmd, cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.STDOUT)
+
+
+def wait_ready(proc, port):
+    """El TCP abre después del escritor; con el puerto aceptando, el UDP ya está o está por estar"""
+    deadline = time.monotonic() + READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            return False
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            time.sleep(0.5)
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+# --- CPU Y MEMORIA (/proc) ---
+def process_tree(pid):
+    """pid y todos sus descendientes (los workers UDP son procesos aparte)"""
+    children = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    tree, pending = [], [pid]
+    while pending:
+        p = pending.pop()
+        tree.append(p)
+        pending.extend(children.get(p, []))
+    return tree
+
+
+def cpu_seconds(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])   # utime + stime
+        except (OSError, IndexError, ValueError):
+            continue
+    return total / CLK_TCK
+
+
+def memory_mb(pids):
+    """(RSS actual, pico de RSS) sumados sobre el árbol, en MB"""
+    rss = peak = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss += int(line.split()[1])
+                    elif line.startswith("VmHWM:"):
+                        peak += int(line.split()[1])
+        except OSError:
+            continue
+    return rss / 1024, peak / 1024
+
+
+# --- ANÁLISIS DE LO PERSISTIDO ---
+def percentile(values, p):
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def analyze(workdir, epoch, t_start, t_end, sent_by_ip):
+    """
+    Recorre lo que quedó en disco: registros/s dentro de la ventana medida,
+    pérdida por dispositivo (seq únicos vs enviados) y latencia extremo a
+    extremo = hora de llegada - (epoch de la flota + uptime_ms).
+    """
+    seqs = {ip: set() for ip in sent_by_ip}
+    latencies = []
+    in_window = 0
+    for _, path in list_segments(os.path.join(workdir, DATA_FILE)):
+        with open_log(path, "rb") as f:
+            for line in f:
+                try:
+                    r = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if r.get("protocol") == "ANALYTICS" or "seq" not in r:
+                    continue
+                t = record_time(r)
+                seqs.setdefault(r.get("source_ip", ""), set()).add(r["seq"])
+                if t is None or not t_start <= t < t_end:
+                    continue
+                in_window += 1
+                if "uptime_ms" in r:
+                    latencies.append((t - (epoch + r["uptime_ms"] / 1000.0)) * 1000.0)
+
+    sent = sum(sent_by_ip.values())
+    received = sum(len(seqs.get(ip, ())) for ip in sent_by_ip)
+    loss_by_ip = {ip: round(1 - len(seqs.get(ip, ())) / n, 5) if n else 0.0 for ip, n in sent_by_ip.items()}
+    latencies.sort()
+    return {
+        "records_per_s": round(in_window / (t_end - t_start), 1),
+        "sent": sent,
+        "received": received,
+        "loss": round(1 - received / sent, 5) if sent else 0.0,
+        "loss_max_device": max(loss_by_ip.values()) if loss_by_ip else 0.0,
+        "latency_ms": {f"p{p}": round(percentile(latencies, p), 2) if latencies else None
+                       for p in (50, 95, 99)},
+    }
+
+
+# --- UNA CORRIDA ---
+def run_mode(name, args):
+    mode = MODES[name]
+    workdir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    proc = start_target(mode, workdir)
+    try:
+        if not wait_ready(proc, PORT):
+            print(f"❌ [{name}] El receptor no quedó escuchando en el puerto {PORT}")
+            return None
+
+        fleet = Fleet(args.devices, distinct_ips=not args.same_ip, sensor=args.sensor,
+                      protocol=mode["protocol"], rate=args.rate, fmt=mode["fmt"],
+                      batch=mode["batch"], stamp=True)
+        fleet.start()
+        time.sleep(WARMUP)
+
+        pids = process_tree(proc.pid)
+        cpu0 = cpu_seconds(pids)
+        t_start = time.time()
+        time.sleep(args.duration)
+        t_end = time.time()
+        cpu1 = cpu_seconds(process_tree(proc.pid))
+        rss, peak = memory_mb(process_tree(proc.pid))
+
+        fleet.stop()
+        time.sleep(DRAIN)
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    result = {
+        "mode": name,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "devices": args.devices,
+        "rate": args.rate,
+        "sensor": args.sensor,
+        "duration": args.duration,
+        "offered_per_s": round(args.devices * args.rate, 1),
+        "cpu_percent": round(100 * (cpu1 - cpu0) / (t_end - t_start), 1),
+        "rss_mb": round(rss, 1),
+        "peak_rss_mb": round(peak, 1),
+    }
+    result.update(analyze(workdir, fleet.epoch, t_start, t_end, fleet.sent_by_ip()))
+    if not args.keep:
+        subprocess.run(["rm", "-rf", workdir])
+    else:
+        result["workdir"] = workdir
+    return result
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                             capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# --- DECODIFICACIÓN (ruta rápida vs json.loads) ---
+def load_payloads(path):
+    """Payloads del firmware rearmados desde los registros guardados (encode_json)"""
+    payloads = []
+    for _, seg in list_segments(path):
+        with open_log(seg, "rb") as f:
+            for line in f:
+                try:
+                    payload = encode_json(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+                if payload is not None:
+                    payloads.append(payload)
+                if len(payloads) >= DECODE_MAX:
+                    return payloads
+    return payloads
+
+
+def time_per_record(fn, payloads):
+    best = float("inf")
+    for _ in range(DECODE_REPEAT):
+        t0 = time.perf_counter()
+        for p in payloads:
+            fn(p)
+        best = min(best, time.perf_counter() - t0)
+    return round(best / len(payloads) * 1e6, 3)
+
+
+def run_decode(path):
+    """
+    µs por registro de json.loads, decode_payload genérico y con la ruta
+    rápida sobre tráfico grabado; verifica que ambas rutas den el mismo registro.
+    """
+    payloads = load_payloads(path)
+    if not payloads:
+        print(f"⚠️ {path}: no hay registros BMI270 RAW/RMS ni BME688 RAW para medir")
+        return None
+    fast = sum(1 for p in payloads if decode_fast_json(p) is not None)
+    mismatches = sum(1 for p in payloads if decode_payload(p) != [json.loads(p)])
+    result = {
+        "mode": "decode",
+        "devices": None,
+        "rate": None,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "file": path,
+        "records": len(payloads),
+        "fast_path": fast,
+        "mismatches": mismatches,
+        "json_loads_us": time_per_record(json.loads, payloads),
+    }
+    protocol.FAST_JSON = False
+    result["generic_us"] = time_per_record(decode_payload, payloads)
+    protocol.FAST_JSON = True
+    result["fast_us"] = time_per_record(decode_payload, payloads)
+    return result
+
+
+def report_decode(r, old):
+    saving = 1 - r["fast_us"] / r["generic_us"]
+    print(f"📊 [decode] {r['records']} registros de {r['file']} | ruta rápida {r['fast_path']} "
+          f"| distintos de json.loads: {r['mismatches']}")
+    print(f"    json.loads {r['json_loads_us']} µs | decode_payload genérico {r['generic_us']} µs | "
+          f"con ruta rápida {r['fast_us']} µs{delta(r, old, 'fast_us')} ({100 * saving:.0f}% menos CPU por registro)")
+    if old is not None:
+        print(f"    comparado con {old.get('commit')} del {old.get('date')}")
+
+
+# --- RESULTADOS ---
+def load_previous(path):
+    """Última corrida guardada de cada (modo, dispositivos, tasa)"""
+    previous = {}
+    if not os.path.exists(path):
+        return previous
+    with open(path) as f:
+        for line in f:
+            try:
+                r = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            previous[(r["mode"], r["devices"], r["rate"])] = r
+    return previous
+
+
+def delta(new, old, key):
+    if old is None or old.get(key) in (None, 0) or new.get(key) is None:
+        return ""
+    return f" ({100 * (new[key] - old[key]) / old[key]:+.0f}%)"
+
+
+def report(r, old):
+    lat = r["latency_ms"]
+    print(f"📊 [{r['mode']}] {r['records_per_s']} reg/s{delta(r, old, 'records_per_s')} "
+          f"de {r['offered_per_s']} ofrecidos | pérdida {100 * r['loss']:.2f}% "
+          f"(peor dispositivo {100 * r['loss_max_device']:.2f}%)")
+    print(f"    latencia p50/p95/p99: {lat['p50']} / {lat['p95']} / {lat['p99']} ms | "
+          f"CPU {r['cpu_percent']}%{delta(r, old, 'cpu_percent')} | "
+          f"RSS {r['rss_mb']} MB (pico {r['peak_rss_mb']}){delta(r, old, 'peak_rss_mb')}")
+    if old is not None:
+        print(f"    comparado con {old.get('commit')} del {old.get('date')}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de ingesta con la flota simulada")
+    parser.add_argument("--modes", nargs="+", choices=sorted(MODES), default=list(DEFAULT_MODES),
+                        help="Modos a medir ('gui' requiere PyQt5)")
+    parser.add_argument("--devices", type=int, default=10, help="Dispositivos virtuales")
+    parser.add_argument("--rate", type=float, default=100.0, help="Muestras/s por dispositivo")
+    parser.add_argument("--sensor", choices=("BMI270", "BME688"), default="BMI270")
+    parser.add_argument("--duration", type=float, default=10.0, help="Segundos medidos por modo")
+    parser.add_argument("--same-ip", action="store_true", help="Todos desde 127.0.0.1")
+    parser.add_argument("--results", default=RESULTS_FILE, help="Historial de corridas (JSONL)")
+    parser.add_argument("--keep", action="store_true", help="Conservar los directorios de datos")
+    parser.add_argument("--decode", nargs="?", const=DATA_FILE, metavar="JSONL",
+                        help="Solo medir la decodificación (ruta rápida vs json.loads) sobre un archivo grabado")
+    parser.add_argument("--gui-worker", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.gui_worker:
+        gui_worker_main()
+        sys.exit(0)
+
+    previous = load_previous(args.results)
+    if args.decode:
+        result = run_decode(args.decode)
+        if result is None:
+            sys.exit(1)
+        report_decode(result, previous.get(("decode", None, None)))
+        with open(args.results, "a") as f:
+            f.write(json.dumps(result) + "\n")
+        print(f"📂 Resultados agregados a {args.results}")
+        sys.exit(0)
+
+    print(f"🚀 Benchmark: {args.devices} dispositivos x {args.rate:g} muestras/s, "
+          f"{args.duration:g} s por modo")
+    for name in args.modes:
+        result = run_mode(name, args)
+        if result is None:
+            continue
+        report(result, previous.get((name, args.devices, args.rate)))
+        with open(args.results, "a") as f:
+            f.write(json.dumps(result) + "\n")
+    print(f"📂 Resultados agregados a {args.results}")
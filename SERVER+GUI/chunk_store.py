@@ -0,0 +1,328 @@
+import argparse
+import json
+import os
+import re
+import time
+from datetime import datetime
+import numpy as np
+from jsonl_index import record_time
+from segments import list_segments, open_log
+
+# --- CONFIGURACIÓN ---
+CHUNK_ROWS = 4096       # Muestras por bloque antes de volcarlo a disco
+CHUNK_MAX_AGE = 60.0    # Segundos máximos que un bloque parcial espera en memoria
+INDEX_NAME = "chunks.jsonl"
+
+# Campos que identifican la serie (van en la ruta, no en las columnas)
+KEY_FIELDS = ("sensor", "type", "source_ip", "protocol", "timestamp_server", "timestamp")
+
+# Layout en disco:
+#   <root>/<source_ip>/<sensor>_<type>/chunk_000001.npy   (array estructurado)
+#   <root>/<source_ip>/<sensor>_<type>/chunks.jsonl       (una cabecera por bloque)
+#   <root>/<source_ip>/<sensor>_<type>.v2/...             (misma serie con otro esquema)
+# Columna 't' = epoch del servidor (float64). El resto, float64 (enteros como
+# seq o uptime_ms son exactos hasta 2^53 y un campo que empieza entero y
+# después trae decimales no se trunca); ausentes = NaN. Los registros sin
+# timestamp válido no se guardan (se cuentan en ChunkStore.skipped).
+# Si aparecen campos nuevos (cambio de firmware), la serie sigue en una
+# versión nueva con las columnas anteriores más las nuevas; todos los bloques
+# de un directorio comparten dtype.
+
+
+def _safe(name):
+    return re.sub(r'[^A-Za-z0-9._-]', '_', str(name))
+
+
+def _chunk_ids(path):
+    if not os.path.isdir(path):
+        return []
+    return [int(m.group(1)) for m in (re.match(r'chunk_(\d+)\.npy$', n) for n in os.listdir(path)) if m]
+
+
+def _series_dtype(dtypes):
+    return np.dtype([("t", "<f8")] + list(dtypes.items()))
+
+
+def _numeric_fields(record):
+    """{campo: dtype} de los valores numéricos del registro (fuera de KEY_FIELDS)"""
+    return {k: "<f8" for k, v in record.items()
+            if k not in KEY_FIELDS and isinstance(v, (int, float)) and not isinstance(v, bool)}
+
+
+def _series_path(base, dtype):
+    """Primera versión de la serie cuyo último bloque tiene este dtype (o una vacía)"""
+    version, path = 1, base
+    while True:
+        ids = _chunk_ids(path)
+        if not ids or np.load(os.path.join(path, f"chunk_{max(ids):06d}.npy"), mmap_mode="r").dtype == dtype:
+            return path
+        version += 1
+        path = f"{base}.v{version}"
+
+
+# --- BUFFER DE UNA SERIE ---
+class _SeriesBuffer:
+    def __init__(self, path, dtypes, keys):
+        self.path = path
+        self.dtypes = dtypes
+        self.fields = list(dtypes)
+        self.dtype = _series_dtype(dtypes)
+        self.keys = set(keys)   # Claves ya vistas: un registro con otras obliga a revisar el esquema
+        self.missing = (float("nan"),) * len(self.fields)
+        self.rows = []
+        self.dropped = 0
+        self.opened = time.monotonic()
+        os.makedirs(path, exist_ok=True)
+        self.next_id = max(_chunk_ids(path), default=0) + 1
+
+    def append(self, t, record):
+        get = record.get
+        self.rows.append((t,) + tuple(m if get(f) is None else get(f)
+                                      for f, m in zip(self.fields, self.missing)))
+
+    def flush(self):
+        if not self.rows:
+            return
+        rows, self.rows = self.rows, []
+        self.opened = time.monotonic()
+        try:
+            arr = np.array(rows, dtype=self.dtype)
+        except (ValueError, TypeError, OverflowError):
+            # Algún valor no convertible (texto, lista...): se descartan solo esas filas
+            good = [row for row in rows if self._castable(row)]
+            self.dropped += len(rows) - len(good)
+            print(f"⚠️ [CHUNKS] {len(rows) - len(good)} muestras con valores no numéricos "
+                  f"descartadas en {self.path}")
+            if not good:
+                return
+            arr = np.array(good, dtype=self.dtype)
+        arr = arr[np.argsort(arr["t"], kind="stable")]  # searchsorted exige orden
+
+        name = f"chunk_{self.next_id:06d}.npy"
+        self.next_id += 1
+        tmp = os.path.join(self.path, name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, arr)
+        os.replace(tmp, os.path.join(self.path, name))
+
+        # Cabecera del bloque: rango temporal, cantidad y min/max por campo
+        header = {
+            "file": name,
+            "count": int(len(arr)),
+            "t_min": float(arr["t"].min()),
+            "t_max": float(arr["t"].max()),
+            "min": {},
+            "max": {},
+        }
+        for f in self.fields:
+            col = arr[f]
+            if col.dtype.kind == "f":
+                col = col[~np.isnan(col)]
+            if len(col):
+                header["min"][f] = col.min().item()
+                header["max"][f] = col.max().item()
+        with open(os.path.join(self.path, INDEX_NAME), "a") as f:
+            f.write(json.dumps(header) + "\n")
+
+    def _castable(self, row):
+        try:
+            np.array([row], dtype=self.dtype)
+        except (ValueError, TypeError, OverflowError):
+            return False
+        return True
+
+
+# --- ESCRITOR (SINK PARA BatchedWriter) ---
+class ChunkStore:
+    """
+    Backend columnar: agrupa las muestras por serie (IP + sensor + tipo) y
+    las vuelca como bloques .npy de tamaño fijo con una cabecera por bloque.
+    Implementa la misma interfaz que JsonlSink (write_batch/flush/close).
+    """
+
+    def __init__(self, root, chunk_rows=CHUNK_ROWS, max_age=CHUNK_MAX_AGE):
+        self.root = root
+        self.chunk_rows = chunk_rows
+        self.max_age = max_age
+        self.series = {}
+        self.skipped = 0        # Registros sin timestamp válido (no se pueden ubicar en el tiempo)
+        os.makedirs(root, exist_ok=True)
+
+    def _series_for(self, record):
+        key = (record.get("source_ip", "unknown"), record.get("sensor", "UNKNOWN"), record.get("type", "RAW"))
+        buf = self.series.get(key)
+        if buf is not None and buf.keys.issuperset(record.keys()):
+            return buf
+        new = _numeric_fields(record)
+        if buf is not None:
+            buf.keys.update(record.keys())
+            if new.keys() <= buf.dtypes.keys():
+                return buf  # Solo claves no numéricas nuevas: el esquema no cambia
+            # Campos numéricos nuevos: lo acumulado se cierra con el esquema anterior
+            buf.flush()
+            new = dict(buf.dtypes, **{k: v for k, v in new.items() if k not in buf.dtypes})
+        base = os.path.join(self.root, _safe(key[0]), f"{_safe(key[1])}_{_safe(key[2])}")
+        keys = record.keys() if buf is None else buf.keys
+        buf = self.series[key] = _SeriesBuffer(_series_path(base, _series_dtype(new)), new, keys)
+        return buf
+
+    def write_batch(self, records):
+        for record in records:
+            t = record_time(record)
+            if t is None:
+                self.skipped += 1
+                if self.skipped == 1:
+                    print("⚠️ [CHUNKS] Registro sin timestamp válido: se omite")
+                continue
+            buf = self._series_for(record)
+            buf.append(t, record)
+            if len(buf.rows) >= self.chunk_rows:
+                buf.flush()
+
+        # Bloques parciales demasiado viejos también se vuelcan
+        now = time.monotonic()
+        for buf in self.series.values():
+            if buf.rows and now - buf.opened >= self.max_age:
+                buf.flush()
+
+    def flush(self, fsync=False):
+        # Los bloques se escriben completos y de forma atómica (tmp + rename);
+        # no hay buffer de archivo que vaciar entre lotes
+        pass
+
+    def close(self):
+        for buf in self.series.values():
+            buf.flush()
+
+
+# --- LECTOR ---
+class ChunkReader:
+    """Consultas por rango temporal sobre los bloques, con np.load(mmap_mode='r')"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def list_series(self):
+        """[(source_ip, 'SENSOR_TYPE'), ...]"""
+        out = []
+        if not os.path.isdir(self.root):
+            return out
+        for ip in sorted(os.listdir(self.root)):
+            ip_dir = os.path.join(self.root, ip)
+            if not os.path.isdir(ip_dir):
+                continue
+            for series in sorted(os.listdir(ip_dir)):
+                if os.path.isfile(os.path.join(ip_dir, series, INDEX_NAME)):
+                    out.append((ip, series))
+        return out
+
+    def headers(self, source_ip, series):
+        path = os.path.join(self.root, _safe(source_ip), series)
+        with open(os.path.join(path, INDEX_NAME)) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def iter_range(self, source_ip, series, t_start=None, t_end=None):
+        """
+        Devuelve vistas (sin copia) de cada bloque que cae en [t_start, t_end].
+        Las cabeceras permiten saltarse los bloques fuera de rango sin abrirlos.
+        """
+        t_start = -np.inf if t_start is None else t_start
+        t_end = np.inf if t_end is None else t_end
+        path = os.path.join(self.root, _safe(source_ip), series)
+        for h in self.headers(source_ip, series):
+            if h["t_max"] < t_start or h["t_min"] > t_end:
+                continue
+            arr = np.load(os.path.join(path, h["file"]), mmap_mode="r")
+            t = arr["t"]
+            lo = np.searchsorted(t, t_start, side="left")
+            hi = np.searchsorted(t, t_end, side="right")
+            if hi > lo:
+                yield arr[lo:hi]
+
+    def read_range(self, source_ip, series, t_start=None, t_end=None):
+        """Como iter_range pero concatena en un único array (esto sí copia)"""
+        parts = list(self.iter_range(source_ip, series, t_start, t_end))
+        if not parts:
+            return None
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+# --- CONVERSIÓN ---
+def convert_jsonl(jsonl_path, root, chunk_rows=CHUNK_ROWS):
+    """Migra un sensor_data.jsonl existente (y sus segmentos, comprimidos o no) al formato por bloques"""
+    store = ChunkStore(root, chunk_rows=chunk_rows, max_age=float("inf"))
+    batch, total, bad = [], 0, 0
+    for _, path in list_segments(jsonl_path):
+        with open_log(path, "rb") as f:
+            for line in f:
+                try:
+                    batch.append(json.loads(line))
+                except json.JSONDecodeError:
+                    bad += 1
+                    continue
+                if len(batch) >= 10000:
+                    store.write_batch(batch)
+                    total += len(batch)
+                    batch = []
+    store.write_batch(batch)
+    total += len(batch)
+    store.close()
+    # Sin timestamp válido no se pueden ubicar en un bloque: cuentan como inválidas
+    return total - store.skipped, bad + store.skipped
+
+
+def export_jsonl(root, out_path, source_ip=None, series=None, t_start=None, t_end=None):
+    """Exporta bloques a JSONL (formato de intercambio)"""
+    reader = ChunkReader(root)
+    n = 0
+    with open(out_path, "w") as out:
+        for ip, ser in reader.list_series():
+            if (source_ip and ip != _safe(source_ip)) or (series and ser != series):
+                continue
+            sensor, _, dtype = ser.partition("_")
+            dtype = dtype.split(".v")[0]  # Versiones de esquema: BMI270_RAW.v2
+            for block in reader.iter_range(ip, ser, t_start, t_end):
+                names = [n_ for n_ in block.dtype.names if n_ != "t"]
+                for row in block:
+                    rec = {"sensor": sensor, "type": dtype, "source_ip": ip,
+                           "timestamp_server": datetime.fromtimestamp(float(row["t"])).isoformat()}
+                    for k in names:
+                        v = row[k].item()
+                        if not (isinstance(v, float) and v != v):  # omitimos NaN
+                            rec[k] = v
+                    out.write(json.dumps(rec) + "\n")
+                    n += 1
+    return n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Almacenamiento columnar por bloques (.npy)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_conv = sub.add_parser("convert", help="Migrar sensor_data.jsonl (y sus segmentos) a bloques")
+    p_conv.add_argument("jsonl")
+    p_conv.add_argument("--out", default="sensor_chunks")
+    p_conv.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+
+    p_exp = sub.add_parser("export", help="Exportar bloques a JSONL")
+    p_exp.add_argument("--root", default="sensor_chunks")
+    p_exp.add_argument("--out", default="export.jsonl")
+    p_exp.add_argument("--ip")
+    p_exp.add_argument("--series", help="Ej: BMI270_RAW")
+
+    p_ls = sub.add_parser("list", help="Listar series y bloques")
+    p_ls.add_argument("--root", default="sensor_chunks")
+
+    args = parser.parse_args()
+    if args.cmd == "convert":
+        total, bad = convert_jsonl(args.jsonl, args.out, args.chunk_rows)
+        print(f"✅ {total} registros convertidos a {args.out} ({bad} líneas inválidas)")
+    elif args.cmd == "export":
+        n = export_jsonl(args.root, args.out, args.ip, args.series)
+        print(f"✅ {n} registros exportados a {args.out}")
+    elif args.cmd == "list":
+        reader = ChunkReader(args.root)
+        for ip, ser in reader.list_series():
+            hs = reader.headers(ip, ser)
+            count = sum(h["count"] for h in hs)
+            print(f"{ip}/{ser}: {len(hs)} bloques, {count} muestras")
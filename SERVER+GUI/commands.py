@@ -0,0 +1,213 @@
+import itertools
+import json
+import queue
+import threading
+import time
+from metrics import REGISTRY
+
+# --- CONFIGURACIÓN ---
+ACK_TIMEOUT = 1.0            # Segundos sin ack antes de reenviar el comando
+ACK_RETRIES = 3              # Reenvíos (mismo id) antes de darlo por fallido
+FIRST_RECORD_TIMEOUT = 5.0   # Segundos esperando el primer registro con la nueva configuración
+
+# Límites de los histogramas de comandos (segundos)
+CMD_BUCKETS = (1e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COMMAND_RTT = REGISTRY.histogram("command_rtt_seconds", "Primer envío del comando hasta el ack (con reintentos)",
+                                 ("source_ip",), buckets=CMD_BUCKETS)
+COMMAND_FIRST_RECORD = REGISTRY.histogram("command_first_record_seconds",
+                                          "Envío del comando hasta el primer registro con la nueva configuración",
+                                          ("source_ip",), buckets=CMD_BUCKETS)
+COMMANDS = REGISTRY.counter("commands_total", "Comandos de configuración por resultado", ("status",))
+
+# Protocolo con la placa (una línea JSON por mensaje, terminada en '\n'):
+#   -> {"cmd":"config","id":N,"sensor":..,...}
+#   <- {"ack":N,"status":"ok|error","next_seq":S,"uptime_ms":..,"config":{lo aplicado}}
+# next_seq es el seq de la primera muestra que sale con la nueva configuración.
+
+
+class _Command:
+    __slots__ = ("id", "ip", "config", "group", "payload", "sent", "first_sent", "tries", "rtt", "next_seq", "acked")
+
+    def __init__(self, cid, ip, config, group):
+        self.id = cid
+        self.ip = ip
+        self.config = config
+        self.group = group
+        self.payload = (json.dumps(dict(config, cmd="config", id=cid), separators=(",", ":")) + "\n").encode("utf-8")
+        self.sent = self.first_sent = None
+        self.tries = 0
+        self.rtt = None
+        self.next_seq = None
+        self.acked = None
+
+
+class CommandChannel:
+    """
+    Cola de comandos de configuración hacia las placas, fuera del hilo de la
+    GUI y de los receptores. Cada comando lleva un id; la placa responde con
+    un ack que trae la configuración aplicada. Sin ack en ACK_TIMEOUT se
+    reenvía con el mismo id (la placa lo aplica de nuevo, es idempotente).
+
+    Por comando se mide el RTT (primer envío -> ack, reintentos incluidos) y el tiempo hasta el primer
+    registro con la nueva configuración (seq >= next_seq del ack). Los
+    comandos enviados juntos (a toda la flota) forman un grupo y se resumen
+    cuando el último termina.
+
+    send(addr, bytes) -> bool es el envío no bloqueante de TcpIngestServer;
+    resolve(ip) -> addr la conexión de control actual de la placa (puede
+    cambiar entre reintentos); on_result(dict) recibe cada resultado.
+    """
+
+    def __init__(self, send, resolve, on_result, timeout=ACK_TIMEOUT, retries=ACK_RETRIES,
+                 first_record_timeout=FIRST_RECORD_TIMEOUT):
+        self.send = send
+        self.resolve = resolve
+        self.on_result = on_result
+        self.timeout = timeout
+        self.retries = retries
+        self.first_record_timeout = first_record_timeout
+        self.inbox = queue.Queue()
+        self.pending = {}      # id -> _Command esperando ack
+        self.awaiting = {}     # source_ip -> _Command esperando su primer registro
+        self.groups = {}       # grupo -> [comandos pendientes, resultados, inicio]
+        self._ids = itertools.count(1)
+        self._groups = itertools.count(1)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="commands", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.inbox.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    # --- API (cualquier hilo) ---
+    def submit(self, ips, config):
+        """Encola el comando para cada placa de 'ips'; devuelve los ids asignados"""
+        group = next(self._groups) if len(ips) > 1 else None
+        cmds = [_Command(next(self._ids), ip, config, group) for ip in ips]
+        if group is not None:
+            with self._lock:
+                self.groups[group] = [len(cmds), [], time.monotonic()]
+        for cmd in cmds:
+            self.inbox.put(cmd)
+        return [cmd.id for cmd in cmds]
+
+    def on_ack(self, ip, ack):
+        """Línea {"ack":..} recibida por TCP (hilo de ingesta)"""
+        now = time.monotonic()
+        with self._lock:
+            cmd = self.pending.get(ack.get("ack"))
+            if cmd is None or cmd.ip != ip:
+                return  # Ack duplicado de un reintento o de un comando ya vencido
+            del self.pending[cmd.id]
+        # Desde el primer envío: el ack puede ser del intento anterior a un reintento,
+        # y medir desde el último haría ver más rápidos justo a los comandos que fallaron
+        cmd.rtt = now - cmd.first_sent
+        cmd.acked = ack
+        COMMAND_RTT.observe(cmd.rtt, ip)
+        if ack.get("status") != "ok":
+            self._finish(cmd, "error")
+            return
+        cmd.next_seq = ack.get("next_seq")
+        with self._lock:
+            previous = self.awaiting.pop(ip, None)
+            self.awaiting[ip] = cmd
+        if previous is not None:
+            self._finish(previous, "superseded")
+
+    def on_record(self, record):
+        """Registro recibido (antes de encolarlo al escritor); barato si nada espera"""
+        if not self.awaiting:
+            return
+        ip = record.get("source_ip")
+        cmd = self.awaiting.get(ip)
+        if cmd is None:
+            return
+        seq = record.get("seq")
+        if seq is not None and cmd.next_seq is not None and seq < cmd.next_seq:
+            return  # Aún en vuelo con la configuración anterior
+        with self._lock:
+            if self.awaiting.get(ip) is not cmd:
+                return
+            del self.awaiting[ip]
+        first = time.monotonic() - cmd.first_sent
+        COMMAND_FIRST_RECORD.observe(first, ip)
+        self._finish(cmd, "ok", first_record=first)
+
+    # --- HILO DE COMANDOS ---
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                cmd = self.inbox.get(timeout=0.1)
+            except queue.Empty:
+                cmd = None
+            if cmd is not None:
+                self._transmit(cmd)
+            self._check_timeouts()
+
+    def _transmit(self, cmd):
+        addr = self.resolve(cmd.ip)
+        cmd.tries += 1
+        cmd.sent = time.monotonic()
+        if cmd.first_sent is None:
+            cmd.first_sent = cmd.sent
+        # Pendiente antes de enviar: el ack puede llegar antes de que send() vuelva.
+        # Sin conexión de control el intento igual cuenta (la placa puede
+        # reconectar antes del próximo reintento)
+        with self._lock:
+            self.pending[cmd.id] = cmd
+        if addr is not None:
+            self.send(addr, cmd.payload)
+
+    def _check_timeouts(self):
+        now = time.monotonic()
+        retry, failed, stale = [], [], []
+        with self._lock:
+            for cmd in list(self.pending.values()):
+                if now - cmd.sent < self.timeout:
+                    continue
+                del self.pending[cmd.id]
+                (retry if cmd.tries <= self.retries else failed).append(cmd)
+            for ip, cmd in list(self.awaiting.items()):
+                if now - cmd.first_sent >= self.first_record_timeout:
+                    del self.awaiting[ip]
+                    stale.append(cmd)
+        for cmd in retry:
+            self._transmit(cmd)
+        for cmd in failed:
+            self._finish(cmd, "timeout")
+        for cmd in stale:
+            self._finish(cmd, "no_data")
+
+    # --- RESULTADOS ---
+    def _finish(self, cmd, status, first_record=None):
+        COMMANDS.inc(status)
+        result = {"id": cmd.id, "source_ip": cmd.ip, "status": status, "tries": cmd.tries,
+                  "config": cmd.acked.get("config") if cmd.acked else None}
+        if cmd.rtt is not None:
+            result["rtt_ms"] = round(cmd.rtt * 1000, 1)
+        if first_record is not None:
+            result["first_record_ms"] = round(first_record * 1000, 1)
+        self.on_result(result)
+        if cmd.group is None:
+            return
+        with self._lock:
+            group = self.groups.get(cmd.group)
+            if group is None:
+                return
+            group[0] -= 1
+            group[1].append(result)
+            if group[0]:
+                return
+            del self.groups[cmd.group]
+        _, results, started = group
+        ok = sum(r["status"] == "ok" for r in results)
+        self.on_result({"group": cmd.group, "ok": ok, "total": len(results),
+                        "elapsed_ms": round((time.monotonic() - started) * 1000, 1)})
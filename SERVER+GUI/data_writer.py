@@ -0,0 +1,405 @@
+import csv
+import json
+import os
+import queue
+import threading
+import time
+from jsonl_index import JsonlIndexer
+from metrics import FLUSH_SECONDS, WRITE_SECONDS
+from segments import SegmentCompressor, list_segments, plain_path, segment_name
+
+# --- POLÍTICAS DE DURABILIDAD ---
+# none  : el buffer de Python/SO decide cuándo llega a disco
+# flush : vaciamos el buffer de Python al SO tras cada lote
+# fsync : flush por lote + os.fsync() cada FSYNC_INTERVAL_MS
+DURABILITY_NONE = "none"
+DURABILITY_FLUSH = "flush"
+DURABILITY_FSYNC = "fsync"
+DURABILITIES = (DURABILITY_NONE, DURABILITY_FLUSH, DURABILITY_FSYNC)
+
+# --- MODOS DE ECO EN CONSOLA ---
+# off    : sin eco
+# sample : imprime 1 de cada N registros
+# rate   : imprime como máximo N registros por segundo
+ECHO_OFF = "off"
+ECHO_SAMPLE = "sample"
+ECHO_RATE = "rate"
+ECHO_MODES = (ECHO_OFF, ECHO_SAMPLE, ECHO_RATE)
+
+
+# --- SINK JSONL ---
+class JsonlSink:
+    """
+    Mantiene el archivo JSONL abierto y escribe lotes completos.
+    Con index=True alimenta además el índice temporal (<archivo>.idx).
+    """
+
+    def __init__(self, filename, buffer_size=1 << 16, index=False):
+        self.filename = filename
+        self._f = open(filename, 'a', buffering=buffer_size)
+        self._offset = self._f.tell()
+        self.indexer = JsonlIndexer(filename) if index else None
+
+    def write_batch(self, records):
+        lines = [json.dumps(r) + "\n" for r in records]
+        self._f.write("".join(lines))
+        if self.indexer:
+            # json.dumps produce ASCII (ensure_ascii): largo del str == bytes
+            offset = self._offset
+            for record, line in zip(records, lines):
+                self.indexer.add(record, offset, len(line))
+                offset += len(line)
+            self._offset = offset
+        return lines
+
+    @property
+    def size(self):
+        """Bytes escritos en el archivo (incluye lo que aún está en el buffer)"""
+        return self._offset if self.indexer else self._f.tell()
+
+    def flush(self, fsync=False):
+        self._f.flush()
+        if fsync:
+            os.fsync(self._f.fileno())
+
+    def close(self):
+        try:
+            self.flush(fsync=True)
+        finally:
+            self._f.close()
+            if self.indexer:
+                self.indexer.close()
+
+
+# --- SINK JSONL SEGMENTADO ---
+class RotatingJsonlSink:
+    """
+    Igual que JsonlSink pero escribe en segmentos (sensor_data-AAAAMMDDTHHMMSS.jsonl)
+    que rotan por tamaño y/o por tiempo (alineado: 3600 = cada hora en punto).
+    Los segmentos cerrados se comprimen y purgan en un hilo aparte (SegmentCompressor).
+    """
+
+    def __init__(self, base, rotate_bytes=0, rotate_seconds=3600, compression="gzip",
+                 retention_bytes=0, retention_seconds=0, index=True, buffer_size=1 << 16, log=print):
+        self.base = base
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.index = index
+        self.buffer_size = buffer_size
+        self.log = log
+        self.compressor = SegmentCompressor(base, compression, retention_bytes, retention_seconds, log=log)
+
+        # Segmentos sin comprimir de una ejecución anterior: a la cola del compresor
+        for _, path in list_segments(base):
+            if path != base and path == plain_path(path):
+                self.compressor.submit(path)
+
+        self.sink = None
+        self._open_segment()
+
+    @property
+    def filename(self):
+        return self.sink.filename
+
+    def _open_segment(self):
+        now = time.time()
+        self.sink = JsonlSink(segment_name(self.base, now), buffer_size=self.buffer_size, index=self.index)
+        self.opened_at = now
+        self._period = int(now // self.rotate_seconds) if self.rotate_seconds else None
+
+    def _should_rotate(self):
+        if self.rotate_bytes and self.sink.size >= self.rotate_bytes:
+            return True
+        if self.rotate_seconds and int(time.time() // self.rotate_seconds) != self._period:
+            return True
+        return False
+
+    def rotate(self):
+        old = self.sink
+        old.close()
+        self._open_segment()
+        self.compressor.submit(old.filename)
+        self.log(f"🔄 [ROTACIÓN] Nuevo segmento: {self.sink.filename}")
+
+    def write_batch(self, records):
+        if self._should_rotate():
+            self.rotate()
+        return self.sink.write_batch(records)
+
+    def flush(self, fsync=False):
+        self.sink.flush(fsync)
+
+    def close(self):
+        self.sink.close()
+        self.compressor.stop()
+
+
+# --- SINK CSV ---
+# Columnas que van primero (si el registro las trae); el resto, en el orden del primer registro
+CSV_LEAD_COLUMNS = ("timestamp", "timestamp_server", "protocol", "source_ip", "sensor", "type")
+
+
+class _CsvFile:
+    def __init__(self, path, columns, buffer_size):
+        self.path = path
+        self.columns = columns
+        self._f = open(path, "a", newline="", buffering=buffer_size)
+        self._w = csv.writer(self._f)
+        if self._f.tell() == 0:
+            self._w.writerow(columns)
+
+    def write_rows(self, records):
+        cols = self.columns
+        self._w.writerows([[r.get(c, "") for c in cols] for r in records])
+
+
+class CsvSink:
+    """
+    Un archivo CSV abierto por esquema (sensor + tipo + columnas):
+    sensor_data_BMI270_RAW.csv, sensor_data_BME688_RAW.csv, ...
+    La cabecera se escribe una sola vez y el orden de columnas queda cacheado;
+    si el esquema cambia (p. ej. aparece 'seq') se abre sensor_data_BMI270_RAW_2.csv.
+    """
+
+    def __init__(self, filename, buffer_size=1 << 16):
+        self.stem, self.ext = os.path.splitext(filename)
+        self.buffer_size = buffer_size
+        self.files = {}       # frozenset(columnas) + sensor/tipo -> _CsvFile
+        self._by_keys = {}    # tuple(claves del dict) -> _CsvFile (atajo por orden de inserción)
+
+    def _file_for(self, record):
+        keys = tuple(record)
+        f = self._by_keys.get(keys)
+        if f is not None:
+            return f
+        schema = (record.get("sensor"), record.get("type"), frozenset(keys))
+        f = self.files.get(schema)
+        if f is None:
+            columns = [c for c in CSV_LEAD_COLUMNS if c in record] + \
+                      [c for c in keys if c not in CSV_LEAD_COLUMNS]
+            f = self.files[schema] = _CsvFile(self._path_for(record, columns), columns, self.buffer_size)
+        self._by_keys[keys] = f
+        return f
+
+    def _path_for(self, record, columns):
+        name = f"{self.stem}_{record.get('sensor', 'UNKNOWN')}_{record.get('type', 'RAW')}"
+        n = 1
+        while True:
+            path = f"{name}{self.ext}" if n == 1 else f"{name}_{n}{self.ext}"
+            if path in (f.path for f in self.files.values()):
+                n += 1
+                continue
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                return path
+            # Reutilizamos un archivo existente solo si su cabecera coincide
+            with open(path, newline="") as f:
+                if next(csv.reader(f), None) == columns:
+                    return path
+            n += 1
+
+    def write_batch(self, records):
+        groups = {}
+        for record in records:
+            groups.setdefault(self._file_for(record), []).append(record)
+        for f, rows in groups.items():
+            f.write_rows(rows)
+
+    def flush(self, fsync=False):
+        for f in self.files.values():
+            f._f.flush()
+            if fsync:
+                os.fsync(f._f.fileno())
+
+    def close(self):
+        for f in self.files.values():
+            try:
+                f._f.flush()
+                os.fsync(f._f.fileno())
+            finally:
+                f._f.close()
+        self.files = {}
+        self._by_keys = {}
+
+
+# --- ESCRITOR EN SEGUNDO PLANO ---
+class BatchedWriter:
+    """
+    Etapa de escritura dedicada: los hilos de red encolan registros en una
+    cola acotada y un único hilo los persiste por lotes (tamaño o tiempo).
+    """
+
+    def __init__(self, sinks, queue_size=10000, batch_size=500, flush_interval=0.5,
+                 durability=DURABILITY_FLUSH, fsync_interval_ms=1000,
+                 echo_mode=ECHO_OFF, echo_value=1):
+        self.sinks = list(sinks)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.fsync_interval = fsync_interval_ms / 1000.0
+        self.echo_mode = echo_mode
+        self.echo_value = echo_value
+
+        # Contadores: received/dropped los tocan todos los productores (TCP, parser
+        # UDP, colector de workers) bajo _count_lock; el resto solo el hilo escritor
+        self._count_lock = threading.Lock()
+        self.received = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.max_depth = 0
+
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._control = queue.Queue()  # Cambios de sinks: los aplica el hilo escritor
+        self._last_fsync = time.monotonic()
+        self._echo_count = 0
+        self._echo_window = 0.0
+        self._echo_in_window = 0
+
+    # --- PRODUCTORES (hilos de red) ---
+    def put(self, record):
+        """Encola sin bloquear. Devuelve False si la cola está llena (registro descartado)"""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._count_lock:
+                self.received += 1
+                self.dropped += 1
+            return False
+        with self._count_lock:
+            self.received += 1
+        return True
+
+    def set_sinks(self, sinks):
+        """
+        Reemplaza los sinks sin detener la ingesta: el hilo escritor termina el
+        lote en curso, cierra los sinks anteriores y sigue con los nuevos.
+        """
+        self._control.put(list(sinks))
+
+    # --- CICLO DE VIDA ---
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="batched_writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                print(f"⚠️ [WRITER] El hilo escritor sigue escribiendo tras {timeout:g} s; se espera otro tanto")
+                self._thread.join(timeout)
+            if self._thread.is_alive():
+                # Cerrar los sinks ahora sería escribir en archivos cerrados desde ese hilo
+                print("❌ [WRITER] El hilo escritor no terminó: los archivos quedan abiertos")
+                return
+        self._apply_control()
+        for sink in self.sinks:
+            sink.close()
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_max_depth": self.max_depth,
+            "queue_size": self.queue.maxsize,
+            "received": self.received,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+        }
+
+    # --- HILO ESCRITOR ---
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+                # Vaciamos lo que ya esté encolado sin volver a dormir
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            depth = self.queue.qsize() + len(batch)
+            if depth > self.max_depth:
+                self.max_depth = depth
+
+            now = time.monotonic()
+            if len(batch) >= self.batch_size or now >= deadline:
+                if batch:
+                    self._write(batch)
+                    batch = []
+                deadline = now + self.flush_interval
+                if self._stop_event.is_set() and self.queue.empty():
+                    break
+            elif self._stop_event.is_set() and self.queue.empty():
+                if batch:
+                    self._write(batch)
+                break
+
+    def _apply_control(self):
+        while True:
+            try:
+                sinks = self._control.get_nowait()
+            except queue.Empty:
+                return
+            for sink in self.sinks:
+                if sink in sinks:
+                    continue  # Sigue activo con la nueva configuración
+                try:
+                    sink.close()
+                except Exception as e:
+                    print(f"⚠️ [WRITER] Error cerrando {type(sink).__name__}: {e}")
+            self.sinks = sinks
+
+    def _write(self, batch):
+        self._apply_control()
+        lines = None
+        # El plazo de fsync se evalúa una vez por lote: o se sincronizan todos los sinks o ninguno
+        fsync = self.durability == DURABILITY_FSYNC and time.monotonic() - self._last_fsync >= self.fsync_interval
+        for sink in self.sinks:
+            name = type(sink).__name__
+            try:
+                t0 = time.perf_counter()
+                out = sink.write_batch(batch)
+                t1 = time.perf_counter()
+                WRITE_SECONDS.observe(t1 - t0, name)
+                if lines is None:
+                    lines = out
+                if self._sync(sink, fsync):
+                    FLUSH_SECONDS.observe(time.perf_counter() - t1, name)
+            except Exception as e:
+                print(f"⚠️ [WRITER] Error escribiendo lote en {name}: {e}")
+        if fsync:
+            self._last_fsync = time.monotonic()
+        self.written += len(batch)
+        self.batches += 1
+        if self.echo_mode != ECHO_OFF:
+            self._echo(batch, lines)
+
+    def _sync(self, sink, fsync):
+        """flush (y fsync si toca en este lote). True si se hizo algo"""
+        if self.durability == DURABILITY_NONE:
+            return False
+        sink.flush(fsync=fsync)
+        return True
+
+    def _echo(self, batch, lines):
+        for i, record in enumerate(batch):
+            if self.echo_mode == ECHO_SAMPLE:
+                self._echo_count += 1
+                if self._echo_count % max(1, self.echo_value):
+                    continue
+            elif self.echo_mode == ECHO_RATE:
+                now = time.monotonic()
+                if now - self._echo_window >= 1.0:
+                    self._echo_window = now
+                    self._echo_in_window = 0
+                if self._echo_in_window >= self.echo_value:
+                    continue
+                self._echo_in_window += 1
+            json_str = lines[i].rstrip("\n") if lines else json.dumps(record)
+            print(f"[{record.get('protocol')}] De {record.get('source_ip')}: {json_str}")
@@ -0,0 +1,168 @@
+import threading
+import time
+import numpy as np
+from ring_buffer import ChannelRings, RING_CAPACITY
+
+# --- CONFIGURACIÓN ---
+MIN_RING_CAPACITY = 1 << 12   # Piso por canal aunque el presupuesto no alcance (~40 s a 100 Hz)
+
+# --- MODO (ESQUEMA) DE UN REGISTRO ---
+# Lo que se grafica depende del tipo de datos que manda la placa; solo los
+# registros del dispositivo definen su modo (los derivados RMS_SRV/PEAK/FFT del
+# servidor se agregan a los buffers pero no lo cambian).
+def record_mode(record):
+    if "ax" in record:
+        return "BMI270"
+    if "temp" in record:
+        return "BME688"
+    if "rms" in record:
+        return "RMS"
+    return None
+
+
+# --- UN DISPOSITIVO ---
+class Device:
+    """
+    Estado de una placa: sus propios buffers por canal, el último registro,
+    el modo actual y el canal de control TCP (si está conectada).
+    'version' avanza con cada registro; 'schema_version' solo cuando cambia el modo.
+    """
+
+    def __init__(self, ip, capacity=RING_CAPACITY, dtype=np.float64, on_new_ring=None):
+        self.ip = ip
+        self.rings = ChannelRings(capacity=capacity, dtype=dtype, on_new=on_new_ring)
+        self.latest = None
+        self.mode = None
+        self.analysis_view = None     # "FFT" / "PEAK" si se le pidió análisis en el servidor
+        self.control = None           # (ip, puerto) de su conexión TCP de control
+        self.records = 0
+        self.last_seen = None
+        self.version = 0
+        self.schema_version = 0
+        self.spectrum = None          # (frecuencias, magnitudes) del último FFT
+        self.spectrum_version = 0
+
+    def add(self, record, t):
+        """Registro de la placa: buffers, último dato y posible cambio de modo"""
+        self.rings.append_record(record, t)
+        mode = record_mode(record)
+        if mode is not None and mode != self.mode:
+            self.mode = mode
+            self.schema_version += 1
+        self.latest = record
+        self.records += 1
+        self.last_seen = t
+        self.version += 1
+
+    def add_derived(self, record, t):
+        """Registro calculado en el servidor (RMS_SRV / PEAK / FFT): no cambia el modo"""
+        if record.get("type") == "FFT":
+            mag = np.asarray(record["mag"])
+            self.spectrum = (np.arange(len(mag)) * record["df"], mag)
+            self.spectrum_version += 1
+        else:
+            self.rings.append_record(record, t)
+        self.version += 1
+
+    def add_columns(self, columns, mode, count, t):
+        """Tramo ya separado por canal (feed compartido, ver shm_feed.split_samples)"""
+        for ch, (tc, vc) in columns.items():
+            self.rings[ch].extend(tc, vc)
+        if mode is not None and mode != self.mode:
+            self.mode = mode
+            self.schema_version += 1
+        self.records += count
+        self.last_seen = t
+        self.version += 1
+
+    def set_analysis_view(self, view):
+        if view != self.analysis_view:
+            self.analysis_view = view
+            self.schema_version += 1
+
+
+# --- REGISTRO DE DISPOSITIVOS ---
+class DeviceRegistry:
+    """
+    Dispositivos por source_ip. Los hilos de red agregan registros; la UI
+    recorre devices() y compara versiones para saber qué redibujar.
+    'version' avanza con cada registro de cualquier dispositivo.
+
+    Con budget_bytes, la memoria de todos los buffers se reparte entre los
+    canales reservados de todas las placas: cada uno tiene la potencia de 2
+    que cabe (entre MIN_RING_CAPACITY y 'capacity'), así agregar placas
+    achica la historia en memoria en vez de agotar la RAM. Lo más antiguo
+    se grafica desde los rollups.
+    """
+
+    def __init__(self, capacity=RING_CAPACITY, dtype=np.float64, budget_bytes=None):
+        self.capacity = capacity
+        self.dtype = dtype
+        self.budget_bytes = budget_bytes
+        self.ring_capacity = capacity
+        self.by_ip = {}
+        self.version = 0
+        self.default_view = None      # analysis_view para placas que aparezcan después de un broadcast
+        self._lock = threading.Lock()
+
+    def get(self, ip):
+        dev = self.by_ip.get(ip)
+        if dev is None:
+            with self._lock:
+                dev = self.by_ip.get(ip)
+                if dev is None:
+                    dev = Device(ip, self.ring_capacity, self.dtype,
+                                 on_new_ring=self._rebalance if self.budget_bytes else None)
+                    dev.analysis_view = self.default_view
+                    self.by_ip[ip] = dev
+        return dev
+
+    def devices(self):
+        return list(self.by_ip.values())
+
+    def _rebalance(self):
+        """Capacidad por canal según el presupuesto y la cantidad de buffers reservados"""
+        with self._lock:
+            devices = list(self.by_ip.values())
+            rings = sum(len(dev.rings.rings) for dev in devices)
+            # t (float64) + y, cada uno espejado (2x)
+            per_sample = 2 * (8 + np.dtype(self.dtype).itemsize)
+            fit = self.budget_bytes // max(1, rings * per_sample)
+            capacity = max(MIN_RING_CAPACITY, min(self.capacity, 1 << max(0, int(fit).bit_length() - 1)))
+            if capacity == self.ring_capacity:
+                return
+            self.ring_capacity = capacity
+        for dev in devices:
+            dev.rings.resize(capacity)
+
+    def add(self, record, t=None):
+        self.get(record.get("source_ip", "")).add(record, time.time() if t is None else t)
+        self.version += 1
+
+    def add_derived(self, record, t=None):
+        self.get(record.get("source_ip", "")).add_derived(record, time.time() if t is None else t)
+        self.version += 1
+
+    def add_columns(self, ip, columns, mode, count, t=None):
+        self.get(ip).add_columns(columns, mode, count, time.time() if t is None else t)
+        self.version += 1
+
+    # --- CANAL DE CONTROL ---
+    def connected(self, addr):
+        self.get(addr[0]).control = addr
+
+    def disconnected(self, addr):
+        dev = self.by_ip.get(addr[0])
+        if dev is not None and dev.control == addr:
+            dev.control = None
+
+    def set_controls(self, addrs):
+        """Conexiones de control informadas por el núcleo de ingesta: [(ip, puerto)]"""
+        by_ip = {addr[0]: addr for addr in addrs}
+        for dev in self.devices():
+            dev.control = by_ip.pop(dev.ip, None)
+        for addr in by_ip.values():
+            self.connected(addr)
+
+    def controllable(self):
+        return [d for d in self.devices() if d.control is not None]
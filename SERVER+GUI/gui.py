@@ -1,151 +1,315 @@
 import sys
-import socket
-import threading
-import json
 import time
-import csv
-import os
-from collections import deque
 from datetime import datetime
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QLabel, QComboBox, QSpinBox, 
                              QPushButton, QGroupBox, QRadioButton, QTextEdit, 
-                             QFrame, QScrollArea, QButtonGroup, QSizePolicy)
+                             QFrame, QScrollArea, QButtonGroup, QSizePolicy, QCheckBox)
 from PyQt5.QtCore import pyqtSignal, QObject, pyqtSlot, Qt, QTimer
 from PyQt5.QtGui import QFont, QColor, QPalette
+import numpy as np
 import pyqtgraph as pg
+from device_registry import DeviceRegistry
+from plot_engine import HISTORY_WINDOWS, RAW_WINDOW_MAX, DecimatedSeries, RollupCache, RollupSeries
+from analytics import DEFAULT_THRESHOLD
+from ingest_core import CORE_LOG, CoreClient, spawn_core
+from shm_feed import FeedReader, split_samples
+from metrics import METRICS_HOST, METRICS_PORT, REGISTRY, MetricsServer
 
 # --- CONFIGURACIÓN ---
-HOST = '0.0.0.0'
-PORT = 1234
-FILE_JSON = 'sensor_data.jsonl'
-FILE_CSV = 'sensor_data.csv'
+HISTORY_SAMPLES = 1 << 19   # Máximo de muestras por canal en memoria (~87 min a 100 Hz)
+HISTORY_BUDGET_MB = 128     # RAM para los buffers de todas las placas; con más placas cada canal guarda menos
+GUI_METRICS_PORT = METRICS_PORT + 1  # /metrics de la GUI (el servidor usa METRICS_PORT; 0 = sin endpoint)
+SPAWN_CORE = True           # Si no hay núcleo de ingesta corriendo, lanzarlo como servicio aparte
+SAVE_FORMATS = {"JSON": "jsonl", "CSV": "csv", "NPY": "chunks"}
 
-# Lock para escritura de archivos y acceso a datos compartidos
-data_lock = threading.Lock()
+# Métricas propias de la GUI: solo se registran en su proceso (el núcleo no dibuja cuadros)
+FEED_LOST = REGISTRY.counter("gui_feed_lost_total", "Muestras del feed sobrescritas antes de leerlas")
+FRAME_SECONDS = REGISTRY.histogram("gui_frame_seconds", "Duracion de un cuadro de update_plots")
 
-# --- WORKER DE RED OPTIMIZADO ---
+# --- CONEXIÓN CON EL NÚCLEO DE INGESTA ---
 class WorkerSignals(QObject):
     log_message = pyqtSignal(str)
     connection_status = pyqtSignal(str)
-
-class NetworkWorker(QObject):
-    def __init__(self):
+    alert_event = pyqtSignal(dict)   # Solo transiciones FIRING / RESOLVED (ver alerts.py)
+    core_stats = pyqtSignal(dict)    # Respuesta a request_stats()
+
+class CoreWorker(QObject):
+    """
+    Consumidor del núcleo de ingesta (ingest_core.py), que corre en su propio
+    proceso: las muestras llegan por el feed en memoria compartida y las
+    órdenes / eventos por el canal de control. Si no hay núcleo corriendo se
+    lanza como servicio aparte, así cerrar o reiniciar la GUI no detiene la
+    captura y el dibujo nunca frena la ingesta.
+    """
+
+    def __init__(self, spawn=SPAWN_CORE):
         super().__init__()
         self.signals = WorkerSignals()
-        self.running = True
-        self.tcp_client_socket = None
-        self.save_format = "JSON"
-        
-        # --- DATOS COMPARTIDOS (NO SEÑALES) ---
-        # Guardamos el último dato recibido para que la UI lo lea a su ritmo
-        self.latest_data = None
-        self.new_data_available = False
+        self.client = CoreClient(self.on_core_event, on_state=self.on_core_state,
+                                 spawn=self.spawn_core if spawn else None)
 
-    def set_save_format(self, fmt):
-        self.save_format = fmt
-
-    def process_data(self, data_dict, protocol, source_ip):
-        """Procesa, guarda y actualiza el estado compartido"""
+        # --- DATOS COMPARTIDOS (NO SEÑALES) ---
+        # Un dispositivo por source_ip, cada uno con sus buffers circulares por
+        # canal (reservados al primer uso), su último registro y su modo.
+        # La UI lee a su ritmo y compara versiones para saber qué redibujar
+        self.devices = DeviceRegistry(capacity=HISTORY_SAMPLES, dtype=np.float32,
+                                      budget_bytes=HISTORY_BUDGET_MB << 20)
+
+        # Feed: el hilo del cliente informa el nombre; el de la UI se adjunta y lee
+        self.feed = None
+        self.feed_name = None
+        self.feed_generation = 0      # Avanza con cada "hello" (el núcleo pudo reiniciarse)
+        self.feed_attached = -1
+        self.cursor = 0
+
+    def start(self):
+        self.client.start()
+        self.start_metrics()
+
+    def spawn_core(self):
+        spawn_core()
+        self.signals.log_message.emit(f"🚀 Núcleo de ingesta lanzado (salida en {CORE_LOG})")
+
+    def start_metrics(self):
+        if not GUI_METRICS_PORT:
+            return
         try:
-            # 1. Guardar en Disco (Persistencia)
-            timestamp = datetime.now().isoformat()
-            data_dict['timestamp'] = timestamp
-            data_dict['protocol'] = protocol
-            
-            # Usamos un lock breve para escribir archivo
-            with data_lock:
-                if self.save_format == "JSON":
-                    with open(FILE_JSON, 'a') as f:
-                        f.write(json.dumps(data_dict) + "\n")
-                elif self.save_format == "CSV":
-                    file_exists = os.path.isfile(FILE_CSV)
-                    with open(FILE_CSV, 'a', newline='') as f:
-                        keys = ['timestamp', 'protocol', 'sensor', 'type'] 
-                        for k in data_dict.keys():
-                            if k not in keys: keys.append(k)
-                        writer = csv.DictWriter(f, fieldnames=keys)
-                        if not file_exists: writer.writeheader()
-                        writer.writerow(data_dict)
-            
-            # 2. Actualizar dato compartido para la UI (Sin Bloqueos Fuertes)
-            self.latest_data = data_dict
-            self.new_data_available = True
-
-        except Exception as e:
-            pass # Evitar spam en log si falla escritura rápida
-
-    def start_servers(self):
-        threading.Thread(target=self.tcp_server_thread, daemon=True).start()
-        threading.Thread(target=self.udp_server_thread, daemon=True).start()
-        self.signals.log_message.emit(f"🚀 Servidores iniciados (Puerto {PORT})")
-
-    def tcp_server_thread(self):
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            try:
-                s.bind((HOST, PORT))
-                s.listen()
-            except Exception as e:
-                self.signals.log_message.emit(f"❌ Error TCP: {e}")
-                return
-
-            while self.running:
-                try:
-                    conn, addr = s.accept()
-                    self.tcp_client_socket = conn
-                    self.signals.connection_status.emit(f"TCP: {addr[0]}")
-                    self.signals.log_message.emit(f"🔵 Conectado: {addr[0]}")
-                    
-                    with conn:
-                        f = conn.makefile('r')
-                        while self.running:
-                            line = f.readline()
-                            if not line: break
-                            try:
-                                data = json.loads(line.strip())
-                                self.process_data(data, "TCP", addr[0])
-                            except json.JSONDecodeError:
-                                pass
-                    self.tcp_client_socket = None
-                    self.signals.connection_status.emit("Desconectado")
-                except Exception:
-                    pass
-
-    def udp_server_thread(self):
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            try:
-                s.bind((HOST, PORT))
-            except Exception:
-                return
-
-            while self.running:
-                try:
-                    data_bytes, addr = s.recvfrom(2048)
-                    if data_bytes:
-                        try:
-                            line = data_bytes.decode('utf-8', errors='replace').strip()
-                            data = json.loads(line)
-                            self.process_data(data, "UDP", addr[0])
-                        except json.JSONDecodeError:
-                            pass
-                except Exception:
-                    pass
-
-    def send_config(self, config):
-        if self.tcp_client_socket:
-            try:
-                msg = json.dumps(config) + "\n"
-                self.tcp_client_socket.sendall(msg.encode('utf-8'))
-                self.signals.log_message.emit(f"📤 Config enviada: {config['sensor']}")
-            except Exception as e:
-                self.signals.log_message.emit(f"❌ Error enviando: {e}")
+            server = MetricsServer(METRICS_HOST, GUI_METRICS_PORT).start()
+            self.signals.log_message.emit(f"📊 Métricas en http://{server.address[0]}:{server.address[1]}/metrics")
+        except OSError as e:
+            self.signals.log_message.emit(f"⚠️ Endpoint de métricas no disponible: {e}")
+
+    # --- EVENTOS DEL NÚCLEO (hilo del cliente) ---
+    def on_core_state(self, connected):
+        if connected:
+            self.signals.log_message.emit("🔗 Conectado al núcleo de ingesta")
+            return
+        self.feed_name = None
+        self.feed_generation += 1
+        self.devices.set_controls([])
+        self.signals.connection_status.emit("Núcleo desconectado")
+
+    def on_core_event(self, event):
+        kind = event.get("event")
+        if kind == "hello":
+            self.feed_name = event.get("feed")
+            self.feed_generation += 1
+            self.update_controls(event["controls"])
+            if self.feed_name is None:
+                self.signals.log_message.emit("⚠️ El núcleo corre sin feed compartido (--no-feed)")
+        elif kind == "controls":
+            self.update_controls(event["controls"])
+        elif kind == "log":
+            self.signals.log_message.emit(event["msg"])
+        elif kind == "alert":
+            self.signals.alert_event.emit(event["alert"])
+        elif kind == "spectrum":
+            self.devices.add_derived(event["record"])
+        elif kind == "stats":
+            self.signals.core_stats.emit(event)
+
+    def update_controls(self, addrs):
+        # Cada placa queda asociada a su propia conexión de control (la lleva el núcleo)
+        self.devices.set_controls([tuple(a) for a in addrs])
+        boards = self.devices.controllable()
+        if len(boards) == 1:
+            self.signals.connection_status.emit(f"TCP: {boards[0].ip}")
+        elif boards:
+            self.signals.connection_status.emit(f"TCP: {len(boards)} placas")
         else:
+            self.signals.connection_status.emit("Desconectado")
+
+    # --- FEED (hilo de la UI, una vez por cuadro) ---
+    def poll_feed(self):
+        """Pasa las muestras nuevas del anillo compartido a los buffers de cada placa"""
+        if self.feed_attached != self.feed_generation:
+            self.attach_feed()
+        if self.feed is None:
+            return
+        samples, self.cursor, lost = self.feed.since(self.cursor)
+        if lost:
+            FEED_LOST.inc(n=lost)
+        if len(samples):
+            now = time.time()
+            for ip, columns, mode, count in split_samples(samples):
+                self.devices.add_columns(ip, columns, mode, count, now)
+
+    def attach_feed(self):
+        generation, name = self.feed_generation, self.feed_name
+        self.feed_attached = generation
+        if self.feed is not None:
+            self.feed.close()
+            self.feed = None
+        if name is None:
+            return
+        try:
+            self.feed = FeedReader(name)
+        except (OSError, ValueError) as e:
+            self.signals.log_message.emit(f"❌ No se pudo leer el feed {name}: {e}")
+            return
+        # Lo que aún está en el anillo (~30 s) se grafica de entrada
+        self.cursor = max(0, self.feed.head() - self.feed.capacity)
+
+    # --- ÓRDENES AL NÚCLEO ---
+    def send(self, msg):
+        if not self.client.send(msg):
+            self.signals.log_message.emit("⚠️ Núcleo de ingesta no disponible.")
+
+    def send_config(self, config, target=None):
+        """Envía la configuración a la placa 'target' (source_ip) o a todas si es None"""
+        if target is None and not self.devices.controllable():
             self.signals.log_message.emit("⚠️ No hay conexión TCP para control.")
+            return
+        self.send({"op": "config", "config": config, "target": target})
+
+    def configure_analytics(self, source_ip=None, window_size=None, threshold=None):
+        self.send({"op": "analytics", "source_ip": source_ip, "window_size": window_size,
+                   "threshold": threshold})
+
+    def set_save_format(self, fmt):
+        # El cambio lo aplica el escritor del núcleo entre lotes; la ingesta no se detiene
+        self.send({"op": "storage", "format": SAVE_FORMATS[fmt]})
+
+    def request_stats(self):
+        self.client.send({"op": "stats"})
 
     def stop(self):
-        self.running = False
+        # Solo se desconecta: el núcleo sigue capturando
+        self.client.stop()
+        if self.feed is not None:
+            self.feed.close()
+            self.feed = None
+
+# --- PANEL DE UN DISPOSITIVO ---
+class DevicePanel(QGroupBox):
+    """
+    Gráficos de una placa. Lee los buffers de su Device y solo rehace los
+    widgets cuando cambia su esquema (modo o análisis pedido), no por paquete.
+    """
+
+    def __init__(self, device):
+        super().__init__(f"📟 {device.ip}")
+        self.device = device
+        self.vbox = QVBoxLayout(self)
+        self.series = {}
+        self.rollup_series = {}
+        self.from_rollups = {}        # Curva -> si el último cuadro salió de los rollups
+        self.plots = {}
+        self.curves = {}
+        self.spectrum_curve = None
+        self.spectrum_seen = 0
+        self.schema_seen = -1
+        self.seen_version = -1
+
+    def setup_graphs(self):
+        dev = self.device
+        if dev.schema_version == self.schema_seen:
+            return
+        self.schema_seen = dev.schema_version
+        mode = dev.mode
+        view = dev.analysis_view if mode == "BMI270" else None
+
+        # Limpiar
+        for i in reversed(range(self.vbox.count())):
+            w = self.vbox.itemAt(i).widget()
+            if w: w.setParent(None)
+
+        self.plots = {}
+        self.curves = {}
+        self.series = {}
+        self.rollup_series = {}
+        self.from_rollups = {}
+        self.spectrum_curve = None
+        self.spectrum_seen = 0
+
+        # Configuración de gráficos
+        configs = []
+        if mode == "BMI270":
+            configs = [
+                ("Aceleración", "m/s²", ["ax", "ay", "az"], ["#FF5252", "#4CAF50", "#448AFF"]),
+                ("Giroscopio", "rad/s", ["gx", "gy", "gz"], ["#E040FB", "#FFEB3B", "#00BCD4"])
+            ]
+            if view:
+                configs.append(("Energía RMS (servidor)", "m/s²", ["rms_srv"], ["#212121"]))
+            if view == "PEAK":
+                configs.append(("Picos sobre el umbral", "m/s²", ["peak"], ["#D32F2F"]))
+        elif mode == "BME688":
+            # 4 Gráficos separados para consistencia visual
+            configs = [
+                ("Temperatura", "°C", ["temp"], ["#FF5252"]),
+                ("Humedad Relativa", "%", ["hum"], ["#448AFF"]),
+                ("Presión Atmosférica", "Pa", ["press"], ["#4CAF50"]),
+                ("Resistencia Gas", "Ω", ["gas"], ["#607D8B"])
+            ]
+        elif mode == "RMS":
+            configs = [("Energía RMS", "Magnitud", ["rms"], ["#212121"])]
+
+        # Crear Widgets (los rollups del panel se leen una vez para todas sus curvas)
+        rollups = RollupCache(source_ip=dev.ip)
+        for title, unit, keys, colors in configs:
+            pw = pg.PlotWidget(title=title)
+            pw.setBackground('w')
+            pw.showGrid(x=True, y=True)
+            pw.setLabel('left', unit)
+            pw.addLegend()
+            pw.setMinimumHeight(200) # Altura mínima para que se vea bien
+            pw.setLabel('bottom', "s")
+            pw.setMouseEnabled(x=False, y=True)  # El eje X lo maneja la ventana de historial
+            self.vbox.addWidget(pw)
+
+            for k, col in zip(keys, colors):
+                self.series[k] = DecimatedSeries(dev.rings[k])
+                self.rollup_series[k] = RollupSeries(dev.rings[k], k, cache=rollups)
+                self.plots[k] = pw
+                # Ancho 1: las líneas gruesas son lo más caro de dibujar en la Raspberry
+                pen = pg.mkPen(color=col, width=1)
+                if k == "peak":
+                    # Eventos sueltos: solo marcadores
+                    self.curves[k] = pw.plot(pen=None, symbol='o', symbolSize=6, symbolBrush=col, name=k.upper())
+                else:
+                    self.curves[k] = pw.plot(pen=pen, name=k.upper())
+
+        if view == "FFT":
+            pw = pg.PlotWidget(title="Espectro FFT |a| (ventana de Hann)")
+            pw.setBackground('w')
+            pw.showGrid(x=True, y=True)
+            pw.setLabel('left', "m/s²")
+            pw.setLabel('bottom', "Hz")
+            pw.setMinimumHeight(200)
+            self.vbox.addWidget(pw)
+            self.spectrum_curve = pw.plot(pen=pg.mkPen(color="#FF9800", width=1))
+
+    def update_curves(self, now, window, origin):
+        # Solo las curvas que recibieron muestras (recorte + decimación a píxeles).
+        # Si el buffer (achicado por el presupuesto de memoria) no cubre la ventana, van los rollups
+        for k in self.curves:
+            use_rollups = window > RAW_WINDOW_MAX or not self.device.rings[k].covers(now - window)
+            series = self.rollup_series[k] if use_rollups else self.series[k]
+            if self.from_rollups.get(k) != use_rollups:
+                self.from_rollups[k] = use_rollups
+                series.invalidate()
+            px = int(self.plots[k].width()) or 1
+            out = series.update(now, window, px, origin=origin)
+            if out is not None:
+                self.curves[k].setData(*out)
+
+        # Espectro: solo cuando llega un FFT nuevo
+        dev = self.device
+        if self.spectrum_curve is not None and dev.spectrum_version != self.spectrum_seen:
+            self.spectrum_seen = dev.spectrum_version
+            self.spectrum_curve.setData(*dev.spectrum)
+
+        # El eje X avanza aunque las curvas no se redibujen
+        x_end = now - origin
+        for pw in set(self.plots.values()):
+            pw.setXRange(x_end - window, x_end, padding=0)
+
+    def invalidate(self):
+        self.seen_version = -1
+        for series in list(self.series.values()) + list(self.rollup_series.values()):
+            series.invalidate()
+
 
 # --- GUI PRINCIPAL ---
 class MainWindow(QMainWindow):
@@ -183,26 +347,36 @@ class MainWindow(QMainWindow):
         """)
 
         # Worker
-        self.worker = NetworkWorker()
+        self.worker = CoreWorker()
         self.worker.signals.log_message.connect(self.log)
         self.worker.signals.connection_status.connect(self.update_status)
-        self.worker.start_servers()
-
-        # Buffers
-        self.maxlen = 100
-        self.data_buffers = {}
-        self.plots = {}
-        self.curves = {}
-        self.current_layout_mode = None 
+        self.worker.signals.alert_event.connect(self.on_alert)
+        self.worker.signals.core_stats.connect(self.show_stats)
+        self.worker.start()
+
+        # Gráficos: un DevicePanel por placa; cada curva lee su RingBuffer a
+        # través de un DecimatedSeries, o de los rollups en disco (RollupSeries)
+        # para ventanas de más de 1 h
+        self.history_window = HISTORY_WINDOWS["10 s"]
+        self.t_origin = time.time()  # x = segundos desde que abrió la GUI
+        self.panels = {}              # source_ip -> DevicePanel
+        self.selected_ip = None       # None = todas las placas (config en broadcast)
+        self.registry_seen = -1
+        self.active_alerts = {}       # (regla, source_ip) -> evento FIRING
 
         self.init_ui()
 
         # --- TIMER DE ACTUALIZACIÓN (LA CLAVE DEL RENDIMIENTO) ---
         # En lugar de actualizar por señal, actualizamos a 30 FPS fijos
         self.update_timer = QTimer()
-        self.update_timer.timeout.connect(self.update_gui_from_data)
+        self.update_timer.timeout.connect(self.timed_update)
         self.update_timer.start(33) # 33ms ~= 30 FPS
 
+        # Panel de métricas: se refresca una vez por segundo solo si está visible
+        self.stats_prev = None
+        self.stats_timer = QTimer()
+        self.stats_timer.timeout.connect(self.refresh_stats)
+
     def init_ui(self):
         main_widget = QWidget()
         self.setCentralWidget(main_widget)
@@ -221,6 +395,13 @@ class MainWindow(QMainWindow):
         # 1. Configuración Sensor
         gb_conf = QGroupBox("1. Configuración de Sensor")
         v_conf = QVBoxLayout()
+
+        v_conf.addWidget(QLabel("Dispositivo:"))
+        self.cb_device = QComboBox()
+        self.cb_device.addItem("Todos (broadcast)", None)
+        self.cb_device.setMinimumHeight(30)
+        self.cb_device.currentIndexChanged.connect(self.select_device)
+        v_conf.addWidget(self.cb_device)
         
         v_conf.addWidget(QLabel("Seleccionar Sensor:"))
         self.cb_sensor = QComboBox()
@@ -243,10 +424,29 @@ class MainWindow(QMainWindow):
         self.cb_type.setMinimumHeight(30)
         v_conf.addWidget(self.cb_type)
 
-        v_conf.addWidget(QLabel("Ventana (N):"))
+        v_conf.addWidget(QLabel("Ventana (N) y umbral de picos (milésimas):"))
         self.sb_win = QSpinBox(); self.sb_win.setRange(10, 1024); self.sb_win.setValue(50)
         self.sb_win.setMinimumHeight(30)
-        v_conf.addWidget(self.sb_win)
+        self.sb_thr = QSpinBox(); self.sb_thr.setRange(0, 100000); self.sb_thr.setValue(DEFAULT_THRESHOLD)
+        self.sb_thr.setMinimumHeight(30)
+        h_win = QHBoxLayout()
+        h_win.addWidget(self.sb_win); h_win.addWidget(self.sb_thr)
+        v_conf.addLayout(h_win)
+
+        v_conf.addWidget(QLabel("Lote RAW (muestras/paquete) y periodo (ms):"))
+        self.sb_batch = QSpinBox(); self.sb_batch.setRange(1, 64); self.sb_batch.setValue(1)
+        self.sb_batch.setMinimumHeight(30)
+        self.sb_period = QSpinBox(); self.sb_period.setRange(1, 1000); self.sb_period.setValue(100)
+        self.sb_period.setMinimumHeight(30)
+        h_batch = QHBoxLayout()
+        h_batch.addWidget(self.sb_batch); h_batch.addWidget(self.sb_period)
+        v_conf.addLayout(h_batch)
+
+        v_conf.addWidget(QLabel("Formato de envío:"))
+        self.cb_format = QComboBox()
+        self.cb_format.addItems(["JSON", "BIN"])
+        self.cb_format.setMinimumHeight(30)
+        v_conf.addWidget(self.cb_format)
 
         gb_conf.setLayout(v_conf)
         control_panel.addWidget(gb_conf)
@@ -263,14 +463,34 @@ class MainWindow(QMainWindow):
         self.bg_save = QButtonGroup()
         self.rb_json = QRadioButton("JSON"); self.rb_json.setChecked(True)
         self.rb_csv = QRadioButton("CSV")
-        self.bg_save.addButton(self.rb_json); self.bg_save.addButton(self.rb_csv)
-        self.rb_json.toggled.connect(self.update_save_format)
+        self.rb_npy = QRadioButton("NPY")
+        self.bg_save.addButton(self.rb_json); self.bg_save.addButton(self.rb_csv); self.bg_save.addButton(self.rb_npy)
+        self.bg_save.buttonToggled.connect(lambda btn, checked: checked and self.update_save_format())
         h_save = QHBoxLayout()
-        h_save.addWidget(self.rb_json); h_save.addWidget(self.rb_csv)
+        h_save.addWidget(self.rb_json); h_save.addWidget(self.rb_csv); h_save.addWidget(self.rb_npy)
         v_save.addLayout(h_save)
         gb_save.setLayout(v_save)
         control_panel.addWidget(gb_save)
 
+        # 3. Visualización
+        gb_view = QGroupBox("3. Visualización")
+        v_view = QVBoxLayout()
+        v_view.addWidget(QLabel("Historial:"))
+        self.cb_history = QComboBox()
+        self.cb_history.addItems(list(HISTORY_WINDOWS))
+        self.cb_history.setMinimumHeight(30)
+        self.cb_history.currentTextChanged.connect(self.update_history_window)
+        v_view.addWidget(self.cb_history)
+        self.chk_stats = QCheckBox("Mostrar métricas de ingesta")
+        self.chk_stats.toggled.connect(self.toggle_stats)
+        v_view.addWidget(self.chk_stats)
+        self.lbl_stats = QLabel()
+        self.lbl_stats.setStyleSheet("font-family: monospace; font-size: 11px;")
+        self.lbl_stats.setVisible(False)
+        v_view.addWidget(self.lbl_stats)
+        gb_view.setLayout(v_view)
+        control_panel.addWidget(gb_view)
+
         # Estado Conexión
         self.lbl_status = QLabel("Esperando conexión...")
         self.lbl_status.setAlignment(Qt.AlignCenter)
@@ -323,102 +543,78 @@ class MainWindow(QMainWindow):
         layout.addLayout(right_layout)
 
     # --- LÓGICA DE ACTUALIZACIÓN (30 FPS) ---
+    def timed_update(self):
+        # Primero lo nuevo del feed compartido (vistas, sin deserializar)
+        self.worker.poll_feed()
+        # Solo se miden los cuadros que dibujan (los vacíos no dicen nada)
+        drawing = self.worker.devices.version != self.registry_seen
+        t0 = time.perf_counter()
+        self.update_gui_from_data()
+        if drawing:
+            FRAME_SECONDS.observe(time.perf_counter() - t0)
+
     def update_gui_from_data(self):
-        # 1. Verificar si hay dato nuevo
-        if not self.worker.new_data_available:
+        # 1. Verificar si llegó algo de cualquier placa
+        registry = self.worker.devices
+        if registry.version == self.registry_seen:
             return
-        
-        # 2. Copiar dato y limpiar flag (consumir)
-        data = self.worker.latest_data
-        self.worker.new_data_available = False # Ya lo consumimos visualmente
-        
-        if not data: return
-
-        # 3. Detectar modo
-        mode = "UNKNOWN"
-        if "ax" in data: mode = "BMI270"
-        elif "temp" in data: mode = "BME688"
-        elif "rms_total" in data: mode = "RMS"
-        
-        # 4. Configurar gráficas si cambió el modo
-        self.setup_graphs(mode)
-
-        # 5. Actualizar Buffers
-        for k, buffer in self.data_buffers.items():
-            if k in data:
-                buffer.append(data[k])
-                # Actualizar curva solo si existe
-                if k in self.curves:
-                    self.curves[k].setData(buffer)
-
-        # 6. Alertas
-        if mode == "BME688":
-            self.check_risk(data.get('temp', 0), data.get('hum', 0), data.get('gas', 0), data.get('press', 0))
-        elif mode == "BMI270":
-            self.set_alert_normal("Monitoreo Inercial Activo")
-
-    def setup_graphs(self, mode):
-        if mode == self.current_layout_mode: return
-        
-        # Limpiar
-        for i in reversed(range(self.graph_layout.count())): 
-            w = self.graph_layout.itemAt(i).widget()
-            if w: w.setParent(None)
-        
-        self.plots = {}
-        self.curves = {}
-        self.data_buffers = {}
-
-        # Configuración de gráficos
-        configs = []
-        if mode == "BMI270":
-            configs = [
-                ("Aceleración", "m/s²", ["ax", "ay", "az"], ["#FF5252", "#4CAF50", "#448AFF"]),
-                ("Giroscopio", "rad/s", ["gx", "gy", "gz"], ["#E040FB", "#FFEB3B", "#00BCD4"])
-            ]
-        elif mode == "BME688":
-            # 4 Gráficos separados para consistencia visual
-            configs = [
-                ("Temperatura", "°C", ["temp"], ["#FF5252"]),
-                ("Humedad Relativa", "%", ["hum"], ["#448AFF"]),
-                ("Presión Atmosférica", "Pa", ["press"], ["#4CAF50"]),
-                ("Resistencia Gas", "Ω", ["gas"], ["#607D8B"])
-            ]
-        elif mode == "RMS":
-            configs = [("Energía RMS", "Magnitud", ["rms_total"], ["#FFFFFF"])]
-
-        # Crear Widgets
-        for title, unit, keys, colors in configs:
-            pw = pg.PlotWidget(title=title)
-            pw.setBackground('w')
-            pw.showGrid(x=True, y=True)
-            pw.setLabel('left', unit)
-            pw.addLegend()
-            pw.setMinimumHeight(200) # Altura mínima para que se vea bien
-            self.graph_layout.addWidget(pw)
-            
-            for k, col in zip(keys, colors):
-                self.data_buffers[k] = deque([0]*self.maxlen, maxlen=self.maxlen)
-                pen = pg.mkPen(color=col, width=2)
-                self.curves[k] = pw.plot(pen=pen, name=k.upper())
-
-        self.current_layout_mode = mode
+        self.registry_seen = registry.version
+
+        now = time.time()
+        for dev in registry.devices():
+            panel = self.panels.get(dev.ip) or self.add_device_panel(dev)
+            if dev.version == panel.seen_version:
+                continue
+            if panel.isHidden():
+                continue
+            panel.seen_version = dev.version
+
+            # 2. Rehacer gráficos solo si cambió el esquema de esta placa
+            panel.setup_graphs()
+
+            # 3. Actualizar curvas (las alertas llegan aparte, como eventos)
+            panel.update_curves(now, self.history_window, self.t_origin)
+
+    def add_device_panel(self, dev):
+        panel = self.panels[dev.ip] = DevicePanel(dev)
+        panel.setVisible(self.selected_ip in (None, dev.ip))
+        self.graph_layout.addWidget(panel)
+        self.cb_device.addItem(dev.ip, dev.ip)
+        self.log(f"📟 Nuevo dispositivo: {dev.ip}")
+        return panel
+
+    def select_device(self, index):
+        self.selected_ip = self.cb_device.itemData(index)
+        for ip, panel in self.panels.items():
+            visible = self.selected_ip in (None, ip)
+            if visible and panel.isHidden():
+                panel.invalidate()
+            panel.setVisible(visible)
+        self.registry_seen = -1
+        self.show_alerts()
 
     # --- ALERTAS ---
-    def check_risk(self, temp, hum, gas, press):
-        if temp == 0 and hum == 0: return
-
-        risks = []
-        if temp > 30: risks.append(f"CALOR: {temp:.1f}°C")
-        if temp < 10: risks.append(f"FRÍO: {temp:.1f}°C")
-        if hum > 70: risks.append(f"HUMEDAD: {hum:.1f}%")
-        if hum < 20: risks.append(f"SECO: {hum:.1f}%")
-        if 0 < gas < 5000: risks.append("AIRE SUCIO")
-
-        if risks:
-            self.set_alert_danger(" | ".join(risks))
+    def on_alert(self, event):
+        """Transición de una regla (hilo escritor -> señal): solo aquí se toca el panel de alertas"""
+        key = (event["rule"], event["source_ip"])
+        if event["type"] == "FIRING":
+            self.active_alerts[key] = event
+            self.log(f"🔴 {event['source_ip']} {event['message']}")
+        else:
+            self.active_alerts.pop(key, None)
+            self.log(f"🟢 {event['source_ip']} {event['rule']} resuelta")
+        self.show_alerts()
+
+    def show_alerts(self):
+        """Alertas activas de la placa seleccionada o, con 'Todos', de cualquier placa"""
+        active = [ev for (_, ip), ev in sorted(self.active_alerts.items())
+                  if self.selected_ip in (None, ip)]
+        if active:
+            several = len({ev["source_ip"] for ev in active}) > 1
+            self.set_alert_danger(" | ".join(f"{ev['source_ip']}: {ev['message']}" if several else ev["message"]
+                                             for ev in active))
         else:
-            self.set_alert_normal(f"T:{temp:.1f}°C H:{hum:.0f}% P:{press:.0f}Pa G:{gas:.0f}Ω")
+            self.set_alert_normal("Sin alertas activas")
 
     def set_alert_danger(self, msg):
         self.frm_alert.setStyleSheet("background-color: #FFCDD2; border: 2px solid #F44336; border-radius: 8px;")
@@ -432,22 +628,90 @@ class MainWindow(QMainWindow):
         self.lbl_alert_title.setStyleSheet("color: #2E7D32;")
         self.lbl_alert_msg.setText(msg)
 
+    # --- MÉTRICAS ---
+    def toggle_stats(self, visible):
+        self.lbl_stats.setVisible(visible)
+        self.stats_prev = None
+        if visible:
+            self.refresh_stats()
+            self.stats_timer.start(1000)
+        else:
+            self.stats_timer.stop()
+
+    def refresh_stats(self):
+        # Los contadores de la ingesta están en el núcleo: la respuesta llega por show_stats
+        self.worker.request_stats()
+
+    def show_stats(self, core):
+        """Tasas y medias del último segundo a partir de los contadores acumulados"""
+        now = time.monotonic()
+        packets = core["packets"]
+        cur = {"t": now, "packets": packets, "decode": core["decode"], "frame": FRAME_SECONDS.totals()}
+        prev = self.stats_prev or cur
+        self.stats_prev = cur
+        dt = max(1e-6, now - prev["t"])
+
+        def mean_us(key):
+            n = cur[key][0] - prev[key][0]
+            return (cur[key][1] - prev[key][1]) / n * 1e6 if n else 0.0
+
+        def ms(q):
+            return f"{q * 1e3:.1f}" if q is not None else "--"
+
+        rates = " | ".join(f"{p} {(n - prev['packets'].get(p, 0)) / dt:.0f}" for p, n in sorted(packets.items()))
+        st = core["writer"]
+        self.lbl_stats.setText(
+            f"Paquetes/s: {rates or '--'}\n"
+            f"Errores de parseo: {core['parse_errors']}\n"
+            f"Decodificación: {mean_us('decode'):.1f} µs\n"
+            f"Escritura p95: {ms(core['write_p95'])} ms | flush p95: {ms(core['flush_p95'])} ms\n"
+            f"Cola: {st['queue_depth']} (máx {st['queue_max_depth']}) | descartados {st['dropped']}\n"
+            f"Comandos p95: ack {ms(core.get('command_rtt_p95'))} ms | "
+            f"primer dato {ms(core.get('command_first_record_p95'))} ms\n"
+            f"Cuadro: {mean_us('frame') / 1e3:.1f} ms (p95 {ms(FRAME_SECONDS.quantile(0.95))} ms)")
+
     # --- CONTROL ---
+    def update_history_window(self, label):
+        self.history_window = HISTORY_WINDOWS[label]
+        for panel in self.panels.values():
+            panel.invalidate()
+        self.registry_seen = -1
+        self.log(f"Historial: {label}")
+
     def update_save_format(self):
-        fmt = "JSON" if self.rb_json.isChecked() else "CSV"
+        if self.rb_json.isChecked(): fmt = "JSON"
+        elif self.rb_csv.isChecked(): fmt = "CSV"
+        else: fmt = "NPY"
         self.worker.set_save_format(fmt)
         self.log(f"Formato guardado: {fmt}")
 
     def send_config(self):
+        dtype = self.cb_type.currentText()
+        target = self.selected_ip
+        # FFT y PEAK se calculan en el servidor: al firmware se le piden muestras RAW
+        view = dtype if dtype in ("FFT", "PEAK") else None
+        registry = self.worker.devices
+        if target is None:
+            registry.default_view = view
+            for dev in registry.devices():
+                dev.set_analysis_view(view)
+        else:
+            registry.get(target).set_analysis_view(view)
+        self.worker.configure_analytics(source_ip=target, window_size=self.sb_win.value(),
+                                        threshold=self.sb_thr.value())
+        self.registry_seen = -1
         cfg = {
             "cmd": "config",
             "sensor": self.cb_sensor.currentText(),
             "protocol": "UDP" if self.rb_udp.isChecked() else "TCP",
-            "type": self.cb_type.currentText(),
+            "type": "RAW" if view else dtype,
             "window_size": self.sb_win.value(),
-            "threshold": 0
+            "threshold": self.sb_thr.value(),
+            "format": self.cb_format.currentText(),
+            "batch": self.sb_batch.value(),
+            "period_ms": self.sb_period.value()
         }
-        self.worker.send_config(cfg)
+        self.worker.send_config(cfg, target)
 
     def update_status(self, status):
         self.lbl_status.setText(status)
@@ -0,0 +1,570 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from data_writer import BatchedWriter, CsvSink, JsonlSink, RotatingJsonlSink
+from tcp_ingest import TcpIngestServer
+from udp_ingest import UdpIngest
+from udp_workers import UdpWorkerPool
+from rollups import ROLLUP_DIR, RollupSink
+from link_tracker import LinkTracker
+from alerts import ALERTS_FILE, RULES_FILE, AlertEngine, load_rules
+from commands import COMMAND_FIRST_RECORD, COMMAND_RTT, CommandChannel
+from protocol import decode_payload, frame_size
+from metrics import (DECODE_SECONDS, FLUSH_SECONDS, METRICS_HOST, PACKETS, PARSE_ERRORS, REGISTRY,
+                     WRITE_SECONDS, MetricsServer, observe_decode)
+
+# --- CONFIGURACIÓN ---
+HOST = '0.0.0.0'
+PORT = 1234
+FILENAME = 'sensor_data.jsonl'
+CSV_FILENAME = 'sensor_data.csv'  # --storage csv: un archivo por sensor/tipo
+JSONL_INDEX = True           # Índice temporal sensor_data.jsonl.idx (ver jsonl_index.py)
+CHUNK_DIR = 'sensor_chunks'  # Almacenamiento columnar (--storage chunks|both)
+STORAGES = ("jsonl", "csv", "chunks", "both")
+ROLLUPS = True               # Agregados 1s/1m/1h en sensor_rollups/ (ver rollups.py)
+LINK_TRACKING = True         # Pérdidas / jitter / retraso por dispositivo según seq (ver link_tracker.py)
+ALERTS = True                # Reglas de alerta sobre cada registro -> alerts.jsonl (ver alerts.py)
+ANALYTICS = True             # RMS / FFT / picos de los RAW del BMI270 (ver analytics.py)
+ANALYTICS_WINDOW = 256       # Muestras por ventana (RMS y FFT), se calcula cada media ventana
+ANALYTICS_THRESHOLD = 1000   # Umbral de picos en milésimas: 1000 = 1.0 m/s²
+UDP_RCVBUF = 4 * 1024 * 1024  # Buffer de recepción UDP del kernel (bytes)
+TCP_IDLE_TIMEOUT = 0         # Segundos sin datos antes de cerrar una conexión (0 = nunca)
+
+# --- ROTACIÓN DE SEGMENTOS (ver segments.py) ---
+ROTATE_SECONDS = 0           # Segmento nuevo cada N s en punto (0 = todo en sensor_data.jsonl; 3600 = cada hora)
+ROTATE_BYTES = 0             # ...o al superar N bytes (0 = sin límite)
+COMPRESSION = "gzip"         # "gzip", "lzma" o "none" para los segmentos cerrados
+RETENTION_BYTES = 0          # Borra los segmentos más viejos sobre este total (0 = sin límite)
+RETENTION_SECONDS = 0        # ...o más viejos que esto (0 = sin límite)
+
+# --- CONFIGURACIÓN DEL ESCRITOR ---
+WRITER_QUEUE_SIZE = 20000    # Registros en cola antes de empezar a descartar
+WRITER_BATCH_SIZE = 500      # Escribe al juntar N registros...
+WRITER_FLUSH_INTERVAL = 0.5  # ...o cada X segundos, lo que ocurra primero
+WRITER_DURABILITY = "flush"  # "none", "flush" o "fsync"
+WRITER_FSYNC_MS = 1000       # Intervalo de fsync en modo "fsync"
+ECHO_MODE = "rate"           # "off", "sample" (1 de cada N) o "rate" (N por segundo)
+ECHO_VALUE = 5
+
+# --- CONSUMIDORES (GUI) ---
+FEED = True                  # Muestras en memoria compartida para la GUI (ver shm_feed.py)
+CONTROL_HOST = "127.0.0.1"   # Solo local: el canal de control no tiene autenticación
+CONTROL_PORT = 1235          # Órdenes y eventos en JSON por líneas (ver IngestCore.handle_control)
+RECONNECT_INTERVAL = 1.0     # Segundos entre intentos del cliente
+CORE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server_unificado.py")
+CORE_LOG = "ingest_core.log"  # Salida del núcleo cuando lo lanza la GUI
+
+# Canal de control (127.0.0.1:CONTROL_PORT), una línea JSON por mensaje:
+#   -> {"op":"hello"}                                   <- {"event":"hello","feed":..,"storage":..,"controls":[[ip,puerto],..]}
+#   -> {"op":"config","config":{...},"target":ip|null}  (a una placa o a todas)
+#   -> {"op":"storage","format":"jsonl|csv|chunks|both"}
+#   -> {"op":"analytics","source_ip":..,"window_size":..,"threshold":..}
+#   -> {"op":"stats"}                                   <- {"event":"stats",...}
+# Eventos que el núcleo envía a todos los consumidores:
+#   {"event":"log","msg":..} | {"event":"controls","controls":[..]} |
+#   {"event":"alert","alert":{...}} | {"event":"spectrum","record":{FFT}} |
+#   {"event":"command","result":{...}} (ack, RTT y primer dato de cada config; ver commands.py)
+
+
+# --- NÚCLEO DE INGESTA ---
+class IngestCore:
+    """
+    Receptores TCP/UDP, escritor por lotes y etapas (enlace, rollups,
+    alertas, análisis) en un solo objeto. Corre sin interfaz como servicio
+    (server_unificado.py); la GUI se adjunta como consumidor opcional: lee las
+    muestras del feed en memoria compartida y manda órdenes por el canal de
+    control, así cerrarla o reiniciarla no interrumpe la captura.
+    """
+
+    def __init__(self, host=HOST, port=PORT, storage="jsonl", filename=FILENAME, workers=0, rollups=ROLLUPS,
+                 link_stats=LINK_TRACKING, alerts=ALERTS, rules_file=RULES_FILE, analytics=ANALYTICS,
+                 window_size=ANALYTICS_WINDOW, threshold=ANALYTICS_THRESHOLD,
+                 rotate_seconds=ROTATE_SECONDS, rotate_bytes=ROTATE_BYTES, compression=COMPRESSION,
+                 retention_bytes=RETENTION_BYTES, retention_seconds=RETENTION_SECONDS,
+                 durability=WRITER_DURABILITY, fsync_ms=WRITER_FSYNC_MS, echo_mode=ECHO_MODE, echo_value=ECHO_VALUE,
+                 feed=FEED, control_port=CONTROL_PORT):
+        if storage not in STORAGES:
+            raise ValueError(f"storage debe ser uno de {STORAGES}")
+        self.host = host
+        self.port = port
+        self.storage = storage
+        self.filename = filename
+        self.workers = workers
+        self.rotation = dict(rotate_bytes=rotate_bytes, rotate_seconds=rotate_seconds, compression=compression,
+                             retention_bytes=retention_bytes, retention_seconds=retention_seconds)
+        self.feed_enabled = feed
+        self.control_port = control_port
+
+        self.tcp_server = None
+        self.udp_ingest = None
+        self.udp_pool = None
+        self.control = None
+        self.feed = None
+        self.controls = {}            # source_ip -> (ip, puerto) de su conexión TCP de control
+        self.last_dropped = 0
+        self.feed_errors = 0          # Muestras que no se pudieron publicar en el feed (ya estaban guardadas)
+        # Configs a las placas: cola con id, ack y reintentos fuera de los hilos de ingesta
+        self.commands = CommandChannel(
+            lambda addr, data: self.tcp_server is not None and self.tcp_server.send(addr, data),
+            self.controls.get, self.report_command)
+
+        # Etapas que sobreviven a un cambio de formato (set_storage)
+        self.link_tracker = LinkTracker(lambda record: self.writer.put(record)) if link_stats else None
+        self.stages = []
+        if rollups:
+            self.stages.append(RollupSink(ROLLUP_DIR))
+        if alerts:
+            self.stages.append(AlertEngine(load_rules(rules_file), ALERTS_FILE, publish=self.report_alert))
+        self.analytics = None
+        if analytics:
+            try:
+                from analytics import AnalyticsStage
+            except ImportError as e:
+                print(f"⚠️ Análisis desactivado (falta NumPy): {e}")
+            else:
+                # Los registros derivados vuelven a la cola y se persisten como cualquier otro
+                self.analytics = AnalyticsStage(self.publish_derived, window_size=window_size, threshold=threshold)
+                self.stages.append(self.analytics)
+
+        self.writer = BatchedWriter(
+            self.build_sinks(storage),
+            queue_size=WRITER_QUEUE_SIZE,
+            batch_size=WRITER_BATCH_SIZE,
+            flush_interval=WRITER_FLUSH_INTERVAL,
+            durability=durability,
+            fsync_interval_ms=fsync_ms,
+            echo_mode=echo_mode,
+            echo_value=echo_value,
+        )
+
+    # --- PERSISTENCIA ---
+    def build_sinks(self, storage):
+        sinks = []
+        if self.link_tracker:
+            # Primero: agrega "delay_ms" a los registros antes de que se escriban
+            sinks.append(self.link_tracker)
+        if storage in ("jsonl", "both"):
+            if self.rotation["rotate_seconds"] or self.rotation["rotate_bytes"]:
+                sinks.append(RotatingJsonlSink(self.filename, index=JSONL_INDEX, **self.rotation))
+            else:
+                sinks.append(JsonlSink(self.filename, index=JSONL_INDEX))
+        if storage == "csv":
+            sinks.append(CsvSink(CSV_FILENAME))
+        if storage in ("chunks", "both"):
+            # Import diferido: NumPy solo hace falta con el backend columnar
+            from chunk_store import ChunkStore
+            sinks.append(ChunkStore(CHUNK_DIR))
+        return sinks + self.stages
+
+    def set_storage(self, storage):
+        # El cambio lo aplica el hilo escritor entre lotes; la ingesta no se detiene
+        if storage not in STORAGES:
+            self.log(f"⚠️ Formato desconocido: {storage}")
+            return
+        self.storage = storage
+        self.writer.set_sinks(self.build_sinks(storage))
+        self.log(f"📂 Formato de guardado: {storage}")
+
+    def put(self, record, t=None):
+        """Registro ya sellado: a la cola del escritor y después al feed de la GUI"""
+        self.commands.on_record(record)
+        accepted = self.writer.put(record)
+        self.publish_feed(record, time.time() if t is None else t)
+        return accepted
+
+    def publish_feed(self, record, t, derived=False):
+        """El feed es solo para graficar: si falla (valor raro, bloque ya liberado) el dato ya está en la cola"""
+        feed = self.feed
+        if feed is None:
+            return
+        try:
+            feed.append(record, t, derived=derived)
+        except Exception as e:
+            self.feed_errors += 1
+            if self.feed_errors == 1:
+                print(f"⚠️ No se pudo publicar en el feed: {e}")
+
+    def save(self, data_dict, protocol, source_ip):
+        data_dict['timestamp_server'] = datetime.now().isoformat()
+        data_dict['protocol'] = protocol
+        data_dict['source_ip'] = source_ip
+
+        # Solo encolamos: serializar, escribir e imprimir lo hace el hilo escritor
+        self.put(data_dict)
+
+    def publish_derived(self, record):
+        """Registros RMS_SRV / FFT / PEAK de AnalyticsStage (hilo escritor)"""
+        self.writer.put(record)
+        if record.get("type") == "FFT":
+            # El espectro no tiene largo fijo: va por el canal de control
+            self.broadcast({"event": "spectrum", "record": record})
+        else:
+            self.publish_feed(record, time.time(), derived=True)
+
+    # --- RECEPTORES ---
+    def handle_tcp_line(self, line, addr):
+        if line.startswith(b'{"ack"'):
+            # Respuesta a un comando: no es un registro y no espera al escritor
+            try:
+                self.commands.on_ack(addr[0], json.loads(line))
+            except ValueError:
+                print(f"⚠️ [TCP] Ack mal formado: {line[:120]}")
+            return True
+        # Contrapresión: si la cola del escritor está llena, no consumimos la línea
+        if self.writer.queue.full():
+            return False
+        try:
+            for data in observe_decode(decode_payload, line, "TCP", addr[0]):
+                self.save(data, "TCP", addr[0])
+        except ValueError:
+            print(f"⚠️ [TCP] Error decodificando: {line[:120]}")
+        except (TypeError, AttributeError):
+            # JSON válido que no es un objeto (ej. "5"): observe_decode no lo contó
+            PARSE_ERRORS.inc("TCP", addr[0])
+            print(f"⚠️ [TCP] Error decodificando: {line[:120]}")
+        return True
+
+    def on_tcp_connect(self, addr):
+        # Cada placa queda asociada a su propia conexión de control
+        self.controls[addr[0]] = addr
+        self.log(f"🔵 [TCP] Conectado: {addr[0]}:{addr[1]}")
+        self.broadcast_controls()
+
+    def on_tcp_disconnect(self, addr):
+        self.log(f"⚪ [TCP] Desconectado: {addr[0]}:{addr[1]}")
+        if self.controls.get(addr[0]) == addr:
+            del self.controls[addr[0]]
+            # Si la placa tiene otra conexión abierta, esa pasa a ser la de control
+            for other in self.tcp_server.clients():
+                if other[0] == addr[0] and other != addr:
+                    self.controls[addr[0]] = other
+        self.broadcast_controls()
+
+    def tcp_server_thread(self):
+        # Un solo hilo (selectors) atiende todas las conexiones TCP a la vez
+        self.tcp_server = TcpIngestServer(
+            self.host, self.port, self.handle_tcp_line,
+            on_connect=self.on_tcp_connect,
+            on_disconnect=self.on_tcp_disconnect,
+            idle_timeout=TCP_IDLE_TIMEOUT,
+            frame_size=frame_size,
+        )
+        try:
+            print(f"✅ Hilo TCP escuchando en {self.host}:{self.port}")
+            self.tcp_server.serve_forever()
+        except Exception as e:
+            print(f"❌ Error iniciando TCP: {e}")
+
+    def handle_udp_datagram(self, data_bytes, addr):
+        # Corre en el hilo parser de UdpIngest, no en el de recepción.
+        # JSON o trama binaria: decode_payload lo detecta por el byte mágico
+        for data in observe_decode(decode_payload, data_bytes, "UDP", addr[0]):
+            self.save(data, "UDP", addr[0])
+
+    def start_udp(self):
+        if self.workers > 0:
+            # N procesos con SO_REUSEPORT; sus registros vuelven a este proceso y
+            # pasan por el mismo escritor, así el archivo sigue siendo uno solo
+            self.udp_pool = UdpWorkerPool(self.workers, self.host, self.port, self.put, rcvbuf=UDP_RCVBUF)
+            self.udp_pool.start()
+            print(f"✅ {self.workers} workers UDP escuchando en {self.host}:{self.port} (SO_REUSEPORT)")
+            return
+        self.udp_ingest = UdpIngest(
+            self.host, self.port, self.handle_udp_datagram, rcvbuf=UDP_RCVBUF,
+            on_malformed=lambda data, addr: print(f"⚠️ [UDP] Error decodificando de {addr[0]}: {data[:120]}"))
+        try:
+            self.udp_ingest.start()
+            print(f"✅ Hilo UDP escuchando en {self.host}:{self.port} "
+                  f"(SO_RCVBUF={self.udp_ingest.effective_rcvbuf()})")
+        except Exception as e:
+            print(f"❌ Error iniciando UDP: {e}")
+
+    def send_config(self, config, target=None):
+        """Encola la configuración para la placa 'target' (source_ip) o para todas si es None"""
+        if target is None:
+            ips = list(self.controls)
+        else:
+            ips = [target] if target in self.controls else []
+        if not ips or self.tcp_server is None:
+            self.log("⚠️ No hay conexión TCP para control.")
+            return
+        ids = self.commands.submit(ips, config)
+        for ip, cid in zip(ips, ids):
+            self.log(f"📤 Config #{cid} a {ip}: {config.get('sensor')}")
+
+    def report_command(self, result):
+        """Resultado de un comando (hilo de comandos o de ingesta)"""
+        if "group" in result:
+            self.log(f"📋 Flota reconfigurada: {result['ok']}/{result['total']} en {result['elapsed_ms']:.0f} ms")
+        else:
+            ip, cid, status = result["source_ip"], result["id"], result["status"]
+            if status == "ok":
+                self.log(f"✅ Config #{cid} aplicada en {ip}: ack en {result['rtt_ms']} ms, "
+                         f"primer dato en {result['first_record_ms']} ms")
+            elif status == "timeout":
+                self.log(f"❌ Config #{cid} sin ack de {ip} tras {result['tries']} intentos")
+            elif status == "error":
+                self.log(f"❌ Config #{cid} rechazada por {ip} (ack en {result['rtt_ms']} ms)")
+            elif status == "no_data":
+                self.log(f"⚠️ Config #{cid} confirmada por {ip} (ack en {result['rtt_ms']} ms) "
+                         f"pero no llegan datos con ella")
+            elif status == "superseded":
+                self.log(f"ℹ️ Config #{cid} en {ip} reemplazada por una más nueva")
+        self.broadcast({"event": "command", "result": result})
+
+    # --- CANAL DE CONTROL (CONSUMIDORES) ---
+    def control_thread(self):
+        self.control = TcpIngestServer(
+            CONTROL_HOST, self.control_port, self.handle_control,
+            on_connect=lambda addr: self.log(f"🖥️ Consumidor conectado: {addr[0]}:{addr[1]}"),
+            on_disconnect=lambda addr: self.log(f"🖥️ Consumidor desconectado: {addr[0]}:{addr[1]}"),
+        )
+        try:
+            print(f"✅ Canal de control en {CONTROL_HOST}:{self.control_port}")
+            self.control.serve_forever()
+        except Exception as e:
+            print(f"❌ Error iniciando el canal de control: {e}")
+
+    def handle_control(self, line, addr):
+        try:
+            msg = json.loads(line)
+        except ValueError:
+            return True
+        op = msg.get("op")
+        if op == "hello":
+            self.reply(addr, {"event": "hello", "feed": self.feed.name if self.feed else None,
+                              "storage": self.storage, "controls": list(self.controls.values())})
+        elif op == "config":
+            self.send_config(msg.get("config", {}), msg.get("target"))
+        elif op == "storage":
+            self.set_storage(msg.get("format"))
+        elif op == "analytics":
+            if self.analytics is not None:
+                self.analytics.configure(source_ip=msg.get("source_ip"), window_size=msg.get("window_size"),
+                                         threshold=msg.get("threshold"))
+        elif op == "stats":
+            self.reply(addr, dict(self.stats(), event="stats"))
+        else:
+            self.reply(addr, {"event": "log", "msg": f"⚠️ Orden desconocida: {op}"})
+        return True
+
+    def reply(self, addr, event):
+        if self.control is not None:
+            self.control.send(addr, (json.dumps(event) + "\n").encode("utf-8"))
+
+    def broadcast(self, event):
+        if self.control is None:
+            return
+        clients = self.control.clients()
+        if clients:
+            msg = (json.dumps(event) + "\n").encode("utf-8")
+            for addr in clients:
+                self.control.send(addr, msg)
+
+    def broadcast_controls(self):
+        self.broadcast({"event": "controls", "controls": list(self.controls.values())})
+
+    def log(self, msg):
+        print(msg)
+        self.broadcast({"event": "log", "msg": msg})
+
+    def report_alert(self, event):
+        icon = "🔴" if event["type"] == "FIRING" else "🟢"
+        print(f"{icon} [ALERTA] {event['source_ip']} {event['rule']}: {event['message']}")
+        self.broadcast({"event": "alert", "alert": event})
+
+    # --- MÉTRICAS Y ESTADO ---
+    def register_metrics(self):
+        """Colas y contadores que ya llevan el escritor y los receptores, leídos al exportar"""
+        writer = self.writer
+        REGISTRY.callback("writer_queue_depth", "Registros en la cola del escritor", lambda: writer.queue.qsize())
+        REGISTRY.callback("writer_queue_max_depth", "Profundidad máxima de la cola del escritor",
+                          lambda: writer.max_depth)
+        REGISTRY.callback("writer_written_total", "Registros escritos", lambda: writer.written, kind="counter")
+        REGISTRY.callback("writer_dropped_total", "Registros descartados con la cola llena",
+                          lambda: writer.dropped, kind="counter")
+        REGISTRY.callback("udp_batch_queue_depth", "Lotes UDP esperando al parser",
+                          lambda: self.udp_ingest.batches.qsize() if self.udp_ingest else None)
+        REGISTRY.callback("udp_kernel_drops_total", "Datagramas descartados por el kernel",
+                          lambda: self.udp_ingest.kernel_drops() if self.udp_ingest else None, kind="counter")
+        REGISTRY.callback("udp_worker_received_total", "Datagramas recibidos por worker",
+                          lambda: {(str(w),): st["received"] for w, st in self.udp_pool.worker_stats.items()}
+                          if self.udp_pool else None, labels=("worker",), kind="counter")
+        REGISTRY.callback("feed_samples_total", "Muestras publicadas en el feed compartido",
+                          lambda: self.feed.head if self.feed else None, kind="counter")
+        REGISTRY.callback("control_clients", "Consumidores conectados al canal de control",
+                          lambda: len(self.control.clients()) if self.control else None)
+        REGISTRY.callback("commands_pending", "Comandos esperando ack o su primer registro",
+                          lambda: len(self.commands.pending) + len(self.commands.awaiting))
+        REGISTRY.add_source(lambda: self.udp_pool.metric_snapshots() if self.udp_pool else [])
+
+    def start_metrics(self, port):
+        try:
+            server = MetricsServer(METRICS_HOST, port).start()
+            print(f"✅ Métricas en http://{server.address[0]}:{server.address[1]}/metrics")
+        except OSError as e:
+            print(f"⚠️ No se pudo abrir el endpoint de métricas en el puerto {port}: {e}")
+
+    def stats(self):
+        """Resumen para el panel de métricas de los consumidores"""
+        packets = {}
+        snaps = [PACKETS.snapshot()]
+        if self.udp_pool:
+            snaps += [s.get(PACKETS.name, {}) for s in self.udp_pool.metric_snapshots()]
+        for snap in snaps:
+            for (proto, _), n in snap.items():
+                packets[proto] = packets.get(proto, 0) + n
+        return {
+            "packets": packets,
+            "parse_errors": PARSE_ERRORS.total(),
+            "decode": DECODE_SECONDS.totals(),
+            "write_p95": WRITE_SECONDS.quantile(0.95),
+            "flush_p95": FLUSH_SECONDS.quantile(0.95),
+            "writer": self.writer.stats(),
+            "feed_head": self.feed.head if self.feed else None,
+            "feed_errors": self.feed_errors,
+            "command_rtt_p95": COMMAND_RTT.quantile(0.95),
+            "command_first_record_p95": COMMAND_FIRST_RECORD.quantile(0.95),
+        }
+
+    def report_stats(self):
+        st = self.writer.stats()
+        print(f"📊 Cola {st['queue_depth']}/{st['queue_size']} (máx {st['queue_max_depth']}) | "
+              f"Escritos: {st['written']} | Descartados: {st['dropped']}")
+        if st['dropped'] > self.last_dropped:
+            print(f"⚠️ [WRITER] Cola llena: {st['dropped'] - self.last_dropped} registros descartados")
+        self.last_dropped = st['dropped']
+        if self.udp_pool:
+            for line in self.udp_pool.report():
+                print(f"📡 {line}")
+        elif self.udp_ingest:
+            st = self.udp_ingest.stats()
+            print(f"📡 UDP recibidos: {st['received']} | Mal formados: {st['malformed']} | "
+                  f"Perdidos (parser): {st['dropped_app']} | Perdidos (kernel): {st['kernel_drops']}")
+
+    # --- CICLO DE VIDA ---
+    def start(self):
+        # Escritor y feed antes que los receptores
+        self.writer.start()
+        self.register_metrics()
+        if self.feed_enabled:
+            try:
+                from shm_feed import FeedWriter, feed_name
+                self.feed = FeedWriter(feed_name(self.port))
+                print(f"✅ Feed compartido: {self.feed.name} ({self.feed.capacity} muestras)")
+            except (ImportError, OSError) as e:
+                print(f"⚠️ Feed compartido desactivado: {e}")
+        threading.Thread(target=self.tcp_server_thread, name="tcp_ingest", daemon=True).start()
+        self.start_udp()
+        self.commands.start()
+        if self.control_port:
+            threading.Thread(target=self.control_thread, name="control", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.commands.stop()
+        if self.udp_pool:
+            self.udp_pool.stop()
+        if self.udp_ingest:
+            self.udp_ingest.stop()
+        if self.tcp_server:
+            self.tcp_server.stop()
+        if self.control:
+            self.control.stop()
+        self.writer.stop()
+        if self.feed is not None:
+            feed, self.feed = self.feed, None
+            feed.close()
+
+
+# --- CLIENTE DEL CANAL DE CONTROL (GUI) ---
+def spawn_core(args=()):
+    """
+    Lanza server_unificado.py como servicio independiente (su propia sesión):
+    sigue capturando aunque se cierre quien lo lanzó.
+    """
+    log = open(CORE_LOG, "ab")
+    return subprocess.Popen([sys.executable, "-u", CORE_SCRIPT] + list(args), stdin=subprocess.DEVNULL,
+                            stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+
+class CoreClient:
+    """
+    Conexión de un consumidor con el núcleo: reconecta sola y entrega cada
+    evento a on_event(dict) desde su propio hilo. on_state(True/False) avisa
+    al conectar o perder el núcleo. Con spawn, si no hay núcleo lo lanza una vez.
+    """
+
+    def __init__(self, on_event, on_state=None, host=CONTROL_HOST, port=CONTROL_PORT, spawn=None):
+        self.on_event = on_event
+        self.on_state = on_state
+        self.host = host
+        self.port = port
+        self.spawn = spawn
+        self.sock = None
+        self.running = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._run, name="core_client", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        with self._lock:
+            if self.sock is not None:
+                try:
+                    self.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def send(self, msg):
+        """Envía una orden. False si no hay conexión con el núcleo"""
+        data = (json.dumps(msg) + "\n").encode("utf-8")
+        with self._lock:
+            if self.sock is None:
+                return False
+            try:
+                self.sock.sendall(data)
+                return True
+            except OSError:
+                return False
+
+    def _run(self):
+        while self.running:
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=RECONNECT_INTERVAL)
+            except OSError:
+                if self.spawn is not None:
+                    spawn, self.spawn = self.spawn, None
+                    spawn()
+                time.sleep(RECONNECT_INTERVAL)
+                continue
+            sock.settimeout(None)
+            with self._lock:
+                self.sock = sock
+            self.send({"op": "hello"})
+            if self.on_state:
+                self.on_state(True)
+            try:
+                for line in sock.makefile("rb"):
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.on_event(event)
+            except OSError:
+                pass
+            with self._lock:
+                self.sock = None
+            sock.close()
+            if self.on_state:
+                self.on_state(False)
+            if self.running:
+                time.sleep(RECONNECT_INTERVAL)
@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+from segments import list_segments, open_log, plain_path
+
+# --- CONFIGURACIÓN ---
+BUCKET_SECONDS = 60      # Granularidad del índice
+LATE_MARGIN = 1          # Buckets extra a cada lado del rango por registros que llegan tarde
+INDEX_SUFFIX = ".idx"
+
+# Formato del índice (<archivo>.idx, una línea JSON por bucket cerrado):
+# {"bucket": 1760623200, "t_min": .., "t_max": .., "start": off, "end": off, "count": n,
+#  "keys": {"10.0.0.7|BMI270": [primer_offset, fin_offset, n], ...}}
+# Las entradas se agregan en orden de "bucket", lo que permite búsqueda binaria
+# directamente sobre el archivo de índice sin cargarlo entero.
+
+
+def record_time(record):
+    """Epoch (float) del registro según timestamp_server o timestamp (GUI). None si no tiene."""
+    ts = record.get("timestamp_server") or record.get("timestamp")
+    if ts is None:
+        return None
+    try:
+        return datetime.fromisoformat(ts).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def record_key(record):
+    return f"{record.get('source_ip', '')}|{record.get('sensor', '')}"
+
+
+def index_path(data_path):
+    # Los segmentos comprimidos conservan el índice del archivo original
+    return plain_path(data_path) + INDEX_SUFFIX
+
+
+# --- CONSTRUCCIÓN INCREMENTAL ---
+class JsonlIndexer:
+    """Lo alimenta JsonlSink con (registro, offset, largo) a medida que escribe"""
+
+    def __init__(self, data_path, path=None):
+        self.path = path or index_path(data_path)
+        self._f = open(self.path, "a")
+        self._entry = None
+
+    def add(self, record, offset, length):
+        t = record_time(record)
+        entry = self._entry
+        if t is not None:
+            bucket = int(t // BUCKET_SECONDS) * BUCKET_SECONDS
+            if entry is None or bucket > entry["bucket"]:
+                self._close_entry()
+                entry = self._entry = {"bucket": bucket, "t_min": t, "t_max": t,
+                                       "start": offset, "end": offset, "count": 0, "keys": {}}
+            else:
+                # Registros que llegan tarde quedan en el bucket abierto; ampliamos su rango
+                entry["t_min"] = min(entry["t_min"], t)
+                entry["t_max"] = max(entry["t_max"], t)
+        elif entry is None:
+            return
+
+        end = offset + length
+        entry["end"] = end
+        entry["count"] += 1
+        k = entry["keys"].get(record_key(record))
+        if k is None:
+            entry["keys"][record_key(record)] = [offset, end, 1]
+        else:
+            k[1] = end
+            k[2] += 1
+
+    def _close_entry(self):
+        if self._entry is not None:
+            self._f.write(json.dumps(self._entry) + "\n")
+            self._f.flush()
+            self._entry = None
+
+    def close(self):
+        self._close_entry()
+        self._f.close()
+
+
+def build_index(data_path):
+    """Reconstruye el índice completo de un archivo existente"""
+    tmp = index_path(data_path) + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    indexer = JsonlIndexer(data_path, path=tmp)
+    n = 0
+    offset = 0
+    with open_log(data_path, "rb") as f:
+        for raw in f:
+            try:
+                indexer.add(json.loads(raw), offset, len(raw))
+                n += 1
+            except json.JSONDecodeError:
+                pass
+            offset += len(raw)
+    indexer.close()
+    os.replace(tmp, index_path(data_path))
+    return n
+
+
+# --- CONSULTA ---
+def _read_entry_at(f, pos):
+    """Primera entrada completa a partir de pos (descarta la línea parcial)"""
+    f.seek(pos)
+    if pos:
+        f.readline()
+    line = f.readline()
+    return json.loads(line) if line.strip() else None
+
+
+def _seek_bucket(f, size, t_start):
+    """Búsqueda binaria sobre el archivo de índice. Posiciona f y devuelve True si quedó al inicio"""
+    target = t_start - (LATE_MARGIN + 1) * BUCKET_SECONDS
+    lo, hi = 0, size
+    while hi - lo > 4096:
+        mid = (lo + hi) // 2
+        entry = _read_entry_at(f, mid)
+        if entry is None or entry["bucket"] >= target:
+            hi = mid
+        else:
+            lo = mid
+    f.seek(lo)
+    if lo:
+        f.readline()
+    return lo == 0
+
+
+def _matching_spans(entry, source_ip, sensor):
+    """Rangos de bytes dentro del bucket que contienen la IP/sensor pedidos"""
+    if source_ip is None and sensor is None:
+        return [(entry["start"], entry["end"])]
+    spans = []
+    for key, (start, end, _) in entry["keys"].items():
+        ip, _, sen = key.partition("|")
+        if (source_ip is None or ip == source_ip) and (sensor is None or sen == sensor):
+            spans.append((start, end))
+    if not spans:
+        return []
+    return [(min(s for s, _ in spans), max(e for _, e in spans))]
+
+
+def _matches(record, t_start, t_end, source_ip, sensor):
+    if source_ip is not None and record.get("source_ip") != source_ip:
+        return False
+    if sensor is not None and record.get("sensor") != sensor:
+        return False
+    t = record_time(record)
+    return t is not None and t_start <= t <= t_end
+
+
+def _scan(data, start, end, t_start, t_end, source_ip, sensor):
+    data.seek(start)
+    pos = start
+    while end is None or pos < end:
+        raw = data.readline()
+        if not raw:
+            break
+        pos += len(raw)
+        try:
+            record = json.loads(raw)
+        except json.JSONDecodeError:
+            continue
+        if _matches(record, t_start, t_end, source_ip, sensor):
+            yield record
+
+
+def query(data_path, t_start, t_end, source_ip=None, sensor=None):
+    """
+    Genera los registros con t_start <= tiempo <= t_end (epoch), opcionalmente
+    filtrados por source_ip y sensor. Solo lee las regiones del archivo que el
+    índice marca como relevantes, más la cola aún no indexada.
+    Los huecos entre entradas consecutivas (un bucket que quedó abierto
+    cuando el proceso murió y nunca se escribió) también se recorren.
+    Acepta segmentos comprimidos (.gz/.xz): el seek se emula descomprimiendo.
+    """
+    idx = index_path(data_path)
+    indexed_end = 0
+    with open_log(data_path, "rb") as data:
+        if os.path.exists(idx):
+            size = os.path.getsize(idx)
+            with open(idx, "rb") as f:
+                # Desde el inicio del índice, lo anterior a la primera entrada también es un hueco
+                prev_end = 0 if _seek_bucket(f, size, t_start) else None
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if prev_end is not None and entry["start"] > prev_end:
+                        yield from _scan(data, prev_end, entry["start"], t_start, t_end, source_ip, sensor)
+                    prev_end = entry["end"]
+                    indexed_end = max(indexed_end, entry["end"])
+                    if entry["bucket"] > t_end + LATE_MARGIN * BUCKET_SECONDS:
+                        # Las entradas siguientes son aún más nuevas (un registro atrasado
+                        # queda en un bucket posterior a su tiempo, hasta LATE_MARGIN); solo falta el final
+                        indexed_end = _last_indexed_end(f, indexed_end)
+                        break
+                    if entry["t_max"] < t_start or entry["t_min"] > t_end:
+                        continue
+                    for start, end in _matching_spans(entry, source_ip, sensor):
+                        yield from _scan(data, start, end, t_start, t_end, source_ip, sensor)
+
+        # Cola sin indexar (bucket abierto o escrita antes de existir el índice)
+        yield from _scan(data, indexed_end, None, t_start, t_end, source_ip, sensor)
+
+
+def query_log(base, t_start, t_end, source_ip=None, sensor=None):
+    """query() sobre todos los segmentos de 'base' que pueden solaparse con el rango"""
+    segments = list_segments(base)
+    margin = (LATE_MARGIN + 1) * BUCKET_SECONDS
+    for i, (start, path) in enumerate(segments):
+        next_start = segments[i + 1][0] if i + 1 < len(segments) else float("inf")
+        if start - margin > t_end or next_start + margin < t_start:
+            continue
+        yield from query(path, t_start, t_end, source_ip, sensor)
+
+
+def _last_indexed_end(f, current):
+    """Fin del último bucket indexado, leyendo solo el final del archivo de índice"""
+    size = f.seek(0, os.SEEK_END)
+    entry = _read_entry_at(f, max(0, size - 65536))
+    last = None
+    while entry is not None:
+        last = entry
+        line = f.readline()
+        entry = json.loads(line) if line.strip() else None
+    return max(current, last["end"]) if last else current
+
+
+def parse_time(text):
+    """Acepta ISO completo ('2026-10-16T14:00') o solo hora ('14:00', hoy)"""
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        pass
+    h = datetime.strptime(text, "%H:%M:%S" if text.count(":") == 2 else "%H:%M")
+    now = datetime.now()
+    return now.replace(hour=h.hour, minute=h.minute, second=h.second, microsecond=0).timestamp()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Índice temporal de sensor_data.jsonl")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_build = sub.add_parser("build", help="(Re)construir el índice de un archivo o segmento")
+    p_build.add_argument("file", nargs="?", default="sensor_data.jsonl")
+
+    p_q = sub.add_parser("query", help="Registros en un rango de tiempo (todos los segmentos)")
+    p_q.add_argument("file", nargs="?", default="sensor_data.jsonl")
+    p_q.add_argument("--from", dest="t_from", required=True, help="ISO o HH:MM[:SS]")
+    p_q.add_argument("--to", dest="t_to", required=True, help="ISO o HH:MM[:SS]")
+    p_q.add_argument("--ip", help="source_ip")
+    p_q.add_argument("--sensor", help="BMI270, BME688, ...")
+    p_q.add_argument("--count", action="store_true", help="Solo contar")
+
+    args = parser.parse_args()
+    if args.cmd == "build":
+        n = build_index(args.file)
+        print(f"✅ Índice reconstruido: {n} registros -> {index_path(args.file)}")
+    else:
+        n = 0
+        for rec in query_log(args.file, parse_time(args.t_from), parse_time(args.t_to), args.ip, args.sensor):
+            n += 1
+            if not args.count:
+                sys.stdout.write(json.dumps(rec) + "\n")
+        if args.count:
+            print(n)
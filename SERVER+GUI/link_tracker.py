@@ -0,0 +1,275 @@
+import argparse
+import json
+import threading
+from collections import deque
+from datetime import datetime
+from jsonl_index import record_time
+from metrics import REGISTRY, SLOW_BUCKETS
+from segments import list_segments, open_log
+
+# --- CONFIGURACIÓN ---
+REORDER_WINDOW = 1024     # seq recientes que se recuerdan (duplicado vs atrasado)
+RESTART_SLACK_MS = 1000   # Reinicio: uptime retrocede más que esto y además seq vuelve atrás (ver _track)
+OFFSET_WINDOW = 60.0      # Segundos: el offset de reloj es el mínimo de (llegada - uptime) en esta ventana
+JITTER_GAIN = 1 / 16      # Suavizado del jitter entre llegadas (RFC 3550)
+BURST_GAP = 0.0005        # Llegadas más juntas que esto son del mismo paquete (lotes)
+REPORT_INTERVAL = 10.0    # Segundos entre registros LINK de cada dispositivo
+MAX_DELAYS = 20000        # Retrasos guardados por intervalo para los percentiles
+LINK_PROTOCOL = "LINK"
+
+# Cada registro con "seq" y "uptime_ms" recibe "delay_ms": retraso de una vía
+# por encima del mínimo observado (llegada - (uptime + offset)). Cada
+# REPORT_INTERVAL s se publica por source_ip:
+#   {"sensor":"LINK","type":"STATS","source_ip":..,"via":"UDP","received":..,"lost":..,
+#    "reordered":..,"duplicates":..,"restarts":..,"loss_rate":..,"jitter_ms":..,
+#    "clock_offset_s":..,"delay_p50_ms":..,"delay_p99_ms":..}
+# con los contadores del intervalo (ver summary() para los acumulados).
+
+STAT_FIELDS = ("received", "lost", "reordered", "duplicates", "restarts")
+
+
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+# --- ESTADO DE UN DISPOSITIVO ---
+class _Source:
+    def __init__(self):
+        self.max_seq = None
+        self.max_uptime = 0
+        self.recent = deque()      # Orden de llegada de los seq recientes
+        self.recent_uptime = {}    # seq reciente -> su uptime_ms (mismo seq con otro uptime = otro arranque)
+        self.recent_count = {}     # seq reciente -> veces que está en 'recent' (duplicados)
+        self.totals = dict.fromkeys(STAT_FIELDS, 0)
+        self.interval = dict.fromkeys(STAT_FIELDS, 0)
+        self.jitter_ms = 0.0
+        self.offsets = deque()     # (llegada, llegada - uptime) con offset creciente: mínimo al frente
+        self.offset = None
+        self.pending = None        # Último (llegada, uptime) en orden; aún puede llegar más del mismo paquete
+        self.prev_packet = None    # Último (llegada, uptime) del paquete anterior
+        self.delays = []
+        self.via = None
+        self.reported_at = None
+
+    def count(self, field, n=1):
+        self.totals[field] += n
+        self.interval[field] += n
+
+    def reset(self):
+        """Reinicio del dispositivo: seq y uptime vuelven a cero"""
+        self.max_seq = None
+        self.max_uptime = 0
+        self.recent.clear()
+        self.recent_uptime.clear()
+        self.recent_count.clear()
+        self.offsets.clear()
+        self.pending = self.prev_packet = None
+        self.count("restarts")
+
+    def recover(self):
+        """Un seq ya contado como perdido llegó tarde. Si la pérdida se informó en
+        un intervalo anterior, el actual no se descuenta (nunca queda negativo)"""
+        if self.totals["lost"] > 0:
+            self.totals["lost"] -= 1
+        if self.interval["lost"] > 0:
+            self.interval["lost"] -= 1
+
+    def remember(self, seq, uptime):
+        self.recent.append(seq)
+        self.recent_uptime[seq] = uptime
+        self.recent_count[seq] = self.recent_count.get(seq, 0) + 1
+        if len(self.recent) > REORDER_WINDOW:
+            old = self.recent.popleft()
+            left = self.recent_count[old] - 1
+            if left:
+                self.recent_count[old] = left
+            else:
+                del self.recent_count[old]
+                del self.recent_uptime[old]
+
+    def update_offset(self, arrival, uptime):
+        off = arrival - uptime / 1000.0
+        offsets = self.offsets
+        while offsets and offsets[-1][1] >= off:
+            offsets.pop()
+        offsets.append((arrival, off))
+        while offsets[0][0] < arrival - OFFSET_WINDOW:
+            offsets.popleft()
+        self.offset = offsets[0][1]
+        return off - self.offset
+
+    def update_jitter(self, arrival, uptime):
+        """
+        Jitter entre paquetes consecutivos en orden. Las muestras de un lote
+        llegan juntas: se compara el último de cada paquete con el del anterior.
+        """
+        if self.pending is not None and arrival - self.pending[0] > BURST_GAP:
+            if self.prev_packet is not None:
+                d = (self.pending[0] - self.prev_packet[0]) - (self.pending[1] - self.prev_packet[1]) / 1000.0
+                self.jitter_ms += (abs(d) * 1000.0 - self.jitter_ms) * JITTER_GAIN
+            self.prev_packet = self.pending
+        self.pending = (arrival, uptime)
+
+
+# --- SEGUIMIENTO (SINK PARA BatchedWriter) ---
+class LinkTracker:
+    """
+    Pérdidas, reordenamiento, duplicados, jitter y offset de reloj por
+    source_ip a partir de "seq" y "uptime_ms". Va como primer sink del
+    BatchedWriter: agrega "delay_ms" a los registros antes de que se
+    persistan y publica un registro LINK por dispositivo cada REPORT_INTERVAL s.
+    """
+
+    def __init__(self, publish, report_interval=REPORT_INTERVAL, registry=REGISTRY):
+        self.publish = publish
+        self.report_interval = report_interval
+        self.sources = {}
+        self._lock = threading.Lock()
+        self.delay_hist = None
+        if registry is not None:
+            self._register(registry)
+
+    def _register(self, registry):
+        self.delay_hist = registry.histogram("link_delay_seconds",
+                                             "Retraso de una via sobre el minimo observado", ("protocol",),
+                                             SLOW_BUCKETS)
+        for field in STAT_FIELDS:
+            registry.callback(f"link_{field}_total", f"Registros {field} segun seq, por dispositivo",
+                              lambda field=field: self._per_source(lambda s: s.totals[field]),
+                              labels=("source_ip",), kind="counter")
+        registry.callback("link_jitter_ms", "Jitter entre llegadas (RFC 3550)",
+                          lambda: self._per_source(lambda s: round(s.jitter_ms, 3)), labels=("source_ip",))
+        registry.callback("link_clock_offset_seconds", "Hora del servidor menos uptime del dispositivo",
+                          lambda: self._per_source(lambda s: s.offset), labels=("source_ip",))
+
+    def _per_source(self, fn):
+        with self._lock:
+            return {(ip,): fn(s) for ip, s in self.sources.items() if fn(s) is not None}
+
+    # --- INTERFAZ DE SINK ---
+    def write_batch(self, records):
+        with self._lock:
+            for r in records:
+                seq = r.get("seq")
+                if seq is None or "uptime_ms" not in r:
+                    continue
+                arrival = record_time(r)
+                if arrival is None:
+                    continue
+                self._track(r, seq, r["uptime_ms"], arrival)
+
+    def flush(self, fsync=False):
+        pass
+
+    def close(self):
+        pass
+
+    # --- CÁLCULO ---
+    def _track(self, r, seq, uptime, arrival):
+        ip = r.get("source_ip", "")
+        s = self.sources.get(ip)
+        if s is None:
+            s = self.sources[ip] = _Source()
+            s.reported_at = arrival
+        s.via = r.get("protocol", s.via)
+
+        # Reinicio solo si ambos relojes volvieron atrás: uptime más de RESTART_SLACK_MS y
+        # seq fuera de la ventana de reorden (o un seq ya visto, pero con otro uptime).
+        # Un paquete atrasado conserva su seq original: se cuenta como reordenado
+        if s.max_seq is not None and seq <= s.max_seq and uptime + RESTART_SLACK_MS < s.max_uptime:
+            seen = s.recent_uptime.get(seq)
+            if s.max_seq - seq > REORDER_WINDOW or (seen is not None and seen != uptime):
+                s.reset()
+
+        s.count("received")
+        if s.max_seq is None or seq > s.max_seq:
+            if s.max_seq is not None and seq > s.max_seq + 1:
+                s.count("lost", seq - s.max_seq - 1)
+            s.max_seq = seq
+            s.max_uptime = max(s.max_uptime, uptime)
+            s.update_jitter(arrival, uptime)
+        elif seq in s.recent_uptime:
+            s.count("duplicates")
+        else:
+            # Llegó tarde: ya se había contado como perdido
+            s.count("reordered")
+            s.recover()
+        s.remember(seq, uptime)
+
+        delay = s.update_offset(arrival, uptime)
+        r["delay_ms"] = round(delay * 1000.0, 3)
+        if self.delay_hist is not None:
+            self.delay_hist.observe(delay, s.via or "")
+        if len(s.delays) < MAX_DELAYS:
+            s.delays.append(delay * 1000.0)
+
+        if arrival - s.reported_at >= self.report_interval:
+            self.publish(self._report(ip, s, r))
+            s.reported_at = arrival
+
+    def _report(self, ip, s, last):
+        iv = s.interval
+        expected = iv["received"] - iv["duplicates"] + iv["lost"]
+        rec = {"sensor": "LINK", "type": "STATS", "source_ip": ip, "via": s.via}
+        rec.update(iv)
+        rec.update({
+            "loss_rate": round(max(0, iv["lost"]) / expected, 6) if expected > 0 else 0.0,
+            "jitter_ms": round(s.jitter_ms, 3),
+            "clock_offset_s": round(s.offset, 6) if s.offset is not None else None,
+            "delay_p50_ms": _percentile(s.delays, 50),
+            "delay_p99_ms": _percentile(s.delays, 99),
+        })
+        for k in ("timestamp_server", "timestamp"):
+            if k in last:
+                rec[k] = last[k]
+        rec["protocol"] = LINK_PROTOCOL
+        s.interval = dict.fromkeys(STAT_FIELDS, 0)
+        s.delays = []
+        return rec
+
+    def summary(self):
+        """Acumulados por source_ip desde el inicio"""
+        with self._lock:
+            out = {}
+            for ip, s in self.sources.items():
+                t = s.totals
+                expected = t["received"] - t["duplicates"] + t["lost"]
+                out[ip] = dict(t, via=s.via, jitter_ms=round(s.jitter_ms, 3),
+                               loss_rate=round(t["lost"] / expected, 6) if expected > 0 else 0.0,
+                               clock_offset_s=s.offset)
+            return out
+
+
+def analyze(base):
+    """Recorre un sensor_data.jsonl (y sus segmentos) y devuelve summary() y los intervalos"""
+    reports = []
+    tracker = LinkTracker(reports.append, registry=None)
+    for _, path in list_segments(base):
+        batch = []
+        with open_log(path, "rb") as f:
+            for line in f:
+                try:
+                    batch.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+                if len(batch) >= 10000:
+                    tracker.write_batch(batch)
+                    batch = []
+        tracker.write_batch(batch)
+    return tracker.summary(), reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pérdidas, reordenamiento y jitter por dispositivo")
+    parser.add_argument("file", nargs="?", default="sensor_data.jsonl")
+    args = parser.parse_args()
+    summary, _ = analyze(args.file)
+    for ip, st in sorted(summary.items()):
+        offset = datetime.fromtimestamp(st["clock_offset_s"]).isoformat() if st["clock_offset_s"] else "--"
+        print(f"📡 {ip} ({st['via']}): recibidos {st['received']} | perdidos {st['lost']} "
+              f"({100 * st['loss_rate']:.2f}%) | reordenados {st['reordered']} | "
+              f"duplicados {st['duplicates']} | reinicios {st['restarts']} | "
+              f"jitter {st['jitter_ms']} ms | arranque {offset}")
@@ -0,0 +1,271 @@
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- CONFIGURACIÓN ---
+METRICS_HOST = "127.0.0.1"   # Solo local: el endpoint no tiene autenticación
+METRICS_PORT = 9100          # Servidor; la GUI usa METRICS_PORT + 1
+
+# Límites de los histogramas (segundos)
+FAST_BUCKETS = (5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 5e-3)        # decodificación
+SLOW_BUCKETS = (1e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.5, 1.0)  # escritura, cuadros
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+# --- MÉTRICAS ---
+class Counter:
+    """Contador monótono por combinación de etiquetas: inc("UDP", "10.0.0.5")"""
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, n=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + n
+
+    def total(self):
+        with self._lock:
+            return sum(self.values.values())
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.values)
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+    def render(self, values):
+        for key, v in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labels, key)} {v}"
+
+
+class Histogram:
+    """
+    Histograma de latencias con límites fijos: observe() solo busca el bin y
+    suma (sin guardar muestras). Se exporta acumulado, como pide Prometheus.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=SLOW_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.values = {}   # etiquetas -> [conteos por bin (+Inf al final), suma, cantidad]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            v = self.values.get(labels)
+            if v is None:
+                v = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            v[0][i] += 1
+            v[1] += value
+            v[2] += 1
+
+    def totals(self):
+        """(cantidad, suma) de todas las etiquetas"""
+        with self._lock:
+            return sum(v[2] for v in self.values.values()), sum(v[1] for v in self.values.values())
+
+    def quantile(self, q):
+        """Estimación desde los bins (límite superior del bin que contiene el cuantil)"""
+        with self._lock:
+            counts = [sum(c) for c in zip(*(v[0] for v in self.values.values()))]
+        total = sum(counts)
+        if not total:
+            return None
+        acc = 0
+        for i, c in enumerate(counts):
+            acc += c
+            if acc >= q * total:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+
+    def snapshot(self):
+        with self._lock:
+            return {k: [list(v[0]), v[1], v[2]] for k, v in self.values.items()}
+
+    @staticmethod
+    def merge(a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def render(self, values):
+        for key, (counts, total, n) in sorted(values.items()):
+            acc = 0
+            for bound, c in zip(self.buckets + ("+Inf",), counts):
+                acc += c
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_labels(self.labels, key, le)} {acc}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {total}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {n}"
+
+
+class CallbackMetric:
+    """
+    Valor leído al exportar (profundidad de colas, contadores que ya lleva
+    otro objeto). fn() devuelve un número o {etiquetas: número}.
+    """
+
+    def __init__(self, name, help, fn, labels=(), kind="gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labels = labels
+        self.kind = kind
+
+    def snapshot(self):
+        try:
+            v = self.fn()
+        except Exception:
+            return {}
+        if v is None:
+            return {}
+        return v if isinstance(v, dict) else {(): v}
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+    def render(self, values):
+        for key, v in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labels, key)} {v}"
+
+
+# --- REGISTRO ---
+class Registry:
+    """
+    Conjunto de métricas de un proceso. Las fuentes remotas (p.ej. los workers
+    UDP, que corren en otros procesos) entregan snapshots {nombre: valores}
+    que se suman a los locales al exportar.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.sources = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=SLOW_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def callback(self, name, help, fn, labels=(), kind="gauge"):
+        """Registra (o reemplaza, si ya existe con ese nombre) una métrica calculada al exportar"""
+        return self._add(CallbackMetric(name, help, fn, labels, kind))
+
+    def add_source(self, fn):
+        """fn() -> lista de snapshots de otros procesos"""
+        self.sources.append(fn)
+
+    def snapshot(self):
+        """{nombre: valores} de las métricas propias (se puede enviar a otro proceso)"""
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return {m.name: m.snapshot() for m in metrics if not isinstance(m, CallbackMetric)}
+
+    def render(self):
+        """Texto en formato de exposición de Prometheus (v0.0.4)"""
+        remote = [snap for fn in self.sources for snap in (fn() or [])]
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for m in metrics:
+            values = m.snapshot()
+            for snap in remote:
+                for key, v in snap.get(m.name, {}).items():
+                    key = tuple(key)
+                    values[key] = m.merge(values[key], v) if key in values else v
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.render(values))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- MÉTRICAS DE LA INGESTA (compartidas por servidor, GUI y workers) ---
+PACKETS = REGISTRY.counter("ingest_packets_total", "Paquetes UDP o lineas/tramas TCP recibidos",
+                           ("protocol", "source_ip"))
+RECORDS = REGISTRY.counter("ingest_records_total", "Registros decodificados", ("protocol", "source_ip"))
+PARSE_ERRORS = REGISTRY.counter("ingest_parse_errors_total", "Paquetes que no se pudieron decodificar",
+                                ("protocol", "source_ip"))
+DECODE_SECONDS = REGISTRY.histogram("ingest_decode_seconds", "Tiempo de decode_payload por paquete",
+                                    ("protocol",), FAST_BUCKETS)
+WRITE_SECONDS = REGISTRY.histogram("writer_write_seconds", "Tiempo de write_batch por lote", ("sink",))
+FLUSH_SECONDS = REGISTRY.histogram("writer_flush_seconds", "Tiempo de flush/fsync por lote", ("sink",))
+
+
+def observe_decode(decode, payload, protocol, source_ip):
+    """decode(payload) midiendo tiempo, paquetes, registros y errores. Relanza ValueError."""
+    t0 = time.perf_counter()
+    try:
+        records = decode(payload)
+    except ValueError:
+        PARSE_ERRORS.inc(protocol, source_ip)
+        raise
+    finally:
+        DECODE_SECONDS.observe(time.perf_counter() - t0, protocol)
+        PACKETS.inc(protocol, source_ip)
+    RECORDS.inc(protocol, source_ip, n=len(records))
+    return records
+
+
+# --- ENDPOINT HTTP ---
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Sin una línea por cada scrape
+
+
+class MetricsServer:
+    """GET /metrics en un hilo propio (http.server, sin dependencias)"""
+
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT, registry=REGISTRY):
+        handler = type("MetricsHandler", (_Handler,), {"registry": registry})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.address = self.httpd.server_address
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="metrics_http", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
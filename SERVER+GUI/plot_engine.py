@@ -0,0 +1,280 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from rollups import ROLLUP_DIR, pick_tier, tier_seconds
+
+# --- VENTANAS DE HISTORIAL (etiqueta -> segundos) ---
+HISTORY_WINDOWS = {
+    "10 s": 10,
+    "1 min": 60,
+    "10 min": 600,
+    "1 h": 3600,
+    "6 h": 6 * 3600,
+    "1 día": 86400,
+    "1 semana": 7 * 86400,
+}
+RAW_WINDOW_MAX = 3600     # Ventanas mayores se leen de los rollups (rollups.py)
+ROLLUP_REREAD = 10.0      # Segundos entre relecturas de los archivos de rollup
+ROLLUP_REDRAW = 1.0       # Segundos entre redibujos de una curva de rollup
+
+
+def _minmax_bins(t, lo, hi, bw):
+    """Agrupa muestras (t ordenado) en bins de ancho bw: (inicio, mín, máx) por bin"""
+    b = np.floor(t / bw)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(b)) + 1))
+    return b[starts] * bw, np.minimum.reduceat(lo, starts), np.maximum.reduceat(hi, starts)
+
+
+def _pairs(bx, lo, hi, origin):
+    """Cada bin como dos puntos (mín, máx) en la misma x: conserva los picos"""
+    x = np.repeat(bx - origin, 2)
+    y = np.empty(len(x))
+    y[0::2] = lo
+    y[1::2] = hi
+    return x, y
+
+
+# --- SERIE DECIMADA PARA UNA CURVA ---
+class DecimatedSeries:
+    """
+    Prepara los datos de una curva a partir de su RingBuffer:
+      - Recorte a la ventana visible [t_now - window, t_now].
+      - Si hay más muestras que 2x el ancho en píxeles, decimación min/max
+        (conserva los picos): un par (mín, máx) por columna de píxel.
+      - Los bins ya cerrados se cachean; cada cuadro solo procesa las muestras
+        nuevas. update() devuelve None si la curva no cambió (no hay que redibujar).
+    """
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.head_seen = -1
+        self.bin_width = None
+        self.cursor = 0          # Primera muestra del ring del bin aún abierto
+        self.bins_x = np.empty(0)
+        self.bins_lo = np.empty(0)
+        self.bins_hi = np.empty(0)
+
+    def invalidate(self):
+        """Forzar recálculo completo (cambio de ventana o de ancho)"""
+        self.head_seen = -1
+        self.bin_width = None
+
+    def update(self, t_now, window, px, origin=0.0):
+        """(x, y) para setData, con x = t - origin; None si nada cambió"""
+        head = self.ring.head
+        if head == self.head_seen:
+            return None
+        self.head_seen = head
+
+        t_all, y_all = self.ring.last(self.ring.capacity)
+        first = np.searchsorted(t_all, t_now - window)
+        if len(t_all) - first <= 2 * px:
+            # Pocas muestras: se grafican tal cual (y es una vista del ring)
+            self.bin_width = None
+            return t_all[first:] - origin, y_all[first:]
+
+        bw = window / max(1, px)
+        if bw != self.bin_width:
+            self._reset(bw, head - len(t_all) + first)
+        return self._decimate(t_now - window, origin)
+
+    def _reset(self, bin_width, cursor):
+        self.bin_width = bin_width
+        self.cursor = cursor
+        self.bins_x = np.empty(0)
+        self.bins_lo = np.empty(0)
+        self.bins_hi = np.empty(0)
+
+    def _decimate(self, t_min, origin):
+        bw = self.bin_width
+        t, y, head, lost = self.ring.since(self.cursor)
+        if not len(t):
+            return self._output(np.empty(0), np.empty(0), np.empty(0), origin)
+        bx, lo, hi = _minmax_bins(t, y, y, bw)
+
+        # Todos los bins menos el último están cerrados: al caché.
+        # El último se recalcula el próximo cuadro desde su primera muestra
+        self.cursor = head - np.count_nonzero(t >= bx[-1])
+        keep = self.bins_x >= t_min - bw
+        self.bins_x = np.concatenate((self.bins_x[keep], bx[:-1]))
+        self.bins_lo = np.concatenate((self.bins_lo[keep], lo[:-1]))
+        self.bins_hi = np.concatenate((self.bins_hi[keep], hi[:-1]))
+        return self._output(bx[-1:], lo[-1:], hi[-1:], origin)
+
+    def _output(self, tail_x, tail_lo, tail_hi, origin):
+        return _pairs(np.concatenate((self.bins_x, tail_x)),
+                      np.concatenate((self.bins_lo, tail_lo)),
+                      np.concatenate((self.bins_hi, tail_hi)), origin)
+
+
+# --- LECTURA INCREMENTAL DE ROLLUPS ---
+class _DayFile:
+    """Un archivo diario de un tier: offset ya leído e intervalos combinados por t"""
+    __slots__ = ("path", "offset", "rows", "cache")
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.rows = {}    # t -> {campo: [n, suma, mín, máx]}
+        self.cache = {}   # campo -> (t, mín, máx) ordenados
+
+    def tail(self, source_ip, sensor):
+        """Lee solo las líneas completas agregadas desde la última vez"""
+        try:
+            if os.path.getsize(self.path) < self.offset:
+                self.offset, self.rows = 0, {}  # Archivo reemplazado
+            with open(self.path, "rb") as f:
+                f.seek(self.offset)
+                data = f.read()
+        except OSError:
+            return
+        end = data.rfind(b"\n") + 1
+        if not end:
+            return
+        self.offset += end
+        for line in data[:end].splitlines():
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if source_ip is not None and row.get("source_ip") != source_ip:
+                continue
+            if sensor is not None and row.get("sensor") != sensor:
+                continue
+            stats = self.rows.setdefault(row["t"], {})
+            for field, (n, mean, lo, hi) in row["fields"].items():
+                m = stats.get(field)
+                if m is None:
+                    stats[field] = [n, mean * n, lo, hi]
+                else:
+                    m[0] += n
+                    m[1] += mean * n
+                    m[2] = min(m[2], lo)
+                    m[3] = max(m[3], hi)
+        self.cache = {}
+
+    def series(self, field):
+        out = self.cache.get(field)
+        if out is None:
+            ts = sorted(t for t, stats in self.rows.items() if field in stats)
+            out = self.cache[field] = (np.array(ts, dtype=float),
+                                       np.array([self.rows[t][field][2] for t in ts], dtype=float),
+                                       np.array([self.rows[t][field][3] for t in ts], dtype=float))
+        return out
+
+
+class RollupReader:
+    """
+    Lector de un tier para la GUI. Cada archivo diario se parsea una vez y
+    después solo se leen las líneas nuevas (desde su offset); las series por
+    campo se cachean por día y solo se rehacen las del día que creció. Un
+    panel usa uno por tier para todas sus curvas.
+    """
+
+    def __init__(self, tier, root=ROLLUP_DIR, source_ip=None, sensor=None):
+        self.tier = tier
+        self.size = tier_seconds(tier)
+        self.root = root
+        self.source_ip = source_ip
+        self.sensor = sensor
+        self.days = {}        # ruta -> _DayFile
+        self.read_at = None   # time.monotonic() de la última lectura
+
+    def _paths(self, t_start, t_end):
+        day = datetime.fromtimestamp(t_start - self.size).date()
+        last = datetime.fromtimestamp(t_end).date()
+        paths = []
+        while day <= last:
+            paths.append(os.path.join(self.root, self.tier, day.strftime("%Y%m%d") + ".jsonl"))
+            day += timedelta(days=1)
+        return paths
+
+    def refresh(self, t_start, t_end, max_age=0.0):
+        """Lee lo nuevo si pasaron max_age s o si la ventana incluye días aún no leídos"""
+        paths = self._paths(t_start, t_end)
+        now = time.monotonic()
+        if (self.read_at is not None and now - self.read_at < max_age
+                and all(path in self.days for path in paths)):
+            return
+        self.days = {path: self.days.get(path) or _DayFile(path) for path in paths}
+        for day in self.days.values():
+            day.tail(self.source_ip, self.sensor)
+        self.read_at = now
+
+    def series(self, field, t_start, t_end):
+        """(t, mín, máx) del campo en los intervalos que se solapan con [t_start, t_end]"""
+        parts = [day.series(field) for day in self.days.values()]
+        if not parts:
+            return np.empty(0), np.empty(0), np.empty(0)
+        t, lo, hi = (np.concatenate(cols) for cols in zip(*parts))
+        keep = (t + self.size > t_start) & (t <= t_end)
+        return t[keep], lo[keep], hi[keep]
+
+
+class RollupCache:
+    """Lectores de rollups de un panel (uno por tier), compartidos por todas sus curvas"""
+
+    def __init__(self, root=ROLLUP_DIR, source_ip=None):
+        self.root = root
+        self.source_ip = source_ip
+        self.readers = {}
+
+    def series(self, tier, field, t_start, t_end):
+        reader = self.readers.get(tier)
+        if reader is None:
+            reader = self.readers[tier] = RollupReader(tier, self.root, self.source_ip)
+        # La primera curva del panel lee los archivos; las demás usan lo ya leído
+        reader.refresh(t_start, t_end, max_age=ROLLUP_REREAD)
+        return reader.series(field, t_start, t_end)
+
+
+# --- SERIE DESDE ROLLUPS (VENTANAS LARGAS) ---
+class RollupSeries:
+    """
+    Para ventanas de horas a semanas: lee el tier más grueso que aún da
+    suficientes puntos (pick_tier) y completa el tramo más reciente, aún no
+    cerrado en disco, con las muestras del RingBuffer agrupadas al mismo ancho.
+    Toma lo nuevo de los archivos cada ROLLUP_REREAD s (vía 'cache', el
+    RollupCache del panel) y redibuja cada ROLLUP_REDRAW s.
+    Con source_ip solo se leen los intervalos de ese dispositivo.
+    """
+
+    def __init__(self, ring, field, root=ROLLUP_DIR, source_ip=None, cache=None):
+        self.ring = ring
+        self.field = field
+        self.cache = RollupCache(root, source_ip) if cache is None else cache
+        self.invalidate()
+
+    def invalidate(self):
+        self.tier = None
+        self.read_at = 0.0
+        self.drawn_at = 0.0
+        self.disk = (np.empty(0), np.empty(0), np.empty(0))
+
+    def update(self, t_now, window, px, origin=0.0):
+        mono = time.monotonic()
+        tier = pick_tier(window)
+        if tier != self.tier or mono - self.read_at >= ROLLUP_REREAD:
+            self.disk = self.cache.series(tier, self.field, t_now - window, t_now)
+            self.tier = tier
+            self.read_at = mono
+        elif mono - self.drawn_at < ROLLUP_REDRAW:
+            return None
+        self.drawn_at = mono
+
+        size = tier_seconds(tier)
+        bx, lo, hi = self.disk
+        tail_from = bx[-1] + size if len(bx) else t_now - window
+        t, y = self.ring.last(self.ring.capacity)
+        first = np.searchsorted(t, tail_from)
+        t, y = t[first:], y[first:]
+        if len(t):
+            tx, tlo, thi = _minmax_bins(t, y, y, size)
+            bx, lo, hi = np.concatenate((bx, tx)), np.concatenate((lo, tlo)), np.concatenate((hi, thi))
+
+        # Si aún hay más intervalos que píxeles, se agrupan otra vez por columna
+        if len(bx) > 2 * px:
+            bx, lo, hi = _minmax_bins(bx, lo, hi, window / max(1, px))
+        return _pairs(bx, lo, hi, origin)
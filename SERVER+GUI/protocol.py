@@ -0,0 +1,224 @@
+import json
+import re
+import struct
+
+# --- TRAMA BINARIA (ver main/telemetry_frame.h) ---
+# v1: magic, version, sensor_id, n_fields, seq (uint32), t_ms (uint32), n_fields * float32
+# v2: magic, version, sensor_id, n_fields, seq (uint32), count (uint16), reservado (uint16),
+#     count * (t_ms uint32 + n_fields * float32)
+FRAME_MAGIC = 0xA5
+FRAME_VERSION = 1
+FRAME_VERSION_BATCH = 2
+FRAME_HEADER = struct.Struct('<BBBBII')
+FRAME_HEADER_SIZE = FRAME_HEADER.size  # 12 bytes
+BATCH_COUNT = struct.Struct('<H')
+
+# sensor_id -> (sensor, type, campos en orden)
+FRAME_SCHEMAS = {
+    1: ("BMI270", "RAW", ("ax", "ay", "az", "gx", "gy", "gz")),
+    2: ("BMI270", "RMS", ("rms", "N")),
+    3: ("BME688", "RAW", ("temp", "press", "hum", "gas")),
+}
+
+# Structs precompilados por n_fields (muestra simple y muestra de lote con t_ms)
+_field_structs = {}
+_sample_structs = {}
+
+
+def _fields_struct(n_fields):
+    st = _field_structs.get(n_fields)
+    if st is None:
+        st = _field_structs[n_fields] = struct.Struct(f'<{n_fields}f')
+    return st
+
+
+def _sample_struct(n_fields):
+    st = _sample_structs.get(n_fields)
+    if st is None:
+        st = _sample_structs[n_fields] = struct.Struct(f'<I{n_fields}f')
+    return st
+
+
+def is_binary(data):
+    """True si el payload comienza con el byte mágico (el JSON siempre empieza con '{')"""
+    return len(data) > 0 and data[0] == FRAME_MAGIC
+
+
+def frame_size(buf, start=0):
+    """
+    Tamaño de la trama que empieza en buf[start]:
+      0  -> no es una trama binaria
+      -1 -> trama incompleta (faltan bytes)
+      >0 -> largo total en bytes
+    """
+    if buf[start] != FRAME_MAGIC:
+        return 0
+    if len(buf) - start < FRAME_HEADER_SIZE:
+        return -1
+    n_fields = buf[start + 3]
+    if buf[start + 1] == FRAME_VERSION_BATCH:
+        count = BATCH_COUNT.unpack_from(buf, start + 8)[0]
+        size = FRAME_HEADER_SIZE + count * (4 + 4 * n_fields)
+    else:
+        size = FRAME_HEADER_SIZE + 4 * n_fields
+    if len(buf) - start < size:
+        return -1
+    return size
+
+
+def _make_record(sensor_id, values, seq, t_ms):
+    schema = FRAME_SCHEMAS.get(sensor_id)
+    if schema is None:
+        record = {"sensor": f"ID{sensor_id}", "type": "RAW"}
+        record.update((f"f{i}", v) for i, v in enumerate(values))
+    else:
+        sensor, dtype, names = schema
+        record = {"sensor": sensor, "type": dtype}
+        record.update(zip(names, values))
+        if "N" in record:
+            record["N"] = int(record["N"])
+    record["seq"] = seq
+    record["uptime_ms"] = t_ms
+    return record
+
+
+def decode_frame(data, offset=0):
+    """
+    Decodifica una trama binaria (v1 o lote v2) en una lista de dicts con el
+    mismo esquema que el JSON del firmware, una entrada por muestra.
+    """
+    magic, version, sensor_id, n_fields, seq, t_ms = FRAME_HEADER.unpack_from(data, offset)
+    if version == FRAME_VERSION:
+        values = _fields_struct(n_fields).unpack_from(data, offset + FRAME_HEADER_SIZE)
+        return [_make_record(sensor_id, values, seq, t_ms)]
+    if version == FRAME_VERSION_BATCH:
+        count = BATCH_COUNT.unpack_from(data, offset + 8)[0]
+        st = _sample_struct(n_fields)
+        pos = offset + FRAME_HEADER_SIZE
+        records = []
+        for i in range(count):
+            sample = st.unpack_from(data, pos)
+            records.append(_make_record(sensor_id, sample[1:], seq + i, sample[0]))
+            pos += st.size
+        return records
+    raise ValueError(f"Versión de trama no soportada: {version}")
+
+
+def expand_json_batch(record):
+    """
+    Lote JSON del firmware:
+      {"sensor":..,"type":"RAW","seq":S,"fields":[..],"samples":[[t_ms, v1, ..], ..]}
+    -> un registro por muestra con seq = S + i y uptime_ms = t_ms
+    """
+    fields = record.pop("fields")
+    samples = record.pop("samples")
+    first_seq = record.pop("seq", None)
+    records = []
+    for i, sample in enumerate(samples):
+        rec = dict(record)
+        rec.update(zip(fields, sample[1:]))
+        if first_seq is not None:
+            rec["seq"] = first_seq + i
+        rec["uptime_ms"] = sample[0]
+        records.append(rec)
+    return records
+
+
+# --- RUTA RÁPIDA PARA EL JSON DEL FIRMWARE ---
+# Las tres plantillas snprintf de sensor_net_task (main/main.c): siempre las
+# mismas claves, en el mismo orden y con los mismos separadores. Se reconocen
+# por el prefijo y los valores se sacan con una regex directo de los bytes;
+# cualquier otra cosa (lotes, comandos, NaN, espacios de más) va a json.loads.
+FAST_JSON = True
+JSON_TEMPLATES = (
+    ("BMI270", "RAW", (("ax", "%.2f"), ("ay", "%.2f"), ("az", "%.2f"),
+                       ("gx", "%.2f"), ("gy", "%.2f"), ("gz", "%.2f"))),
+    ("BMI270", "RMS", (("rms", "%.3f"), ("N", "%d"))),
+    ("BME688", "RAW", (("temp", "%.2f"), ("press", "%.2f"), ("hum", "%.2f"), ("gas", "%.2f"))),
+)
+STAMP_FIELDS = (("seq", "%lu"), ("uptime_ms", "%lu"))  # Opcional: firmware anterior no los manda
+_PREFIX = '{"sensor":"%s", "type":"%s", '
+_PREFIX_LEN = len(_PREFIX % ("BMI270", "RAW"))
+_NUMBER = {"%.2f": rb'(-?\d+\.\d+)', "%.3f": rb'(-?\d+\.\d+)', "%d": rb'(-?\d+)', "%lu": rb'(\d+)'}
+
+
+def _compile_template(sensor, dtype, fields):
+    def body(fields):
+        return b", ".join(b'"%s":%s' % (k.encode(), _NUMBER[fmt]) for k, fmt in fields)
+    pattern = body(fields) + b"(?:, " + body(STAMP_FIELDS) + rb")?\}[ \t\r\n]*\Z"
+    keys = tuple(k for k, _ in fields)
+    ints = tuple((i, k) for i, (k, fmt) in enumerate(fields) if not fmt.endswith("f"))
+    return sensor, dtype, re.compile(pattern), keys, ints
+
+
+_FAST_TEMPLATES = {(_PREFIX % (sensor, dtype)).encode(): _compile_template(sensor, dtype, fields)
+                   for sensor, dtype, fields in JSON_TEMPLATES}
+
+
+def decode_fast_json(data):
+    """Registro de una plantilla del firmware, o None si no calza exacto (usar json.loads)"""
+    tpl = _FAST_TEMPLATES.get(bytes(data[:_PREFIX_LEN]))
+    if tpl is None:
+        return None
+    sensor, dtype, regex, keys, ints = tpl
+    m = regex.match(data, _PREFIX_LEN)
+    if m is None:
+        return None
+    groups = m.groups()
+    record = {"sensor": sensor, "type": dtype}
+    record.update(zip(keys, map(float, groups)))   # zip corta en los campos de la plantilla
+    for i, key in ints:
+        record[key] = int(groups[i])
+    if groups[-1] is not None:
+        record["seq"] = int(groups[-2])
+        record["uptime_ms"] = int(groups[-1])
+    return record
+
+
+def encode_json(record):
+    """Payload tal como lo arma el firmware (bytes), o None si no es de una plantilla conocida"""
+    for sensor, dtype, fields in JSON_TEMPLATES:
+        if record.get("sensor") == sensor and record.get("type") == dtype:
+            break
+    else:
+        return None
+    if "seq" in record and "uptime_ms" in record:
+        fields = fields + STAMP_FIELDS
+    try:
+        body = ", ".join(f'"{k}":' + (fmt.replace("%lu", "%d") % record[k]) for k, fmt in fields)
+    except (KeyError, TypeError):
+        return None
+    return (_PREFIX % (sensor, dtype) + body + "}\n").encode()
+
+
+def decode_payload(data):
+    """
+    Decodifica un datagrama UDP o una línea/trama TCP a una lista de registros.
+    Detecta el formato por el byte mágico y si no, cae a JSON.
+    Lanza ValueError si el contenido no es válido.
+    """
+    if not is_binary(data):
+        if FAST_JSON:
+            record = decode_fast_json(data)
+            if record is not None:
+                return [record]
+        record = json.loads(data)
+        if not isinstance(record, dict):
+            # JSON válido pero no un registro (ej. "5" o una lista)
+            raise ValueError(f"Se esperaba un objeto JSON, llegó {type(record).__name__}")
+        if "samples" in record:
+            try:
+                return expand_json_batch(record)
+            except (KeyError, TypeError, IndexError) as e:
+                raise ValueError(f"Lote JSON inválido: {e}")
+        return [record]
+
+    records = []
+    offset = 0
+    while offset < len(data):
+        size = frame_size(data, offset)
+        if size <= 0:
+            raise ValueError(f"Trama binaria truncada o inválida en byte {offset}")
+        records.extend(decode_frame(data, offset))
+        offset += size
+    return records
@@ -0,0 +1,306 @@
+import argparse
+import json
+import socket
+import threading
+import time
+from ingest_core import CONTROL_PORT, IngestCore
+from jsonl_index import parse_time, query_log, record_time
+from link_tracker import LINK_PROTOCOL
+from protocol import encode_json
+from segments import list_segments, open_log
+
+# --- CONFIGURACIÓN ---
+FILENAME = 'sensor_data.jsonl'   # Captura a reproducir (con sus segmentos rotados)
+REPLAY_FILENAME = 'replay_data.jsonl'  # Salida del núcleo en proceso (no se mezcla con la captura)
+HOST = '127.0.0.1'
+PORT = 1234
+MAX_GAP = 0                  # Huecos más largos que esto (s) se acortan a MAX_GAP (0 = respetarlos)
+REPORT_INTERVAL = 1.0        # Segundos entre líneas de progreso
+
+# Campos que agrega el servidor al guardar: se quitan antes de volver a ingerir
+SERVER_FIELDS = ("timestamp_server", "protocol", "source_ip", "delay_ms")
+# Registros calculados en el servidor (analytics.DERIVED_PROTOCOL y LINK): el pipeline los rehace
+DERIVED = ("ANALYTICS", LINK_PROTOCOL)
+
+
+# --- LECTURA ---
+def read_records(base, t_start=None, t_end=None, source_ip=None, sensor=None):
+    """
+    Genera los registros de 'base' y sus segmentos en orden, de a uno (memoria
+    constante). Con t_start usa el índice temporal para saltar directo a esa
+    parte del archivo (ver jsonl_index.query_log).
+    """
+    if t_start is not None:
+        yield from query_log(base, t_start, float("inf") if t_end is None else t_end, source_ip, sensor)
+        return
+    for _, path in list_segments(base):
+        with open_log(path, "rb") as f:
+            for raw in f:
+                try:
+                    record = json.loads(raw)
+                except json.JSONDecodeError:
+                    continue
+                if source_ip is not None and record.get("source_ip") != source_ip:
+                    continue
+                if sensor is not None and record.get("sensor") != sensor:
+                    continue
+                if t_end is not None:
+                    t = record_time(record)
+                    if t is not None and t > t_end:
+                        return
+                yield record
+
+
+def device_payload(record):
+    """Lo que mandó la placa: la plantilla del firmware o, si no calza, el JSON sin campos del servidor"""
+    payload = encode_json(record)
+    if payload is None:
+        payload = (json.dumps({k: v for k, v in record.items() if k not in SERVER_FIELDS}) + "\n").encode()
+    return payload
+
+
+# --- DESTINOS ---
+class CoreTarget:
+    """Entrega los registros directo a un IngestCore (feed, escritor y etapas) sin pasar por la red"""
+
+    def __init__(self, core):
+        self.core = core
+
+    def send(self, record):
+        # Contrapresión: a máxima velocidad se espera al escritor en vez de descartar
+        while self.core.writer.queue.full():
+            time.sleep(0.001)
+        protocol, ip = record.get("protocol", "UDP"), record.get("source_ip", "")
+        data = {k: v for k, v in record.items() if k not in SERVER_FIELDS}
+        self.core.save(data, protocol, ip)
+
+    def close(self):
+        pass
+
+
+class _NetTarget:
+    """
+    Un socket por source_ip original. Hacia loopback cada placa sale desde
+    su propia IP 127.0.x.y (como simulator.Fleet), así el servidor las
+    sigue distinguiendo.
+    """
+
+    def __init__(self, host=HOST, port=PORT):
+        self.addr = (host, port)
+        self.loopback = host.startswith("127.")
+        self.socks = {}
+
+    def _bind_ip(self):
+        i = len(self.socks)
+        return f"127.0.{(i + 2) // 256}.{(i + 2) % 256}" if self.loopback else None
+
+    def _sock(self, ip):
+        sock = self.socks.get(ip)
+        if sock is None:
+            sock = self.socks[ip] = self.connect(self._bind_ip())
+        return sock
+
+    def close(self):
+        for sock in self.socks.values():
+            sock.close()
+        self.socks.clear()
+
+
+class UdpTarget(_NetTarget):
+    def connect(self, bind_ip):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if bind_ip:
+            sock.bind((bind_ip, 0))
+        return sock
+
+    def send(self, record):
+        self._sock(record.get("source_ip")).sendto(device_payload(record), self.addr)
+
+
+class TcpTarget(_NetTarget):
+    def connect(self, bind_ip):
+        return socket.create_connection(self.addr, source_address=(bind_ip, 0) if bind_ip else None)
+
+    def send(self, record):
+        ip = record.get("source_ip")
+        try:
+            self._sock(ip).sendall(device_payload(record))
+        except OSError:
+            # Se reconecta en el próximo registro de esta placa
+            sock = self.socks.pop(ip, None)
+            if sock is not None:
+                sock.close()
+            raise
+
+
+# --- REPRODUCTOR ---
+class Replayer(threading.Thread):
+    """
+    Reproduce una captura hacia 'target' (CoreTarget, UdpTarget o TcpTarget).
+    speed = 1 respeta los tiempos entre llegadas originales (timestamp_server),
+    N los comprime N veces y 0 envía lo más rápido que acepte el destino.
+    Los registros derivados (ANALYTICS, LINK) se saltan por defecto: el
+    pipeline los vuelve a calcular. seek() y set_speed() se pueden llamar
+    desde otro hilo mientras reproduce.
+    """
+
+    def __init__(self, base, target, speed=1.0, t_start=None, t_end=None, source_ip=None, sensor=None,
+                 max_gap=MAX_GAP, derived=False, loop=False):
+        super().__init__(name="replay", daemon=True)
+        self.base = base
+        self.target = target
+        self.speed = speed
+        self.t_start = t_start
+        self.t_end = t_end
+        self.filters = dict(source_ip=source_ip, sensor=sensor)
+        self.max_gap = max_gap
+        self.derived = derived
+        self.loop = loop
+        self.sent = 0
+        self.skipped = 0
+        self.errors = 0
+        self.position = None       # timestamp_server del último registro enviado
+        self._anchor = None        # (monotonic, tiempo original) de referencia para el ritmo
+        self._last_t = None
+        self._seek_to = None
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+
+    def seek(self, t):
+        """Salta a la primera muestra con tiempo >= t (epoch)"""
+        self._seek_to = t
+        self._wake.set()
+
+    def set_speed(self, speed):
+        self.speed = speed
+        self._anchor = None
+
+    def _open(self, t_start):
+        self._anchor = None
+        self._last_t = None
+        return read_records(self.base, t_start, self.t_end, **self.filters)
+
+    def _pace(self, t):
+        """Espera hasta el instante que le toca a t; False si un seek o stop cortó la espera"""
+        if not self.speed:
+            return True
+        now = time.monotonic()
+        if self._anchor is None:
+            self._anchor, self._last_t = (now, t), t
+            return True
+        gap = t - self._last_t
+        if self.max_gap and gap > self.max_gap:
+            # Placa apagada, noche sin datos...: el hueco se acorta a max_gap
+            self._anchor = (self._anchor[0], self._anchor[1] + gap - self.max_gap)
+        self._last_t = max(self._last_t, t)
+        delay = self._anchor[0] + (t - self._anchor[1]) / self.speed - now
+        if delay > 0 and self._wake.wait(delay):
+            self._wake.clear()
+            return self._seek_to is None and not self._stop_event.is_set()
+        return True
+
+    def run(self):
+        records = self._open(self.t_start)
+        while not self._stop_event.is_set():
+            if self._seek_to is not None:
+                t, self._seek_to = self._seek_to, None
+                self._wake.clear()
+                records = self._open(t)
+            record = next(records, None)
+            if record is None:
+                if not self.loop:
+                    break
+                records = self._open(self.t_start)
+                continue
+            if not self.derived and record.get("protocol") in DERIVED:
+                self.skipped += 1
+                continue
+            t = record_time(record)
+            if t is not None and not self._pace(t):
+                continue  # Seek o stop durante la espera: este registro ya no va
+            try:
+                self.target.send(record)
+            except OSError as e:
+                self.errors += 1
+                if self.errors == 1:
+                    print(f"❌ Error enviando: {e}")
+                continue
+            self.sent += 1
+            if t is not None:
+                self.position = t
+
+
+def build_core(args):
+    """Núcleo en proceso: la GUI se adjunta a él como a server_unificado.py"""
+    return IngestCore(port=args.port, filename=args.out, rollups=args.rollups, link_stats=not args.no_link_stats,
+                      feed=not args.no_feed, control_port=args.control_port)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Reproduce una captura sensor_data.jsonl hacia el pipeline de ingesta")
+    parser.add_argument("file", nargs="?", default=FILENAME, help="Archivo base (incluye sus segmentos rotados)")
+    speed = parser.add_mutually_exclusive_group()
+    speed.add_argument("--speed", type=float, default=1.0, help="1 = tiempo real, N = N veces más rápido")
+    speed.add_argument("--max", action="store_true", help="Lo más rápido posible, sin respetar tiempos")
+    parser.add_argument("--target", choices=("core", "udp", "tcp"), default="core",
+                        help="core: IngestCore en este proceso (GUI, análisis y alertas incluidos) | "
+                             "udp/tcp: a un server_unificado.py que ya esté corriendo")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--from", dest="t_from", help="Empezar en este instante (ISO o HH:MM[:SS])")
+    parser.add_argument("--to", dest="t_to", help="Terminar en este instante (ISO o HH:MM[:SS])")
+    parser.add_argument("--ip", help="Solo esta source_ip")
+    parser.add_argument("--sensor", help="Solo este sensor (BMI270, BME688)")
+    parser.add_argument("--max-gap", type=float, default=MAX_GAP,
+                        help="Acortar huecos sin datos a estos segundos (0 = respetarlos)")
+    parser.add_argument("--derived", action="store_true", help="Reenviar también registros ANALYTICS y LINK")
+    parser.add_argument("--loop", action="store_true", help="Volver a empezar al llegar al final")
+    parser.add_argument("--out", default=REPLAY_FILENAME, help="(core) Archivo donde guarda el núcleo")
+    parser.add_argument("--rollups", action="store_true", help="(core) Actualizar también sensor_rollups/")
+    parser.add_argument("--no-link-stats", action="store_true", help="(core) Sin estadísticas de enlace")
+    parser.add_argument("--no-feed", action="store_true", help="(core) Sin feed compartido para la GUI")
+    parser.add_argument("--control-port", type=int, default=CONTROL_PORT, help="(core) Canal de control de la GUI")
+    return parser.parse_args()
+
+
+# --- MAIN ---
+if __name__ == "__main__":
+    args = parse_args()
+    core = None
+    if args.target == "core":
+        core = build_core(args).start()
+        target = CoreTarget(core)
+    elif args.target == "udp":
+        target = UdpTarget(args.host, args.port)
+    else:
+        target = TcpTarget(args.host, args.port)
+
+    t_start = parse_time(args.t_from) if args.t_from else None
+    t_end = parse_time(args.t_to) if args.t_to else None
+    replayer = Replayer(args.file, target, speed=0 if args.max else args.speed, t_start=t_start, t_end=t_end,
+                        source_ip=args.ip, sensor=args.sensor, max_gap=args.max_gap, derived=args.derived,
+                        loop=args.loop)
+    pace = "máxima velocidad" if args.max else f"{args.speed:g}x"
+    print(f"▶️ Reproduciendo {args.file} -> {args.target} ({pace})")
+    t0 = time.monotonic()
+    replayer.start()
+    try:
+        last = 0
+        while replayer.is_alive():
+            replayer.join(REPORT_INTERVAL)
+            pos = time.strftime("%H:%M:%S", time.localtime(replayer.position)) if replayer.position else "--"
+            print(f"📼 Enviados: {replayer.sent} ({(replayer.sent - last) / REPORT_INTERVAL:.0f}/s) | "
+                  f"Posición: {pos}")
+            last = replayer.sent
+    except KeyboardInterrupt:
+        replayer.stop()
+        replayer.join()
+    target.close()
+    print(f"⏹️ {replayer.sent} registros en {time.monotonic() - t0:.1f} s "
+          f"({replayer.skipped} derivados omitidos, {replayer.errors} errores)")
+    if core is not None:
+        core.stop()
@@ -0,0 +1,141 @@
+import threading
+import numpy as np
+
+# --- CONFIGURACIÓN ---
+RING_CAPACITY = 1 << 16   # Muestras por canal (~11 min a 100 Hz)
+
+# Canales numéricos que se grafican
+CHANNELS = ("ax", "ay", "az", "gx", "gy", "gz", "temp", "hum", "press", "gas", "rms", "peak", "rms_srv")
+
+
+# --- BUFFER CIRCULAR ESPEJADO ---
+class RingBuffer:
+    """
+    Buffer circular preasignado de (t, valor) para un canal.
+    Cada muestra se escribe dos veces (posición i e i + capacity), así cualquier
+    tramo de hasta 'capacity' muestras es contiguo en memoria y se entrega como
+    vista de NumPy, sin copiar ni concatenar.
+
+    'head' cuenta las muestras escritas desde el inicio; los lectores guardan
+    su propio cursor y piden todo lo nuevo con since(cursor).
+    """
+
+    def __init__(self, capacity=RING_CAPACITY, dtype=np.float64):
+        self.capacity = capacity
+        self.t = np.zeros(2 * capacity)
+        self.y = np.zeros(2 * capacity, dtype=dtype)
+        self.head = 0
+        self.first = 0           # Muestra más antigua que se conserva tras un resize()
+        self._lock = threading.Lock()
+
+    def append(self, t, y):
+        with self._lock:
+            i = self.head % self.capacity
+            self.t[i] = self.t[i + self.capacity] = t
+            self.y[i] = self.y[i + self.capacity] = y
+            self.head += 1
+
+    def extend(self, t, y):
+        """Agrega varias muestras de una vez (arrays o listas del mismo largo)"""
+        t = np.asarray(t, dtype=float)
+        y = np.asarray(y, dtype=self.y.dtype)
+        total = len(t)
+        if not total:
+            return
+        # Solo caben las últimas 'capacity'; head avanza igual por todas
+        t, y = t[-self.capacity:], y[-self.capacity:]
+        n = len(t)
+        with self._lock:
+            i = (self.head + total - n) % self.capacity
+            first = min(n, self.capacity - i)
+            for base in (i, i + self.capacity):
+                self.t[base:base + first] = t[:first]
+                self.y[base:base + first] = y[:first]
+            if first < n:
+                # El resto da la vuelta al principio de ambas copias
+                rest = n - first
+                for base in (0, self.capacity):
+                    self.t[base:base + rest] = t[first:]
+                    self.y[base:base + rest] = y[first:]
+            self.head += total
+
+    def resize(self, capacity):
+        """Cambia la capacidad conservando las últimas muestras; head (y los cursores) no cambian"""
+        with self._lock:
+            if capacity == self.capacity:
+                return
+            n = min(self.head, self.capacity, capacity)
+            old = (self.head - n + np.arange(n)) % self.capacity
+            new = (self.head - n + np.arange(n)) % capacity
+            t = np.zeros(2 * capacity)
+            y = np.zeros(2 * capacity, dtype=self.y.dtype)
+            t[new] = t[new + capacity] = self.t[old]
+            y[new] = y[new + capacity] = self.y[old]
+            self.t, self.y, self.capacity = t, y, capacity
+            self.first = self.head - n
+
+    def covers(self, t_from):
+        """True si el buffer aún tiene muestras desde t_from (o nunca perdió ninguna)"""
+        with self._lock:
+            oldest = max(self.first, self.head - self.capacity)
+            return oldest == 0 or self.t[oldest % self.capacity] <= t_from
+
+    def since(self, cursor):
+        """
+        (t, y, nuevo_cursor, perdidas): vistas con todas las muestras escritas
+        desde 'cursor'. Si el lector se atrasó más que la capacidad, 'perdidas'
+        indica cuántas se sobrescribieron antes de leerlas.
+        """
+        with self._lock:
+            head, capacity, first, t, y = self.head, self.capacity, self.first, self.t, self.y
+        start = max(cursor, head - capacity, first)
+        i = start % capacity
+        n = head - start
+        return t[i:i + n], y[i:i + n], head, start - cursor
+
+    def last(self, n):
+        """Vistas de las últimas n muestras (o menos si aún no hay tantas)"""
+        with self._lock:
+            head, capacity, first, t, y = self.head, self.capacity, self.first, self.t, self.y
+        n = min(n, head - first, capacity)
+        i = (head - n) % capacity
+        return t[i:i + n], y[i:i + n]
+
+
+class ChannelRings:
+    """
+    Un RingBuffer por canal; los hilos de red agregan registros completos.
+    Los buffers se reservan al primer uso: con historiales largos solo
+    ocupan memoria los canales que realmente llegan. on_new() se llama
+    después de reservar uno (DeviceRegistry reparte ahí su presupuesto).
+    """
+
+    def __init__(self, channels=CHANNELS, capacity=RING_CAPACITY, dtype=np.float64, on_new=None):
+        self.channels = channels
+        self.capacity = capacity
+        self.dtype = dtype
+        self.on_new = on_new
+        self.rings = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, channel):
+        ring = self.rings.get(channel)
+        if ring is None:
+            with self._lock:
+                ring = self.rings.get(channel)
+                if ring is None:
+                    ring = self.rings[channel] = RingBuffer(self.capacity, self.dtype)
+            if self.on_new is not None:
+                self.on_new()
+        return ring
+
+    def resize(self, capacity):
+        self.capacity = capacity
+        for ring in list(self.rings.values()):
+            ring.resize(capacity)
+
+    def append_record(self, record, t):
+        for ch in self.channels:
+            v = record.get(ch)
+            if v is not None:
+                self[ch].append(t, v)
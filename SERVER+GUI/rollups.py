@@ -0,0 +1,263 @@
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from jsonl_index import parse_time, record_time
+from segments import list_segments, open_log
+
+# --- CONFIGURACIÓN ---
+ROLLUP_DIR = "sensor_rollups"
+TIERS = (("1s", 1), ("1m", 60), ("1h", 3600))  # Del más fino al más grueso
+MIN_POINTS = 200        # pick_tier: puntos mínimos que debe aportar un tier en la ventana
+
+# Campos que no se agregan (identifican la serie o son metadatos)
+SKIP_FIELDS = ("sensor", "type", "source_ip", "protocol", "timestamp_server", "timestamp",
+               "seq", "uptime_ms")
+
+# Layout en disco:
+#   <root>/<tier>/<AAAAMMDD>.jsonl, una línea por (serie, intervalo) cerrado:
+#   {"t": inicio_epoch, "source_ip": .., "sensor": .., "type": .., "n": registros,
+#    "fields": {"ax": [n, media, mín, máx], ...}}
+# El tier 1s se calcula de los registros; 1m se arma con los 1s y 1h con los 1m.
+# Al cerrar el servidor se escriben también los intervalos abiertos (parciales);
+# el lector combina líneas repetidas del mismo intervalo.
+
+
+# --- AGREGADO DE UN INTERVALO ---
+class _Bucket:
+    __slots__ = ("start", "n", "stats")
+
+    def __init__(self, start):
+        self.start = start
+        self.n = 0
+        self.stats = {}  # campo -> [n, suma, mín, máx]
+
+    def add(self, record):
+        self.n += 1
+        stats = self.stats
+        for k, v in record.items():
+            if k in SKIP_FIELDS or v.__class__ not in (int, float):
+                continue
+            s = stats.get(k)
+            if s is None:
+                stats[k] = [1, v, v, v]
+            else:
+                s[0] += 1
+                s[1] += v
+                if v < s[2]:
+                    s[2] = v
+                elif v > s[3]:
+                    s[3] = v
+
+    def merge(self, other):
+        self.n += other.n
+        for k, (n, total, lo, hi) in other.stats.items():
+            s = self.stats.get(k)
+            if s is None:
+                self.stats[k] = [n, total, lo, hi]
+            else:
+                s[0] += n
+                s[1] += total
+                s[2] = min(s[2], lo)
+                s[3] = max(s[3], hi)
+
+    def to_dict(self, key):
+        ip, sensor, dtype = key
+        return {"t": self.start, "source_ip": ip, "sensor": sensor, "type": dtype, "n": self.n,
+                "fields": {k: [n, total / n, lo, hi] for k, (n, total, lo, hi) in self.stats.items()}}
+
+
+# --- ESCRITOR (SINK PARA BatchedWriter) ---
+class RollupSink:
+    """
+    Mantiene en streaming min/máx/media/cantidad por source_ip, sensor y campo
+    en varias resoluciones (TIERS) y persiste cada intervalo al cerrarse.
+    Implementa la misma interfaz que JsonlSink (write_batch/flush/close).
+    """
+
+    def __init__(self, root=ROLLUP_DIR, tiers=TIERS):
+        self.root = root
+        self.tiers = tiers
+        self.open = {}   # (ip, sensor, type) -> [_Bucket o None por tier]
+        self.files = {}  # (tier, día) -> archivo abierto
+        for name, _ in tiers:
+            os.makedirs(os.path.join(root, name), exist_ok=True)
+
+    def write_batch(self, records):
+        size0 = self.tiers[0][1]
+        for record in records:
+            t = record_time(record)
+            if t is None:
+                continue
+            key = (record.get("source_ip", ""), record.get("sensor", ""), record.get("type", ""))
+            buckets = self.open.get(key)
+            if buckets is None:
+                buckets = self.open[key] = [None] * len(self.tiers)
+            start = t // size0 * size0
+            b = buckets[0]
+            if b is None or start > b.start:
+                if b is not None:
+                    self._close(key, 0, b)
+                b = buckets[0] = _Bucket(start)
+            # Registros atrasados se suman al intervalo abierto
+            b.add(record)
+
+    def _close(self, key, level, bucket):
+        """Persiste un intervalo cerrado y lo acumula en el tier siguiente"""
+        name = self.tiers[level][0]
+        self._file(name, bucket.start).write(json.dumps(bucket.to_dict(key)) + "\n")
+        if level + 1 >= len(self.tiers):
+            return
+        buckets = self.open[key]
+        size = self.tiers[level + 1][1]
+        start = bucket.start // size * size
+        parent = buckets[level + 1]
+        if parent is None or start > parent.start:
+            if parent is not None:
+                self._close(key, level + 1, parent)
+            parent = buckets[level + 1] = _Bucket(start)
+        parent.merge(bucket)
+
+    def _file(self, tier, t):
+        day = datetime.fromtimestamp(t).strftime("%Y%m%d")
+        f = self.files.get((tier, day))
+        if f is None:
+            # Cambió el día de este tier: cerramos el archivo anterior
+            for k in [k for k in self.files if k[0] == tier]:
+                self.files.pop(k).close()
+            f = self.files[(tier, day)] = open(os.path.join(self.root, tier, day + ".jsonl"), "a")
+        return f
+
+    def flush(self, fsync=False):
+        for f in self.files.values():
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+
+    def close(self):
+        # Intervalos abiertos: se escriben como parciales (el lector los combina)
+        for key, buckets in self.open.items():
+            for level in range(len(self.tiers)):
+                if buckets[level] is not None:
+                    self._close(key, level, buckets[level])
+                    buckets[level] = None
+        self.open = {}
+        self.flush(fsync=True)
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+
+# --- LECTURA ---
+def tier_seconds(tier):
+    return dict(TIERS)[tier]
+
+
+def pick_tier(window, min_points=MIN_POINTS):
+    """El tier más grueso que aún deja al menos min_points intervalos en la ventana"""
+    for name, size in reversed(TIERS):
+        if window / size >= min_points:
+            return name
+    return TIERS[0][0]
+
+
+def query(tier, t_start, t_end, source_ip=None, sensor=None, root=ROLLUP_DIR):
+    """Intervalos del tier que se solapan con [t_start, t_end]; solo abre los archivos de esos días"""
+    size = tier_seconds(tier)
+    day = datetime.fromtimestamp(t_start - size).date()
+    last = datetime.fromtimestamp(t_end).date()
+    while day <= last:
+        path = os.path.join(root, tier, day.strftime("%Y%m%d") + ".jsonl")
+        day += timedelta(days=1)
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if row["t"] + size <= t_start or row["t"] > t_end:
+                    continue
+                if source_ip is not None and row["source_ip"] != source_ip:
+                    continue
+                if sensor is not None and row["sensor"] != sensor:
+                    continue
+                yield row
+
+
+def field_series(tier, field, t_start, t_end, source_ip=None, sensor=None, root=ROLLUP_DIR):
+    """
+    Serie de un campo: listas (t, n, media, mín, máx) ordenadas por t. Combina
+    las líneas del mismo intervalo (parciales o de varias IPs si source_ip=None).
+    """
+    merged = {}
+    for row in query(tier, t_start, t_end, source_ip, sensor, root):
+        s = row["fields"].get(field)
+        if s is None:
+            continue
+        n, mean, lo, hi = s
+        m = merged.get(row["t"])
+        if m is None:
+            merged[row["t"]] = [n, mean * n, lo, hi]
+        else:
+            m[0] += n
+            m[1] += mean * n
+            m[2] = min(m[2], lo)
+            m[3] = max(m[3], hi)
+    ts = sorted(merged)
+    return (ts,
+            [merged[t][0] for t in ts],
+            [merged[t][1] / merged[t][0] for t in ts],
+            [merged[t][2] for t in ts],
+            [merged[t][3] for t in ts])
+
+
+def backfill(base, root=ROLLUP_DIR):
+    """Calcula los rollups de un sensor_data.jsonl (y sus segmentos) ya existente"""
+    sink = RollupSink(root)
+    n = 0
+    for _, path in list_segments(base):
+        batch = []
+        with open_log(path, "rb") as f:
+            for line in f:
+                try:
+                    batch.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+                if len(batch) >= 10000:
+                    sink.write_batch(batch)
+                    n += len(batch)
+                    batch = []
+        sink.write_batch(batch)
+        n += len(batch)
+    sink.close()
+    return n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rollups 1s / 1m / 1h de la telemetría")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_bf = sub.add_parser("backfill", help="Calcular rollups desde sensor_data.jsonl")
+    p_bf.add_argument("file", nargs="?", default="sensor_data.jsonl")
+    p_bf.add_argument("--root", default=ROLLUP_DIR)
+
+    p_q = sub.add_parser("query", help="Intervalos de un tier en un rango de tiempo")
+    p_q.add_argument("--tier", choices=[name for name, _ in TIERS], default="1m")
+    p_q.add_argument("--from", dest="t_from", required=True, help="ISO o HH:MM[:SS]")
+    p_q.add_argument("--to", dest="t_to", help="ISO o HH:MM[:SS] (por defecto ahora)")
+    p_q.add_argument("--ip", help="source_ip")
+    p_q.add_argument("--sensor", help="BMI270, BME688, ...")
+    p_q.add_argument("--root", default=ROLLUP_DIR)
+
+    args = parser.parse_args()
+    if args.cmd == "backfill":
+        n = backfill(args.file, args.root)
+        print(f"✅ Rollups calculados a partir de {n} registros en {args.root}/")
+    else:
+        t_end = parse_time(args.t_to) if args.t_to else time.time()
+        for row in query(args.tier, parse_time(args.t_from), t_end, args.ip, args.sensor, args.root):
+            sys.stdout.write(json.dumps(row) + "\n")
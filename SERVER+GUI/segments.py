@@ -0,0 +1,147 @@
+import gzip
+import lzma
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from datetime import datetime
+
+# --- COMPRESIÓN ---
+# nombre -> (sufijo, función open)
+COMPRESSORS = {
+    "gzip": (".gz", gzip.open),
+    "lzma": (".xz", lzma.open),
+}
+COMPRESSED_SUFFIXES = {suffix: opener for suffix, opener in COMPRESSORS.values()}
+
+SEGMENT_TIME_FORMAT = "%Y%m%dT%H%M%S"
+
+# Un segmento de 'sensor_data.jsonl' se llama 'sensor_data-20261016T140000.jsonl'
+# (o .jsonl.gz / .jsonl.xz una vez cerrado y comprimido). Su índice temporal
+# siempre usa el nombre sin compresión: 'sensor_data-20261016T140000.jsonl.idx'.
+
+
+def plain_path(path):
+    """Ruta sin el sufijo de compresión"""
+    for suffix in COMPRESSED_SUFFIXES:
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+def open_log(path, mode="rb"):
+    """Abre un segmento comprimido o no de forma transparente"""
+    for suffix, opener in COMPRESSED_SUFFIXES.items():
+        if path.endswith(suffix):
+            return opener(path, mode)
+    return open(path, mode)
+
+
+def segment_name(base, t=None):
+    """Nombre del segmento que empieza en t; si ya existe (rotación por tamaño en el mismo segundo) avanza 1 s"""
+    stem, ext = os.path.splitext(base)
+    t = int(time.time() if t is None else t)
+    while True:
+        path = f"{stem}-{datetime.fromtimestamp(t).strftime(SEGMENT_TIME_FORMAT)}{ext}"
+        if not any(os.path.exists(path + suffix) for suffix in ("", *COMPRESSED_SUFFIXES)):
+            return path
+        t += 1
+
+
+def list_segments(base):
+    """
+    [(inicio_epoch, ruta), ...] ordenado por tiempo. Incluye el archivo base
+    sin rotar (registros previos a la rotación) con inicio 0.
+    """
+    stem, ext = os.path.splitext(base)
+    folder = os.path.dirname(base) or "."
+    pattern = re.compile(re.escape(os.path.basename(stem)) + r"-(\d{8}T\d{6})" + re.escape(ext)
+                         + r"(" + "|".join(re.escape(s) for s in COMPRESSED_SUFFIXES) + r")?$")
+    found = {}
+    for name in os.listdir(folder):
+        m = pattern.match(name)
+        if not m:
+            continue
+        start = datetime.strptime(m.group(1), SEGMENT_TIME_FORMAT).timestamp()
+        path = os.path.join(folder, name)
+        # Si conviven el original y el comprimido (compresión en curso), gana el original
+        if start not in found or not m.group(2):
+            found[start] = path
+    segments = sorted(found.items())
+    if os.path.exists(base):
+        segments.insert(0, (0.0, base))
+    return segments
+
+
+# --- COMPRESIÓN Y RETENCIÓN EN SEGUNDO PLANO ---
+class SegmentCompressor:
+    """
+    Hilo que comprime segmentos cerrados (fuera del camino de ingesta) y
+    aplica la retención: borra los segmentos más antiguos si el total supera
+    max_bytes o si son más viejos que max_age segundos (0 = sin límite).
+    """
+
+    def __init__(self, base, compression="gzip", max_bytes=0, max_age=0, log=print):
+        self.base = base
+        self.compression = compression if compression in COMPRESSORS else None
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.log = log
+        self.pending = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="segment_compressor", daemon=True)
+        self._thread.start()
+
+    def submit(self, path):
+        self.pending.put(path)
+
+    def stop(self, timeout=30.0):
+        self.pending.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            path = self.pending.get()
+            if path is None:
+                return
+            try:
+                if self.compression:
+                    self._compress(path)
+                self.apply_retention(exclude=None)
+            except Exception as e:
+                self.log(f"⚠️ [ROTACIÓN] Error procesando {path}: {e}")
+
+    def _compress(self, path):
+        suffix, opener = COMPRESSORS[self.compression]
+        target = path + suffix
+        tmp = target + ".tmp"
+        with open(path, "rb") as src, opener(tmp, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        os.replace(tmp, target)
+        os.remove(path)
+
+    def apply_retention(self, exclude=None):
+        if not self.max_bytes and not self.max_age:
+            return
+        segments = [(start, path) for start, path in list_segments(self.base)
+                    if path != exclude and plain_path(path) != self.base]
+        # El segmento activo (el más nuevo) nunca se borra
+        segments = segments[:-1]
+        now = time.time()
+
+        def size_of(p):
+            idx = plain_path(p) + ".idx"
+            return os.path.getsize(p) + (os.path.getsize(idx) if os.path.exists(idx) else 0)
+
+        total = sum(size_of(p) for _, p in segments)
+        for start, path in segments:
+            too_old = self.max_age and now - start > self.max_age
+            too_big = self.max_bytes and total > self.max_bytes
+            if not (too_old or too_big):
+                break
+            total -= size_of(path)
+            for p in (path, plain_path(path) + ".idx"):
+                if os.path.exists(p):
+                    os.remove(p)
+            self.log(f"🗑️ [ROTACIÓN] Segmento eliminado por retención: {path}")
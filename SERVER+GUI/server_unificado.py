@@ -1,110 +1,122 @@
-import socket
-import threading
-import json
+import argparse
 import time
-from datetime import datetime
+from data_writer import DURABILITIES, ECHO_MODES, JsonlSink, RotatingJsonlSink
+from rollups import ROLLUP_DIR
+from alerts import RULES_FILE
+from metrics import METRICS_PORT
+from ingest_core import (ANALYTICS_THRESHOLD, ANALYTICS_WINDOW, CHUNK_DIR, COMPRESSION, CONTROL_PORT, ECHO_MODE,
+                         ECHO_VALUE, PORT, RETENTION_BYTES, RETENTION_SECONDS, ROTATE_BYTES, ROTATE_SECONDS, STORAGES,
+                         WRITER_DURABILITY, WRITER_FSYNC_MS, IngestCore)
 
 # --- CONFIGURACIÓN ---
-HOST = '0.0.0.0'  
-PORT = 1234       
-FILENAME = 'sensor_data.jsonl' 
-
-# --- FUNCIÓN DE GUARDADO ---
-
-file_lock = threading.Lock()
-
-def save_to_file(data_dict, protocol, source_ip):
-
-
-    data_dict['timestamp_server'] = datetime.now().isoformat()
-    data_dict['protocol'] = protocol
-    data_dict['source_ip'] = source_ip
-
-    json_str = json.dumps(data_dict)
-
-    # Sección crítica: Solo un hilo escribe a la vez
-    with file_lock:
-        with open(FILENAME, 'a') as f:
-            f.write(json_str + "\n")
-    
-    # Imprimir en consola para ver en vivo
-    print(f"[{protocol}] De {source_ip}: {json_str}")
-
-# --- SERVIDOR TCP ---
-def tcp_server_thread():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        try:
-            s.bind((HOST, PORT))
-            s.listen()
-            print(f"✅ Hilo TCP escuchando en {HOST}:{PORT}")
-        except Exception as e:
-            print(f"❌ Error iniciando TCP: {e}")
-            return
-
-        while True:
-            try:
-                conn, addr = s.accept()
-                with conn:
-                    f = conn.makefile('r')
-                    while True:
-                        line = f.readline()
-                        if not line:
-                            break # Fin de conexión
-                        
-                        try:
-                            # Limpiamos espacios y decodificamos
-                            data = json.loads(line.strip())
-                            save_to_file(data, "TCP", addr[0])
-                        except json.JSONDecodeError:
-                            print(f"⚠️ [TCP] Error decodificando JSON: {line.strip()}")
-            except Exception as e:
-                print(f"⚠️ [TCP] Error en conexión: {e}")
-
-# --- SERVIDOR UDP ---
-def udp_server_thread():
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        try:
-            s.bind((HOST, PORT))
-            print(f"✅ Hilo UDP escuchando en {HOST}:{PORT}")
-        except Exception as e:
-            print(f"❌ Error iniciando UDP: {e}")
-            return
-
-        while True:
-            try:
-                # Buffer de 1024 bytes es suficiente para tus mensajes JSON
-                data_bytes, addr = s.recvfrom(1024)
-                
-                if data_bytes:
-                    try:
-                        line = data_bytes.decode('utf-8').strip()
-                        data = json.loads(line)
-                        save_to_file(data, "UDP", addr[0])
-                    except json.JSONDecodeError:
-                        print(f"⚠️ [UDP] Error decodificando JSON: {data_bytes}")
-                        
-            except Exception as e:
-                print(f"⚠️ [UDP] Error recibiendo: {e}")
+# La ingesta, la persistencia y las etapas viven en ingest_core.py; este
+# script la corre sin interfaz como servicio de larga duración. La GUI se
+# conecta a él (o lo lanza) por el canal de control y el feed compartido.
+STATS_INTERVAL = 10          # Segundos entre reportes de la cola
+METRICS_ENABLED = True       # GET http://127.0.0.1:9100/metrics (formato Prometheus, ver metrics.py)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Servidor unificado TCP + UDP de telemetría")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Procesos UDP con SO_REUSEPORT (0 = recepción UDP en este proceso)")
+    parser.add_argument("--storage", choices=STORAGES, default="jsonl",
+                        help="jsonl: sensor_data.jsonl | csv: un CSV por sensor | "
+                             "chunks: bloques .npy en sensor_chunks/ | both: jsonl + chunks")
+    parser.add_argument("--durability", choices=DURABILITIES, default=WRITER_DURABILITY,
+                        help="none: lo decide el SO | flush: vaciar al SO por lote | fsync: además fsync periódico")
+    parser.add_argument("--fsync-ms", type=int, default=WRITER_FSYNC_MS,
+                        help="Intervalo de fsync en ms con --durability fsync")
+    parser.add_argument("--echo", nargs="+", metavar=("MODO", "N"), default=[ECHO_MODE, ECHO_VALUE],
+                        help=f"Eco en consola: off | sample N (1 de cada N) | rate N (N por segundo). "
+                             f"Por defecto: {ECHO_MODE} {ECHO_VALUE}")
+    parser.add_argument("--no-rollups", action="store_true",
+                        help="No mantener los agregados 1s/1m/1h en sensor_rollups/")
+    parser.add_argument("--no-link-stats", action="store_true",
+                        help="No calcular pérdidas, jitter ni retraso por dispositivo")
+    parser.add_argument("--no-alerts", action="store_true",
+                        help="No evaluar reglas de alerta")
+    parser.add_argument("--alert-rules", default=RULES_FILE,
+                        help="JSON con las reglas de alerta (si no existe, las de fábrica)")
+    parser.add_argument("--no-analytics", action="store_true",
+                        help="No calcular RMS / FFT / picos en el servidor")
+    parser.add_argument("--window-size", type=int, default=ANALYTICS_WINDOW,
+                        help="Muestras por ventana de análisis (RMS y FFT)")
+    parser.add_argument("--threshold", type=int, default=ANALYTICS_THRESHOLD,
+                        help="Umbral de picos en milésimas (1000 = 1.0 m/s² sobre la media)")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT if METRICS_ENABLED else 0,
+                        help="Puerto local del endpoint Prometheus /metrics (0 = desactivado)")
+    parser.add_argument("--control-port", type=int, default=CONTROL_PORT,
+                        help="Puerto local del canal de control para la GUI (0 = sin consumidores)")
+    parser.add_argument("--no-feed", action="store_true",
+                        help="No publicar muestras en memoria compartida para la GUI")
+    parser.add_argument("--rotate-minutes", type=float, default=ROTATE_SECONDS / 60,
+                        help="Minutos por segmento JSONL, ej. 60 (0 = sin rotación: todo en sensor_data.jsonl)")
+    parser.add_argument("--rotate-mb", type=float, default=ROTATE_BYTES / 1e6,
+                        help="Tamaño máximo de un segmento en MB (0 = sin límite)")
+    parser.add_argument("--compress", choices=("gzip", "lzma", "none"), default=COMPRESSION,
+                        help="Compresión de los segmentos cerrados")
+    parser.add_argument("--retention-gb", type=float, default=RETENTION_BYTES / 1e9,
+                        help="Espacio máximo de los segmentos en GB (0 = sin límite)")
+    parser.add_argument("--retention-days", type=float, default=RETENTION_SECONDS / 86400,
+                        help="Días que se conservan los segmentos (0 = sin límite)")
+    args = parser.parse_args()
+    mode, *value = args.echo
+    if mode not in ECHO_MODES or len(value) > 1:
+        parser.error(f"--echo: usar {' | '.join(ECHO_MODES)} seguido opcionalmente de N")
+    try:
+        args.echo = (mode, int(value[0]) if value else ECHO_VALUE)
+    except ValueError:
+        parser.error(f"--echo: N debe ser un entero, no {value[0]!r}")
+    return args
 
 # --- MAIN ---
 if __name__ == "__main__":
+    args = parse_args()
+    core = IngestCore(
+        storage=args.storage,
+        workers=args.workers,
+        rollups=not args.no_rollups,
+        link_stats=not args.no_link_stats,
+        alerts=not args.no_alerts,
+        rules_file=args.alert_rules,
+        analytics=not args.no_analytics,
+        window_size=args.window_size,
+        threshold=args.threshold,
+        rotate_seconds=int(args.rotate_minutes * 60),
+        rotate_bytes=int(args.rotate_mb * 1e6),
+        compression=args.compress,
+        retention_bytes=int(args.retention_gb * 1e9),
+        retention_seconds=int(args.retention_days * 86400),
+        durability=args.durability,
+        fsync_ms=args.fsync_ms,
+        echo_mode=args.echo[0],
+        echo_value=args.echo[1],
+        feed=not args.no_feed,
+        control_port=args.control_port,
+    )
     print(f"🚀 Iniciando Servidor Unificado (TCP + UDP) en puerto {PORT}...")
-    print(f"📂 Los datos se guardarán en: {FILENAME}")
+    if args.storage in ("chunks", "both"):
+        print(f"📂 Bloques columnares en: {CHUNK_DIR}/")
+    if not args.no_rollups:
+        print(f"📂 Rollups 1s/1m/1h en: {ROLLUP_DIR}/")
+    for sink in core.writer.sinks:
+        if isinstance(sink, (JsonlSink, RotatingJsonlSink)):
+            print(f"📂 Los datos se guardarán en: {sink.filename}")
     print("Presiona Ctrl+C para detener.")
 
-    # Creamos los hilos
-    thread_tcp = threading.Thread(target=tcp_server_thread, daemon=True)
-    thread_udp = threading.Thread(target=udp_server_thread, daemon=True)
-
-    # Iniciamos los hilos
-    thread_tcp.start()
-    thread_udp.start()
+    core.start()
+    if args.metrics_port:
+        core.start_metrics(args.metrics_port)
 
     # Mantenemos el programa principal vivo
     try:
+        last_report = time.monotonic()
         while True:
             time.sleep(1)
+            if time.monotonic() - last_report >= STATS_INTERVAL:
+                core.report_stats()
+                last_report = time.monotonic()
     except KeyboardInterrupt:
-        print("\n🛑 Servidor detenido.")
\ No newline at end of file
+        core.stop()
+        print("\n🛑 Servidor detenido.")
@@ -0,0 +1,176 @@
+import socket
+import struct
+import threading
+from multiprocessing import shared_memory
+import numpy as np
+from device_registry import record_mode
+from ring_buffer import CHANNELS
+
+# --- CONFIGURACIÓN ---
+FEED_PREFIX = "tic3_feed"   # Nombre del bloque: tic3_feed_<puerto de ingesta>
+FEED_CAPACITY = 1 << 16     # Muestras en el anillo (~30 s con 20 placas a 100 Hz)
+FEED_MAGIC = 0x54494333     # "TIC3"
+FEED_VERSION = 2
+
+# Una muestra de largo fijo (68 bytes). 'mask' tiene un bit por canal de
+# CHANNELS presente en el registro; los ausentes quedan en NaN.
+SAMPLE_DTYPE = np.dtype([
+    ("t", "<f8"),                       # llegada al servidor (epoch)
+    ("ip", "<u4"),                      # source_ip IPv4 empaquetada
+    ("mode", "u1"),                     # índice en MODES (0 = derivado o sin modo)
+    ("derived", "u1"),                  # 1 = calculado en el servidor (RMS_SRV / PEAK)
+    ("mask", "<u2"),
+    ("v", "<f4", (len(CHANNELS),)),
+])
+MODES = (None, "BMI270", "BME688", "RMS")
+MODE_CODES = {m: i for i, m in enumerate(MODES)}
+
+# Cabecera: 8 uint64 (64 bytes) antes de las muestras
+HEADER_WORDS = 8
+H_MAGIC, H_VERSION, H_CAPACITY, H_HEAD = range(4)
+
+
+def feed_name(port):
+    return f"{FEED_PREFIX}_{port}"
+
+
+def _layout(buf, capacity):
+    header = np.ndarray((HEADER_WORDS,), dtype=np.uint64, buffer=buf)
+    samples = np.ndarray((2 * capacity,), dtype=SAMPLE_DTYPE, buffer=buf, offset=HEADER_WORDS * 8)
+    return header, samples
+
+
+# --- PRODUCTOR (núcleo de ingesta) ---
+class FeedWriter:
+    """
+    Anillo de muestras en memoria compartida para consumidores en otros
+    procesos (la GUI). Espejado como RingBuffer: cada muestra se escribe en
+    i e i + capacity, así cualquier tramo es una vista contigua. 'head' se
+    publica en la cabecera después de escribir la muestra.
+    Los registros sin canales graficables (LINK, FFT...) no entran.
+    """
+
+    def __init__(self, name, capacity=FEED_CAPACITY):
+        self.name = name
+        self.capacity = capacity
+        size = HEADER_WORDS * 8 + 2 * capacity * SAMPLE_DTYPE.itemsize
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # Quedó de un núcleo que terminó sin limpiar: se reemplaza
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        self.header, self.samples = _layout(self.shm.buf, capacity)
+        self.header[:] = 0
+        self.header[H_MAGIC] = FEED_MAGIC
+        self.header[H_VERSION] = FEED_VERSION
+        self.header[H_CAPACITY] = capacity
+        self.head = 0
+        self._ips = {}
+        self._lock = threading.Lock()
+
+    def _ip(self, ip):
+        code = self._ips.get(ip)
+        if code is None:
+            try:
+                code = struct.unpack("!I", socket.inet_aton(ip))[0]
+            except OSError:
+                code = 0
+            self._ips[ip] = code
+        return code
+
+    def append(self, record, t, derived=False):
+        values = [record.get(ch) for ch in CHANNELS]
+        mask = 0
+        for k, v in enumerate(values):
+            if v is None or isinstance(v, (list, str)):
+                values[k] = np.nan
+            else:
+                mask |= 1 << k
+        if not mask:
+            return
+        mode = 0 if derived else MODE_CODES.get(record_mode(record), 0)
+        sample = (t, self._ip(record.get("source_ip", "")), mode, derived, mask, values)
+        with self._lock:
+            i = self.head % self.capacity
+            self.samples[i] = self.samples[i + self.capacity] = sample
+            self.head += 1
+            self.header[H_HEAD] = self.head
+
+    def close(self):
+        self.header = self.samples = None
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+# --- CONSUMIDOR (GUI) ---
+class FeedReader:
+    """Se adjunta al anillo de un FeedWriter; cada lector lleva su propio cursor"""
+
+    def __init__(self, name):
+        try:
+            self.shm = shared_memory.SharedMemory(name, track=False)
+        except TypeError:
+            # Python < 3.13: el resource_tracker borraría el bloque al cerrar este proceso
+            from multiprocessing import resource_tracker
+            self.shm = shared_memory.SharedMemory(name)
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        header = np.ndarray((HEADER_WORDS,), dtype=np.uint64, buffer=self.shm.buf)
+        if header[H_MAGIC] != FEED_MAGIC or header[H_VERSION] != FEED_VERSION:
+            self.shm.close()
+            raise ValueError(f"{name}: no es un feed v{FEED_VERSION}")
+        self.name = name
+        self.capacity = int(header[H_CAPACITY])
+        self.header, self.samples = _layout(self.shm.buf, self.capacity)
+
+    def head(self):
+        return int(self.header[H_HEAD])
+
+    def since(self, cursor):
+        """
+        (muestras, nuevo_cursor, perdidas) como RingBuffer.since: vista sin
+        copiar de todo lo escrito desde 'cursor'. Es válida hasta que el
+        productor dé la vuelta (capacity muestras más), así que se consume en
+        el mismo cuadro.
+        """
+        head = self.head()
+        if cursor > head:
+            cursor = head  # El núcleo se reinició con el mismo nombre
+        start = max(cursor, head - self.capacity)
+        i = start % self.capacity
+        return self.samples[i:i + head - start], head, start - cursor
+
+    def close(self):
+        self.header = self.samples = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # Aún hay vistas vivas; se libera con ellas
+
+
+def split_samples(samples):
+    """
+    Agrupa un tramo del anillo por placa. Devuelve [(ip, columnas, modo, n)]
+    con columnas = {canal: (t, valores)} y modo el último informado por la
+    placa (None si solo hubo derivados). n = registros propios de la placa.
+    """
+    out = []
+    ips = samples["ip"]
+    for code in np.unique(ips):
+        rows = samples[ips == code]
+        t, mask, v = rows["t"], rows["mask"], rows["v"]
+        columns = {}
+        for k, ch in enumerate(CHANNELS):
+            sel = (mask & (1 << k)) != 0
+            if sel.any():
+                columns[ch] = (t[sel], v[sel, k])
+        modes = rows["mode"][rows["mode"] > 0]
+        mode = MODES[modes[-1]] if len(modes) else None
+        n = int((rows["derived"] == 0).sum())
+        out.append((socket.inet_ntoa(struct.pack("!I", int(code))), columns, mode, n))
+    return out
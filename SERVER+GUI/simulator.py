@@ -0,0 +1,396 @@
+import argparse
+import json
+import math
+import random
+import socket
+import struct
+import threading
+import time
+from protocol import BATCH_COUNT, FRAME_HEADER, FRAME_MAGIC, FRAME_VERSION, FRAME_VERSION_BATCH
+
+# --- CONFIGURACIÓN ---
+HOST = '127.0.0.1'
+PORT = 1234
+SEND_BUFFER_SIZE = 1400      # Igual que el firmware: los lotes se parten a este tamaño
+MAX_BATCH_SAMPLES = 64
+RECONNECT_DELAY = 3.0
+
+# Mismas plantillas que sensor_net_task (main/main.c)
+JSON_BMI270_RAW = ('{{"sensor":"BMI270", "type":"RAW", "ax":{:.2f}, "ay":{:.2f}, "az":{:.2f}, '
+                   '"gx":{:.2f}, "gy":{:.2f}, "gz":{:.2f}{}}}\n')
+JSON_BMI270_RMS = '{{"sensor":"BMI270", "type":"RMS", "rms":{:.3f}, "N":{}{}}}\n'
+JSON_BME688_RAW = ('{{"sensor":"BME688", "type":"RAW", "temp":{:.2f}, "press":{:.2f}, '
+                   '"hum":{:.2f}, "gas":{:.2f}{}}}\n')
+
+# sensor_id de la trama binaria (ver FRAME_SCHEMAS en protocol.py)
+FRAME_IDS = {("BMI270", "RAW"): 1, ("BMI270", "RMS"): 2, ("BME688", "RAW"): 3}
+BATCH_FIELDS = {"BMI270": ("ax", "ay", "az", "gx", "gy", "gz"), "BME688": ("temp", "press", "hum", "gas")}
+
+
+# Structs de la trama binaria (igual que telemetry_frame.h)
+_float_structs = {}
+
+
+def struct_floats(values):
+    st = _float_structs.get(len(values))
+    if st is None:
+        st = _float_structs[len(values)] = struct.Struct(f"<{len(values)}f")
+    return st.pack(*values)
+
+
+def struct_sample(t_ms, values):
+    return struct.pack("<I", t_ms & 0xFFFFFFFF) + struct_floats(values)
+
+
+# --- SEÑALES SINTÉTICAS ---
+def bmi270_sample(t, phase):
+    """Vibración de 5 Hz + ruido sobre la gravedad en z"""
+    w = 2 * math.pi * 5 * t + phase
+    g = random.gauss
+    return (0.3 * math.sin(w) + g(0, 0.02), 0.2 * math.cos(w) + g(0, 0.02), 9.81 + 0.5 * math.sin(w) + g(0, 0.02),
+            0.05 * math.cos(w), 0.04 * math.sin(w), g(0, 0.01))
+
+
+def bme688_sample(t, phase):
+    return (22.0 + 2 * math.sin(t / 60 + phase), 101325.0 + 50 * math.sin(t / 300), 45.0 + 5 * math.cos(t / 90),
+            50000.0 + 2000 * math.sin(t / 30 + phase))
+
+
+# --- DISPOSITIVO VIRTUAL ---
+class VirtualDevice(threading.Thread):
+    """
+    Imita sensor_net_task: abre la conexión TCP de control, atiende los
+    {"cmd":"config"} que le mande el servidor/GUI y transmite muestras por UDP
+    o TCP al ritmo de period_ms (o 'rate' muestras/s).
+
+    bind_ip permite darle a cada dispositivo su propia IP de loopback
+    (127.0.0.x) para que el servidor los distinga por source_ip.
+    Con stamp=True el JSON incluye "seq" y "uptime_ms" como el firmware actual
+    (stamp=False imita al anterior); uptime_ms se cuenta desde 'epoch', común a
+    toda la flota, para medir latencia.
+    Los comandos con "id" se confirman con el mismo ack que el firmware;
+    ack_loss descarta esa fracción de acks para probar los reintentos.
+    """
+
+    def __init__(self, device_id, host=HOST, port=PORT, sensor="BMI270", dtype="RAW", protocol="UDP",
+                 rate=10.0, fmt="JSON", batch=1, window_size=50, bind_ip=None, epoch=None, stamp=True,
+                 control=True, ack_loss=0.0):
+        super().__init__(name=f"virtual_device_{device_id}", daemon=True)
+        self.device_id = device_id
+        self.addr = (host, port)
+        self.bind_ip = bind_ip
+        self.epoch = time.time() if epoch is None else epoch
+        self.stamp = stamp
+        self.control = control
+        self.ack_loss = ack_loss
+        self.config = {"sensor": sensor, "type": dtype, "protocol": protocol, "format": fmt,
+                       "batch": batch, "period_ms": 1000.0 / rate, "window_size": window_size}
+        self.phase = random.uniform(0, 2 * math.pi)
+        self.seq = 0           # Próximo seq a enviar
+        self.sent = 0          # Registros enviados
+        self.send_errors = 0
+        self.configs = 0       # Comandos de configuración recibidos
+        self.tcp = None
+        self.udp = None
+        self._rx = b""
+        self._rms = []         # Muestras acumuladas para el modo RMS
+        self._reschedule = False  # Config nueva: el reloj de muestreo parte de cero
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def uptime_ms(self):
+        return int((time.time() - self.epoch) * 1000)
+
+    # --- SOCKETS ---
+    def _open_udp(self):
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.bind_ip:
+            self.udp.bind((self.bind_ip, 0))
+
+    def _connect_tcp(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.bind_ip:
+            sock.bind((self.bind_ip, 0))
+        try:
+            sock.connect(self.addr)
+        except OSError:
+            sock.close()
+            return False
+        sock.setblocking(False)
+        self.tcp = sock
+        return True
+
+    def _close_tcp(self):
+        if self.tcp:
+            self.tcp.close()
+            self.tcp = None
+
+    # --- COMANDOS (como process_incoming_command) ---
+    def _poll_commands(self):
+        try:
+            data = self.tcp.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError:
+            return False
+        if not data:
+            return False
+        self._rx += data
+        # Un comando por línea, como handle_rx en el firmware
+        *lines, self._rx = self._rx.split(b"\n")
+        for line in lines:
+            if line.strip():
+                self._apply(line)
+        return True
+
+    def _apply(self, line):
+        try:
+            cmd = json.loads(line)
+        except json.JSONDecodeError:
+            return
+        if cmd.get("cmd") != "config":
+            self._ack(cmd.get("id"), "error")
+            return
+        cfg = self.config
+        for key in ("sensor", "type", "protocol", "format"):
+            if isinstance(cmd.get(key), str):
+                cfg[key] = cmd[key]
+        if isinstance(cmd.get("batch"), int):
+            cfg["batch"] = max(1, min(MAX_BATCH_SAMPLES, cmd["batch"]))
+        if isinstance(cmd.get("period_ms"), (int, float)) and cmd["period_ms"] > 0:
+            cfg["period_ms"] = cmd["period_ms"]
+        if isinstance(cmd.get("window_size"), int) and cmd["window_size"] > 0:
+            cfg["window_size"] = cmd["window_size"]
+        self._rms = []
+        self._reschedule = True
+        self.configs += 1
+        self._ack(cmd.get("id"), "ok")
+
+    def _ack(self, cmd_id, status):
+        """Eco de la configuración aplicada; next_seq = primera muestra con ella"""
+        if not isinstance(cmd_id, int) or random.random() < self.ack_loss:
+            return
+        cfg = self.config
+        ack = {"ack": cmd_id, "status": status, "next_seq": self.seq, "uptime_ms": self.uptime_ms(),
+               "config": dict(cfg, period_ms=int(cfg["period_ms"]))}
+        self.tcp.setblocking(True)
+        try:
+            self.tcp.sendall((json.dumps(ack) + "\n").encode())
+        except OSError:
+            self.send_errors += 1
+        finally:
+            self.tcp.setblocking(False)
+
+    # --- CODIFICACIÓN ---
+    def _stamp_json(self, seq, t_ms):
+        return f', "seq":{seq}, "uptime_ms":{t_ms}' if self.stamp else ""
+
+    def _encode_single(self, sensor, dtype, values, seq, t_ms):
+        if self.config["format"] == "BIN":
+            header = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, FRAME_IDS[(sensor, dtype)], len(values), seq, t_ms)
+            return header + struct_floats(values)
+        extra = self._stamp_json(seq, t_ms)
+        if sensor == "BME688":
+            return JSON_BME688_RAW.format(*values, extra).encode()
+        if dtype == "RMS":
+            return JSON_BMI270_RMS.format(values[0], int(values[1]), extra).encode()
+        return JSON_BMI270_RAW.format(*values, extra).encode()
+
+    def _encode_batch(self, sensor, samples, first_seq):
+        """Lotes partidos a SEND_BUFFER_SIZE, como send_batch en el firmware"""
+        n_fields = len(samples[0][1])
+        out = []
+        if self.config["format"] == "BIN":
+            per = (SEND_BUFFER_SIZE - FRAME_HEADER.size) // (4 + 4 * n_fields)
+            for i in range(0, len(samples), per):
+                chunk = samples[i:i + per]
+                header = bytearray(FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION_BATCH, FRAME_IDS[(sensor, "RAW")],
+                                                     n_fields, first_seq + i, 0))
+                BATCH_COUNT.pack_into(header, 8, len(chunk))
+                body = b"".join(struct_sample(t_ms, values) for t_ms, values in chunk)
+                out.append(bytes(header) + body)
+            return out
+        fields = json.dumps(list(BATCH_FIELDS[sensor]))
+        seq, parts, size = first_seq, [], 0
+        for t_ms, values in samples:
+            item = "[" + ",".join([str(t_ms)] + [f"{v:.2f}" for v in values]) + "]"
+            # 100 bytes de margen para la cabecera del lote
+            if parts and 100 + size + len(item) > SEND_BUFFER_SIZE:
+                out.append(self._json_batch(sensor, seq, fields, parts))
+                seq += len(parts)
+                parts, size = [], 0
+            parts.append(item)
+            size += len(item) + 1
+        out.append(self._json_batch(sensor, seq, fields, parts))
+        return out
+
+    @staticmethod
+    def _json_batch(sensor, seq, fields, parts):
+        return (f'{{"sensor":"{sensor}", "type":"RAW", "seq":{seq}, "fields":{fields}, '
+                f'"samples":[{",".join(parts)}]}}\n').encode()
+
+    # --- ENVÍO ---
+    def _send(self, payload):
+        try:
+            if self.config["protocol"] == "TCP":
+                if not self.tcp:
+                    return False
+                self.tcp.setblocking(True)
+                try:
+                    self.tcp.sendall(payload)
+                finally:
+                    self.tcp.setblocking(False)
+            else:
+                self.udp.sendto(payload, self.addr)
+        except OSError:
+            self.send_errors += 1
+            return self.config["protocol"] != "TCP"
+        return True
+
+    def _emit(self, count):
+        """Genera y envía 'count' muestras (o lotes / ventanas RMS que se completen)"""
+        cfg = self.config
+        sensor, dtype = cfg["sensor"], cfg["type"]
+        gen = bme688_sample if sensor == "BME688" else bmi270_sample
+        now_ms = self.uptime_ms()
+        period = cfg["period_ms"]
+        samples = []
+        for i in range(count):
+            # Las muestras atrasadas llevan el instante en que debieron tomarse
+            t_ms = max(0, int(now_ms - (count - 1 - i) * period))
+            samples.append((t_ms, gen(t_ms / 1000, self.phase)))
+
+        if sensor == "BMI270" and dtype == "RMS":
+            self._rms.extend(v for _, v in samples)
+            n = cfg["window_size"]
+            while len(self._rms) >= n:
+                window, self._rms = self._rms[:n], self._rms[n:]
+                rms = math.sqrt(sum(v[0] ** 2 + v[1] ** 2 + v[2] ** 2 for v in window) / n)
+                if not self._send(self._encode_single(sensor, "RMS", (rms, n), self.seq, now_ms)):
+                    return False
+                self.seq += 1
+                self.sent += 1
+            return True
+
+        if cfg["batch"] > 1 and dtype == "RAW":
+            for i in range(0, len(samples), cfg["batch"]):
+                chunk = samples[i:i + cfg["batch"]]
+                for payload in self._encode_batch(sensor, chunk, self.seq):
+                    if not self._send(payload):
+                        return False
+                self.seq += len(chunk)
+                self.sent += len(chunk)
+            return True
+
+        for t_ms, values in samples:
+            if not self._send(self._encode_single(sensor, "RAW", values, self.seq, t_ms)):
+                return False
+            self.seq += 1
+            self.sent += 1
+        return True
+
+    def run(self):
+        self._open_udp()
+        while not self._stop_event.is_set():
+            if self.control and not self.tcp and not self._connect_tcp():
+                self._stop_event.wait(RECONNECT_DELAY)
+                continue
+
+            start = time.monotonic()
+            done = 0
+            while not self._stop_event.is_set():
+                if self.tcp and not self._poll_commands():
+                    self._close_tcp()
+                    break
+                if self._reschedule:
+                    # Como el timer del firmware: el nuevo periodo cuenta desde que se aplicó
+                    # (sin ráfaga de muestras atrasadas ni silencio al cambiar period_ms)
+                    self._reschedule = False
+                    start = time.monotonic()
+                    done = 0
+                # Muestras que ya deberían haberse tomado: recupera atrasos sin acumular deriva
+                period = self.config["period_ms"] / 1000.0
+                due = int((time.monotonic() - start) / period) + 1
+                if due - done >= max(1, self.config["batch"] if self.config["type"] == "RAW" else 1):
+                    pending = due - done
+                    if not self._emit(pending):
+                        self._close_tcp()
+                        break
+                    done = due
+                self._stop_event.wait(min(period, 0.005))
+        self._close_tcp()
+        self.udp.close()
+
+
+# --- FLOTA ---
+class Fleet:
+    """N dispositivos virtuales, cada uno con su IP de loopback 127.0.0.(2+i)"""
+
+    def __init__(self, devices, distinct_ips=True, **kwargs):
+        self.epoch = time.time()
+        self.devices = [
+            VirtualDevice(i, bind_ip=f"127.0.{(i + 2) // 256}.{(i + 2) % 256}" if distinct_ips else None,
+                          epoch=self.epoch, **kwargs)
+            for i in range(devices)
+        ]
+
+    def start(self):
+        for d in self.devices:
+            d.start()
+
+    def stop(self):
+        for d in self.devices:
+            d.stop()
+        for d in self.devices:
+            d.join(2.0)
+
+    def sent(self):
+        return sum(d.sent for d in self.devices)
+
+    def sent_by_ip(self):
+        return {d.bind_ip or HOST: d.sent for d in self.devices}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Flota de ESP32 simuladas (imita sensor_net_task)")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--devices", type=int, default=1, help="Dispositivos virtuales")
+    parser.add_argument("--sensor", choices=("BMI270", "BME688"), default="BMI270")
+    parser.add_argument("--type", dest="dtype", choices=("RAW", "RMS"), default="RAW")
+    parser.add_argument("--protocol", choices=("UDP", "TCP"), default="UDP")
+    parser.add_argument("--format", dest="fmt", choices=("JSON", "BIN"), default="JSON")
+    parser.add_argument("--rate", type=float, default=10.0, help="Muestras/s por dispositivo")
+    parser.add_argument("--batch", type=int, default=1, help="Muestras por paquete en RAW")
+    parser.add_argument("--duration", type=float, default=0, help="Segundos (0 = hasta Ctrl+C)")
+    parser.add_argument("--no-control", action="store_true", help="Sin conexión TCP de control")
+    parser.add_argument("--same-ip", action="store_true", help="Todos desde 127.0.0.1")
+    parser.add_argument("--ack-loss", type=float, default=0.0,
+                        help="Fracción de acks de comandos que no se envían (prueba de reintentos)")
+    parser.add_argument("--no-stamp", action="store_true", help="JSON sin seq/uptime_ms (firmware anterior)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    fleet = Fleet(args.devices, distinct_ips=not args.same_ip and args.host.startswith("127."),
+                  host=args.host, port=args.port, sensor=args.sensor, dtype=args.dtype,
+                  protocol=args.protocol, rate=args.rate, fmt=args.fmt, batch=args.batch,
+                  stamp=not args.no_stamp, control=not args.no_control, ack_loss=args.ack_loss)
+    print(f"🚀 {args.devices} dispositivos virtuales -> {args.host}:{args.port} "
+          f"({args.sensor} {args.dtype} {args.protocol} {args.fmt}, {args.rate:g} muestras/s, lote {args.batch})")
+    fleet.start()
+    try:
+        t0 = time.monotonic()
+        last = 0
+        while not args.duration or time.monotonic() - t0 < args.duration:
+            time.sleep(1)
+            sent = fleet.sent()
+            print(f"📡 Enviados: {sent} ({sent - last}/s)")
+            last = sent
+    except KeyboardInterrupt:
+        pass
+    fleet.stop()
+    print(f"🛑 Total enviados: {fleet.sent()}")
@@ -0,0 +1,266 @@
+import selectors
+import socket
+import time
+from collections import deque
+
+# --- CONFIGURACIÓN POR DEFECTO ---
+RECV_CHUNK = 64 * 1024       # Bytes leídos por recv()
+MAX_LINE_BUFFER = 64 * 1024  # Línea sin '\n' más larga que esto => se descarta
+RETRY_PAUSED = 0.05          # Reintento de entrega cuando el consumidor está lleno
+SELECT_TIMEOUT = 1.0
+
+
+class _Connection:
+    __slots__ = ("sock", "addr", "rbuf", "wbuf", "pending", "last_activity", "paused")
+
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.rbuf = bytearray()
+        self.wbuf = bytearray()
+        self.pending = deque()
+        self.last_activity = time.monotonic()
+        self.paused = False
+
+
+# --- SERVIDOR TCP MULTI-CLIENTE ---
+class TcpIngestServer:
+    """
+    Servidor TCP basado en selectors: un solo hilo atiende cientos de
+    conexiones, cada una con su propio buffer de líneas.
+
+    Si se entrega frame_size(buf, start) (ver protocol.frame_size), el flujo
+    puede mezclar líneas JSON con tramas binarias de largo fijo; cada trama se
+    entrega completa a on_line igual que una línea.
+
+    on_line(line_bytes, addr) debe devolver False si el consumidor está lleno;
+    en ese caso la línea queda pendiente y se deja de leer esa conexión
+    (contrapresión: el control de flujo TCP frena al emisor).
+    """
+
+    def __init__(self, host, port, on_line, on_connect=None, on_disconnect=None,
+                 idle_timeout=0, max_line_buffer=MAX_LINE_BUFFER, frame_size=None, log=print):
+        self.host = host
+        self.port = port
+        self.on_line = on_line
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.idle_timeout = idle_timeout  # 0 = desactivado (el canal de control puede estar mudo)
+        self.max_line_buffer = max_line_buffer
+        self.frame_size = frame_size
+        self.log = log
+
+        self.running = False
+        self.conns = {}  # addr -> _Connection
+        self.sel = selectors.DefaultSelector()
+        self.lines_received = 0
+        self.lines_oversized = 0
+        self.lines_failed = 0
+
+        # Socketpair para despertar al selector desde otros hilos (send/stop)
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._outbox = deque()
+
+    # --- API PÚBLICA (thread-safe) ---
+    def serve_forever(self):
+        """Bloquea hasta stop(). Lanza OSError si no se puede hacer bind."""
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.host, self.port))
+        listener.listen(512)
+        listener.setblocking(False)
+        self.sel.register(listener, selectors.EVENT_READ, "listen")
+        self.sel.register(self._wake_r, selectors.EVENT_READ, "wake")
+        self.running = True
+
+        try:
+            while self.running:
+                for key, events in self.sel.select(self._next_timeout()):
+                    if key.data == "listen":
+                        self._accept(listener)
+                    elif key.data == "wake":
+                        self._drain_wake()
+                    else:
+                        conn = key.data
+                        if events & selectors.EVENT_READ:
+                            self._read(conn)
+                        if events & selectors.EVENT_WRITE and conn.addr in self.conns:
+                            self._write(conn)
+                self._process_outbox()
+                self._retry_paused()
+                self._close_idle()
+        finally:
+            for conn in list(self.conns.values()):
+                self._close(conn)
+            self.sel.close()
+            listener.close()
+
+    def stop(self):
+        self.running = False
+        self._wake()
+
+    def send(self, addr, data):
+        """Encola datos para un cliente. Devuelve False si no está conectado."""
+        if addr not in self.conns:
+            return False
+        self._outbox.append((addr, data))
+        self._wake()
+        return True
+
+    def clients(self):
+        return list(self.conns.keys())
+
+    # --- INTERNOS ---
+    def _wake(self):
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            pass
+
+    def _drain_wake(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _next_timeout(self):
+        for conn in self.conns.values():
+            if conn.paused:
+                return RETRY_PAUSED
+        return SELECT_TIMEOUT
+
+    def _accept(self, listener):
+        while True:
+            try:
+                sock, addr = listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            sock.setblocking(False)
+            conn = _Connection(sock, addr)
+            self.conns[addr] = conn
+            self.sel.register(sock, selectors.EVENT_READ, conn)
+            if self.on_connect:
+                self.on_connect(addr)
+
+    def _read(self, conn):
+        try:
+            chunk = conn.sock.recv(RECV_CHUNK)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            chunk = b""
+        if not chunk:
+            self._close(conn)  # Fin de conexión
+            return
+
+        conn.last_activity = time.monotonic()
+        buf = conn.rbuf
+        buf += chunk
+        start = 0
+        while start < len(buf):
+            if self.frame_size:
+                size = self.frame_size(buf, start)
+                if size < 0:
+                    break  # Trama binaria incompleta: esperamos más bytes
+                if size > 0:
+                    conn.pending.append(bytes(buf[start:start + size]))
+                    start += size
+                    continue
+            nl = buf.find(b"\n", start)
+            if nl < 0:
+                break
+            line = bytes(buf[start:nl]).strip()
+            start = nl + 1
+            if line:
+                conn.pending.append(line)
+        del buf[:start]
+
+        if len(buf) > self.max_line_buffer:
+            self.lines_oversized += 1
+            self.log(f"⚠️ [TCP] Línea demasiado larga de {conn.addr[0]}, descartando {len(buf)} bytes")
+            buf.clear()
+
+        self._deliver(conn)
+
+    def _deliver(self, conn):
+        pending = conn.pending
+        while pending:
+            try:
+                accepted = self.on_line(pending[0], conn.addr)
+            except Exception as e:
+                # Una línea que el consumidor no pudo procesar no debe tumbar
+                # el hilo (y con él todas las conexiones): se descarta
+                self.lines_failed += 1
+                self.log(f"⚠️ [TCP] Error procesando línea de {conn.addr[0]}: {e}")
+                accepted = True
+            if accepted is False:
+                break
+            pending.popleft()
+            self.lines_received += 1
+
+        # Contrapresión: si el consumidor no aceptó todo, dejamos de leer
+        # esta conexión hasta entregar lo pendiente
+        should_pause = bool(pending)
+        if should_pause != conn.paused:
+            conn.paused = should_pause
+            self._update_events(conn)
+
+    def _retry_paused(self):
+        for conn in list(self.conns.values()):
+            if conn.paused:
+                self._deliver(conn)
+
+    def _update_events(self, conn):
+        events = 0 if conn.paused else selectors.EVENT_READ
+        if conn.wbuf:
+            events |= selectors.EVENT_WRITE
+        try:
+            if events:
+                self.sel.modify(conn.sock, events, conn)
+            else:
+                self.sel.unregister(conn.sock)
+        except KeyError:
+            if events:
+                self.sel.register(conn.sock, events, conn)
+
+    def _process_outbox(self):
+        while self._outbox:
+            addr, data = self._outbox.popleft()
+            conn = self.conns.get(addr)
+            if conn is None:
+                continue
+            conn.wbuf += data
+            self._write(conn)
+
+    def _write(self, conn):
+        try:
+            sent = conn.sock.send(conn.wbuf)
+            del conn.wbuf[:sent]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self._close(conn)
+            return
+        self._update_events(conn)
+
+    def _close_idle(self):
+        if not self.idle_timeout:
+            return
+        limit = time.monotonic() - self.idle_timeout
+        for conn in list(self.conns.values()):
+            if conn.last_activity < limit:
+                self.log(f"⏱️ [TCP] {conn.addr[0]} inactivo {self.idle_timeout}s, cerrando")
+                self._close(conn)
+
+    def _close(self, conn):
+        if self.conns.pop(conn.addr, None) is None:
+            return
+        try:
+            self.sel.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        conn.sock.close()
+        if self.on_disconnect:
+            self.on_disconnect(conn.addr)
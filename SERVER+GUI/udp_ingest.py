@@ -0,0 +1,180 @@
+import os
+import queue
+import select
+import socket
+import struct
+import threading
+
+# --- CONFIGURACIÓN POR DEFECTO ---
+UDP_RCVBUF = 4 * 1024 * 1024  # SO_RCVBUF pedido al kernel (Linux lo duplica y limita por rmem_max)
+MAX_DATAGRAM = 65535          # Tamaño máximo de un datagrama UDP
+MAX_BATCH = 1024              # Datagramas máximos por lote entregado al parser
+BATCH_QUEUE_SIZE = 256        # Lotes en espera entre el receptor y el parser
+
+# SO_RXQ_OVFL: el kernel adjunta a cada datagrama el contador acumulado de
+# descartes del socket. Python no siempre exporta la constante (Linux = 40).
+SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40)
+
+
+def read_proc_udp_drops(sock):
+    """Lee la columna 'drops' de /proc/net/udp para este socket (por inodo). None si no aplica."""
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+        with open("/proc/net/udp") as f:
+            next(f)  # cabecera
+            for line in f:
+                cols = line.split()
+                if len(cols) >= 13 and cols[9] == inode:
+                    return int(cols[-1])
+    except (OSError, ValueError, StopIteration):
+        pass
+    return None
+
+
+# --- RECEPTOR UDP DE ALTA TASA ---
+class UdpIngest:
+    """
+    Receptor UDP desacoplado del parseo:
+      - Hilo receptor: espera con select() y drena TODOS los datagramas en
+        cola del socket por cada despertar, entregándolos como un lote.
+      - Hilo parser: llama handler(data_bytes, addr) por datagrama. Si el
+        handler lanza ValueError (p.ej. json.JSONDecodeError) se cuenta como
+        mal formado.
+    """
+
+    def __init__(self, host, port, handler, rcvbuf=UDP_RCVBUF, max_batch=MAX_BATCH,
+                 queue_size=BATCH_QUEUE_SIZE, on_malformed=None, reuseport=False, log=print):
+        self.host = host
+        self.port = port
+        self.handler = handler
+        self.rcvbuf = rcvbuf
+        self.max_batch = max_batch
+        self.on_malformed = on_malformed
+        self.reuseport = reuseport  # Varios procesos comparten el puerto (SO_REUSEPORT)
+        self.log = log
+        self.batches = queue.Queue(maxsize=queue_size)
+        self.running = False
+        self.sock = None
+        self._rxq_ovfl = False
+
+        # Contadores
+        self.received = 0         # Datagramas leídos del socket
+        self.parsed = 0           # Datagramas entregados sin error
+        self.malformed = 0        # Datagramas que el handler rechazó
+        self.dropped_app = 0      # Datagramas perdidos porque el parser no daba abasto
+        self._kernel_drops = 0    # Último valor de SO_RXQ_OVFL
+
+    # --- CICLO DE VIDA ---
+    def start(self):
+        """Hace bind y lanza los hilos. Lanza OSError si el puerto no está disponible."""
+        self.sock = self._create_socket()
+        self.running = True
+        threading.Thread(target=self._recv_loop, name="udp_recv", daemon=True).start()
+        threading.Thread(target=self._parse_loop, name="udp_parse", daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def _create_socket(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuseport:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        try:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        except OSError as e:
+            self.log(f"⚠️ [UDP] No se pudo fijar SO_RCVBUF={self.rcvbuf}: {e}")
+        try:
+            s.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+            self._rxq_ovfl = True
+        except OSError:
+            self._rxq_ovfl = False
+        s.bind((self.host, self.port))
+        s.setblocking(False)
+        return s
+
+    # --- HILO RECEPTOR ---
+    def _recv_loop(self):
+        sock = self.sock
+        cmsg_space = socket.CMSG_SPACE(4) if self._rxq_ovfl else 0
+        while self.running:
+            try:
+                ready, _, _ = select.select([sock], [], [], 1.0)
+            except (OSError, ValueError):
+                break
+            if not ready:
+                continue
+
+            batch = []
+            while len(batch) < self.max_batch:
+                try:
+                    if cmsg_space:
+                        data, ancdata, _, addr = sock.recvmsg(MAX_DATAGRAM, cmsg_space)
+                        for level, ctype, cdata in ancdata:
+                            if level == socket.SOL_SOCKET and ctype == SO_RXQ_OVFL and len(cdata) >= 4:
+                                self._kernel_drops = struct.unpack("I", cdata[:4])[0]
+                    else:
+                        data, addr = sock.recvfrom(MAX_DATAGRAM)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError as e:
+                    self.log(f"⚠️ [UDP] Error recibiendo: {e}")
+                    break
+                if data:
+                    batch.append((data, addr))
+
+            if batch:
+                self.received += len(batch)
+                try:
+                    self.batches.put_nowait(batch)
+                except queue.Full:
+                    self.dropped_app += len(batch)
+
+        sock.close()
+
+    # --- HILO PARSER ---
+    def _parse_loop(self):
+        handler = self.handler
+        while self.running or not self.batches.empty():
+            try:
+                batch = self.batches.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            for data, addr in batch:
+                try:
+                    handler(data, addr)
+                    self.parsed += 1
+                except ValueError:
+                    self.malformed += 1
+                    if self.on_malformed:
+                        self.on_malformed(data, addr)
+                except Exception as e:
+                    self.malformed += 1
+                    self.log(f"⚠️ [UDP] Error procesando datagrama de {addr[0]}: {e}")
+
+    # --- ESTADÍSTICAS ---
+    def kernel_drops(self):
+        """Descartes del kernel por buffer lleno: SO_RXQ_OVFL o, si no hay, /proc/net/udp"""
+        if self._rxq_ovfl and self._kernel_drops:
+            return self._kernel_drops
+        if self.sock is not None and self.sock.fileno() >= 0:
+            drops = read_proc_udp_drops(self.sock)
+            if drops is not None:
+                return drops
+        return self._kernel_drops
+
+    def effective_rcvbuf(self):
+        try:
+            return self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        except (OSError, AttributeError):
+            return None
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "parsed": self.parsed,
+            "malformed": self.malformed,
+            "dropped_app": self.dropped_app,
+            "kernel_drops": self.kernel_drops(),
+            "batch_queue": self.batches.qsize(),
+        }
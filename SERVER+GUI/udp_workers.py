@@ -0,0 +1,133 @@
+import multiprocessing
+import queue
+import threading
+import time
+from datetime import datetime
+from udp_ingest import UdpIngest, UDP_RCVBUF
+from protocol import decode_payload
+from metrics import REGISTRY, observe_decode
+
+# --- CONFIGURACIÓN ---
+FORWARD_INTERVAL = 0.05   # Cada cuánto un worker envía su lote al proceso principal
+STATS_INTERVAL = 2.0      # Cada cuánto un worker reporta sus contadores
+RESULT_QUEUE_SIZE = 1000  # Lotes en tránsito hacia el proceso principal
+
+
+# --- PROCESO WORKER ---
+def udp_worker_main(worker_id, host, port, rcvbuf, out_queue):
+    """
+    Cada worker abre su propio socket UDP con SO_REUSEPORT: el kernel reparte
+    los datagramas entre procesos (mismo origen -> mismo worker), así el
+    decodificado de toda la flota se reparte entre núcleos sin el GIL.
+    """
+    pending = []
+    pending_lock = threading.Lock()
+
+    def handle(data_bytes, addr):
+        records = observe_decode(decode_payload, data_bytes, "UDP", addr[0])
+        timestamp = datetime.now().isoformat()
+        for data in records:
+            data['timestamp_server'] = timestamp
+            data['protocol'] = "UDP"
+            data['source_ip'] = addr[0]
+        with pending_lock:
+            pending.extend(records)
+
+    ingest = UdpIngest(host, port, handle, rcvbuf=rcvbuf, reuseport=True,
+                       log=lambda msg: print(f"[W{worker_id}] {msg}"))
+    try:
+        ingest.start()
+    except OSError as e:
+        print(f"❌ [W{worker_id}] Error iniciando UDP: {e}")
+        return
+
+    last_stats = time.monotonic()
+    try:
+        while True:
+            time.sleep(FORWARD_INTERVAL)
+            with pending_lock:
+                batch = pending[:]
+                pending.clear()
+            if batch:
+                out_queue.put(("records", worker_id, batch))
+
+            now = time.monotonic()
+            if now - last_stats >= STATS_INTERVAL:
+                # Las métricas del worker viajan con sus contadores (ver UdpWorkerPool.metric_snapshots)
+                out_queue.put(("stats", worker_id, dict(ingest.stats(), metrics=REGISTRY.snapshot())))
+                last_stats = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ingest.stop()
+
+
+# --- GESTOR EN EL PROCESO PRINCIPAL ---
+class UdpWorkerPool:
+    """
+    Lanza N procesos worker y vuelca sus registros en un único sink
+    (sink(record)), normalmente BatchedWriter.put: una sola etapa de
+    persistencia mantiene sensor_data.jsonl como un único archivo coherente.
+    """
+
+    def __init__(self, workers, host, port, sink, rcvbuf=UDP_RCVBUF):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.sink = sink
+        self.rcvbuf = rcvbuf
+        # spawn: los hijos no heredan hilos, archivos abiertos ni sockets del padre
+        self.ctx = multiprocessing.get_context("spawn")
+        self.queue = self.ctx.Queue(maxsize=RESULT_QUEUE_SIZE)
+        self.procs = []
+        self.worker_stats = {}  # worker_id -> último dict de stats
+        self._prev_received = {}
+        self._prev_time = time.monotonic()
+
+    def start(self):
+        for wid in range(self.workers):
+            p = self.ctx.Process(target=udp_worker_main, name=f"udp_worker_{wid}",
+                                 args=(wid, self.host, self.port, self.rcvbuf, self.queue),
+                                 daemon=True)
+            p.start()
+            self.procs.append(p)
+        threading.Thread(target=self._collect, name="udp_worker_collector", daemon=True).start()
+
+    def stop(self):
+        for p in self.procs:
+            p.terminate()
+        for p in self.procs:
+            p.join(timeout=2)
+
+    def _collect(self):
+        while True:
+            try:
+                kind, wid, payload = self.queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            if kind == "records":
+                for record in payload:
+                    self.sink(record)
+            elif kind == "stats":
+                self.worker_stats[wid] = payload
+
+    def metric_snapshots(self):
+        """Últimas métricas de cada worker, para Registry.add_source"""
+        return [st["metrics"] for st in list(self.worker_stats.values()) if "metrics" in st]
+
+    def report(self):
+        """Devuelve una línea por worker con su tasa de datagramas/s desde el último reporte"""
+        now = time.monotonic()
+        elapsed = max(1e-6, now - self._prev_time)
+        lines = []
+        for wid in sorted(self.worker_stats):
+            st = self.worker_stats[wid]
+            rate = (st['received'] - self._prev_received.get(wid, 0)) / elapsed
+            self._prev_received[wid] = st['received']
+            alive = "🟢" if self.procs[wid].is_alive() else "🔴"
+            lines.append(f"{alive} W{wid}: {rate:.0f} pkt/s | recibidos {st['received']} | "
+                         f"mal formados {st['malformed']} | perdidos kernel {st['kernel_drops']}")
+        self._prev_time = now
+        return lines
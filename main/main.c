@@ -11,6 +11,8 @@
 #include <math.h>       
 #include "wifi_tcp.h"
 #include "wifi_udp.h" 
+#include "telemetry_frame.h"
+#include "esp_timer.h"
 #include "sdkconfig.h"
 
 // Incluimos ambos drivers
@@ -21,14 +23,17 @@
 #define I2C_SDA_IO GPIO_NUM_48
 
 static const char *TAG = "APP_MAIN";
-#define SEND_BUFFER_SIZE 512 
-#define RX_BUFFER_SIZE 256
+#define SEND_BUFFER_SIZE 1400 // Cabe en un datagrama UDP sin fragmentar (MTU 1500)
+#define RX_BUFFER_SIZE 256   // Largo máximo de un comando (una línea JSON)
+#define ACK_BUFFER_SIZE 384
+#define MAX_BATCH_SAMPLES 64  // Máximo de muestras acumuladas por lote
 #define MAX_CONNECTION_RETRIES 10
 
 // --- ESTRUCTURA DE ESTADO DEL SISTEMA ---
 typedef enum { SENSOR_BMI270, SENSOR_BME688 } sensor_type_t;
 typedef enum { PROTOCOL_TCP, PROTOCOL_UDP } protocol_type_t;
 typedef enum { TYPE_RAW, TYPE_RMS, TYPE_FFT, TYPE_PEAK } data_type_t;
+typedef enum { FORMAT_JSON, FORMAT_BIN } data_format_t;
 
 typedef struct {
     sensor_type_t current_sensor;
@@ -36,6 +41,9 @@ typedef struct {
     data_type_t current_datatype;
     int window_size; // "N" para RMS/FFT
     int threshold;   // Umbral para picos
+    data_format_t data_format; // JSON (texto) o BIN (trama telemetry_frame.h)
+    int batch_size;       // Muestras RAW por envío (1 = una muestra por paquete)
+    int sample_period_ms; // Periodo de muestreo en modo RAW
 } app_config_t;
 
 // Configuración inicial por defecto
@@ -44,7 +52,10 @@ static app_config_t global_config = {
     .current_protocol = PROTOCOL_UDP, // UDP por defecto para streaming rápido
     .current_datatype = TYPE_RAW,
     .window_size = 50,
-    .threshold = 1000
+    .threshold = 1000,
+    .data_format = FORMAT_JSON,
+    .batch_size = 1,
+    .sample_period_ms = 100
 };
 
 static i2c_master_bus_handle_t main_bus_handle;
@@ -64,14 +75,20 @@ static void init_i2c_master_bus(void) {
 }
 
 // --- LÓGICA DE CONTROL (RECEPCIÓN JSON) ---
-void process_incoming_command(char *json_str) {
-    // Ejemplo recibido: {"cmd":"config", "sensor":"BME688", "protocol":"TCP", "window": 100}
+// Devuelve el "id" del comando (-1 si no trae) y deja *applied en 1 si se aplicó
+int process_incoming_command(char *json_str, int *applied) {
+    // Ejemplo recibido: {"cmd":"config", "id":12, "sensor":"BME688", "protocol":"TCP", "window": 100}
+    *applied = 0;
     cJSON *root = cJSON_Parse(json_str);
     if (root == NULL) {
         ESP_LOGW(TAG, "JSON inválido recibido");
-        return;
+        return -1;
     }
 
+    int id = -1;
+    cJSON *cid = cJSON_GetObjectItem(root, "id");
+    if (cJSON_IsNumber(cid)) id = cid->valueint;
+
     cJSON *cmd = cJSON_GetObjectItem(root, "cmd");
     if (cJSON_IsString(cmd) && strcmp(cmd->valuestring, "config") == 0) {
         
@@ -105,10 +122,194 @@ void process_incoming_command(char *json_str) {
         cJSON *th = cJSON_GetObjectItem(root, "threshold");
         if (cJSON_IsNumber(th)) global_config.threshold = th->valueint;
 
-        ESP_LOGW(TAG, "CONFIG ACTUALIZADA: Sensor=%d, Proto=%d, Tipo=%d", 
-                 global_config.current_sensor, global_config.current_protocol, global_config.current_datatype);
+        // 5. Formato de salida
+        cJSON *fmt = cJSON_GetObjectItem(root, "format");
+        if (cJSON_IsString(fmt)) {
+            if (strcmp(fmt->valuestring, "JSON") == 0) global_config.data_format = FORMAT_JSON;
+            else if (strcmp(fmt->valuestring, "BIN") == 0) global_config.data_format = FORMAT_BIN;
+        }
+
+        // 6. Lotes y frecuencia de muestreo
+        cJSON *batch = cJSON_GetObjectItem(root, "batch");
+        if (cJSON_IsNumber(batch)) {
+            int k = batch->valueint;
+            if (k < 1) k = 1;
+            if (k > MAX_BATCH_SAMPLES) k = MAX_BATCH_SAMPLES;
+            global_config.batch_size = k;
+        }
+
+        cJSON *period = cJSON_GetObjectItem(root, "period_ms");
+        if (cJSON_IsNumber(period) && period->valueint >= 1) global_config.sample_period_ms = period->valueint;
+
+        ESP_LOGW(TAG, "CONFIG ACTUALIZADA: Sensor=%d, Proto=%d, Tipo=%d, Formato=%d, Lote=%d, Periodo=%dms", 
+                 global_config.current_sensor, global_config.current_protocol, global_config.current_datatype,
+                 global_config.data_format, global_config.batch_size, global_config.sample_period_ms);
+        *applied = 1;
     }
     cJSON_Delete(root);
+    return id;
+}
+
+// Uptime del dispositivo en ms (se desborda cada ~49 días)
+static inline uint32_t uptime_ms(void) {
+    return (uint32_t)(esp_timer_get_time() / 1000);
+}
+
+// --- ACK DE COMANDOS ---
+static const char *SENSOR_NAMES[] = {"BMI270", "BME688"};
+static const char *PROTOCOL_NAMES[] = {"TCP", "UDP"};
+static const char *TYPE_NAMES[] = {"RAW", "RMS", "FFT", "PEAK"};
+static const char *FORMAT_NAMES[] = {"JSON", "BIN"};
+
+// Confirma un comando con id: eco de la configuración aplicada y el seq de la
+// primera muestra que sale con ella (el servidor mide RTT y tiempo al primer dato).
+// Devuelve -1 solo si falla el socket TCP.
+static int send_command_ack(int tcp_sock, int id, int applied, uint32_t next_seq) {
+    char ack[ACK_BUFFER_SIZE];
+    int len = snprintf(ack, sizeof(ack),
+        "{\"ack\":%d, \"status\":\"%s\", \"next_seq\":%lu, \"uptime_ms\":%lu, \"config\":{\"sensor\":\"%s\", \"protocol\":\"%s\", \"type\":\"%s\", \"window_size\":%d, \"threshold\":%d, \"format\":\"%s\", \"batch\":%d, \"period_ms\":%d}}\n",
+        id, applied ? "ok" : "error", (unsigned long)next_seq, (unsigned long)uptime_ms(),
+        SENSOR_NAMES[global_config.current_sensor], PROTOCOL_NAMES[global_config.current_protocol],
+        TYPE_NAMES[global_config.current_datatype], global_config.window_size, global_config.threshold,
+        FORMAT_NAMES[global_config.data_format], global_config.batch_size, global_config.sample_period_ms);
+    if (send(tcp_sock, ack, len, 0) < 0 && errno != EAGAIN && errno != EWOULDBLOCK) {
+        ESP_LOGE(TAG, "Fallo al enviar ack del comando %d", id);
+        return -1;
+    }
+    return 0; // Con EAGAIN el ack se pierde; el servidor reintenta el comando
+}
+
+// --- FRAMING DE COMANDOS ---
+// El recv no bloqueante puede entregar medio comando o varios juntos: se
+// acumula en rx_line y se procesa cada línea completa ('\n').
+static char rx_line[RX_BUFFER_SIZE];
+static int rx_line_len = 0;
+static int rx_overflow = 0;
+
+static int handle_rx(int tcp_sock, const char *data, int len, uint32_t next_seq) {
+    for (int i = 0; i < len; i++) {
+        if (data[i] != '\n') {
+            if (rx_line_len < RX_BUFFER_SIZE - 1) rx_line[rx_line_len++] = data[i];
+            else rx_overflow = 1; // Se descarta hasta el próximo '\n'
+            continue;
+        }
+        rx_line[rx_line_len] = 0;
+        if (rx_overflow) {
+            ESP_LOGW(TAG, "Comando de más de %d bytes descartado", RX_BUFFER_SIZE - 1);
+        } else if (rx_line_len > 0) {
+            ESP_LOGI(TAG, "Comando recibido: %s", rx_line);
+            int applied;
+            int id = process_incoming_command(rx_line, &applied);
+            if (id >= 0 && send_command_ack(tcp_sock, id, applied, next_seq) < 0) return -1;
+        }
+        rx_line_len = 0;
+        rx_overflow = 0;
+    }
+    return 0;
+}
+
+// --- ENVÍO ---
+// Envía por el protocolo activo. Devuelve -1 solo si falla el socket TCP.
+static int send_payload(int tcp_sock, int udp_sock, const char *buf, int len) {
+    if (global_config.current_protocol == PROTOCOL_UDP) {
+        wifi_udp_send(udp_sock, buf, len);
+        return 0;
+    }
+    if (tcp_sock >= 0 && send(tcp_sock, buf, len, 0) < 0) {
+        ESP_LOGE(TAG, "Fallo al enviar TCP");
+        return -1;
+    }
+    return 0;
+}
+
+// --- MODO RAW POR LOTES ---
+typedef struct {
+    uint32_t t_ms;                  // Uptime al momento de la lectura
+    float v[FRAME_MAX_FIELDS];
+} sample_t;
+
+static sample_t batch_samples[MAX_BATCH_SAMPLES];
+
+static const char *BMI270_FIELDS = "[\"ax\",\"ay\",\"az\",\"gx\",\"gy\",\"gz\"]";
+static const char *BME688_FIELDS = "[\"temp\",\"press\",\"hum\",\"gas\"]";
+
+// Lee k muestras del sensor activo a sample_period_ms. Devuelve cuántas se leyeron.
+static int collect_batch(int k, int *n_fields) {
+    TickType_t last_wake = xTaskGetTickCount();
+    TickType_t period = pdMS_TO_TICKS(global_config.sample_period_ms);
+    if (period == 0) period = 1;
+    int n = 0;
+
+    for (int i = 0; i < k; i++) {
+        sample_t *s = &batch_samples[n];
+        if (global_config.current_sensor == SENSOR_BMI270) {
+            bmi270_data_t d;
+            *n_fields = 6;
+            if (bmi270_read_data(&d) == ESP_OK) {
+                s->t_ms = uptime_ms();
+                s->v[0] = d.ax; s->v[1] = d.ay; s->v[2] = d.az;
+                s->v[3] = d.gx; s->v[4] = d.gy; s->v[5] = d.gz;
+                n++;
+            }
+        } else {
+            bme688_data_t d = {0};
+            *n_fields = 4;
+            if (bme688_read_data(&d) == ESP_OK) {
+                s->t_ms = uptime_ms();
+                s->v[0] = d.temperature; s->v[1] = d.pressure;
+                s->v[2] = d.humidity; s->v[3] = d.gas_resistance;
+                n++;
+            }
+        }
+        vTaskDelayUntil(&last_wake, period);
+    }
+    return n;
+}
+
+// Serializa las muestras en tantos paquetes como haga falta (cada uno <= SEND_BUFFER_SIZE).
+// Devuelve -1 si se cae el socket TCP.
+static int send_batch(int tcp_sock, int udp_sock, char *buf, int n, int n_fields, uint32_t first_seq) {
+    int i = 0;
+    while (i < n) {
+        int start = i;
+        size_t len = 0;
+
+        if (global_config.data_format == FORMAT_BIN) {
+            uint8_t sensor_id = (global_config.current_sensor == SENSOR_BMI270)
+                                ? FRAME_SENSOR_BMI270_RAW : FRAME_SENSOR_BME688_RAW;
+            len = frame_batch_begin((uint8_t *)buf, SEND_BUFFER_SIZE, sensor_id, n_fields, first_seq + start);
+            while (i < n && frame_batch_add((uint8_t *)buf, SEND_BUFFER_SIZE, &len,
+                                            batch_samples[i].t_ms, batch_samples[i].v)) {
+                i++;
+            }
+        } else {
+            // {"sensor":..,"type":"RAW","seq":S,"fields":[..],"samples":[[t,v..],..]}
+            const bool bmi = (global_config.current_sensor == SENSOR_BMI270);
+            len = snprintf(buf, SEND_BUFFER_SIZE,
+                "{\"sensor\":\"%s\", \"type\":\"RAW\", \"seq\":%lu, \"fields\":%s, \"samples\":[",
+                bmi ? "BMI270" : "BME688", (unsigned long)(first_seq + start),
+                bmi ? BMI270_FIELDS : BME688_FIELDS);
+            while (i < n) {
+                char item[128];
+                int l = snprintf(item, sizeof(item), "%s[%lu", (i > start) ? "," : "",
+                                 (unsigned long)batch_samples[i].t_ms);
+                for (int f = 0; f < n_fields; f++) {
+                    l += snprintf(item + l, sizeof(item) - l, ",%.2f", batch_samples[i].v[f]);
+                }
+                l += snprintf(item + l, sizeof(item) - l, "]");
+                if (len + l + 3 >= SEND_BUFFER_SIZE) break; // Reservamos "]}\n"
+                memcpy(buf + len, item, l);
+                len += l;
+                i++;
+            }
+            memcpy(buf + len, "]}\n", 3);
+            len += 3;
+        }
+
+        if (i == start) return 0; // No cabe ni una muestra (no debería pasar)
+        if (send_payload(tcp_sock, udp_sock, buf, (int)len) < 0) return -1;
+    }
+    return 0;
 }
 
 // --- TAREA PRINCIPAL ---
@@ -122,6 +323,7 @@ static void sensor_net_task(void *arg) {
 
     int tcp_sock = -1;
     int udp_sock = -1;
+    uint32_t frame_seq = 0; // Número de secuencia de cada muestra (JSON y binario), monótono desde el arranque
 
     while (1) {
         // --- GESTIÓN DE CONEXIÓN ---
@@ -134,6 +336,8 @@ static void sensor_net_task(void *arg) {
                 // Configurar socket como NO BLOQUEANTE para poder leer sin detener el loop
                 int flags = fcntl(tcp_sock, F_GETFL, 0);
                 fcntl(tcp_sock, F_SETFL, flags | O_NONBLOCK);
+                rx_line_len = 0; // Un comando a medias de la conexión anterior no sirve
+                rx_overflow = 0;
                 ESP_LOGI(TAG, "Canal de control TCP listo (No bloqueante).");
             } else {
                 ESP_LOGE(TAG, "Fallo al conectar TCP. Reintentando en 3s...");
@@ -150,11 +354,14 @@ static void sensor_net_task(void *arg) {
         // --- BUCLE DE PROCESAMIENTO ---
         while (1) {
             // A. VERIFICAR COMANDOS (Recv No Bloqueante)
-            int len = recv(tcp_sock, rx_buf, sizeof(rx_buf) - 1, 0);
+            int len = recv(tcp_sock, rx_buf, sizeof(rx_buf), 0);
             if (len > 0) {
-                rx_buf[len] = 0; // Null-terminate string
-                ESP_LOGI(TAG, "Comando recibido: %s", rx_buf);
-                process_incoming_command(rx_buf);
+                // Las muestras que siguen (desde frame_seq) ya salen con la nueva configuración
+                if (handle_rx(tcp_sock, rx_buf, len, frame_seq) < 0) {
+                    close(tcp_sock);
+                    tcp_sock = -1;
+                    break;
+                }
             } else if (len < 0 && errno != EAGAIN && errno != EWOULDBLOCK) {
                 // Error real de conexión (no es solo que no haya datos)
                 ESP_LOGE(TAG, "Conexión TCP perdida (errno %d). Reconectando...", errno);
@@ -163,9 +370,27 @@ static void sensor_net_task(void *arg) {
                 break; // Salir del while interno para reconectar
             }
 
-            // B. LEER SENSOR ACTIVO
+            // B. MODO RAW POR LOTES: K muestras por paquete, cada una con su timestamp
+            if (global_config.current_datatype == TYPE_RAW && global_config.batch_size > 1) {
+                int n_fields = 0;
+                int n = collect_batch(global_config.batch_size, &n_fields);
+                if (n == 0) {
+                    ESP_LOGW(TAG, "Error lectura sensor (lote vacío)");
+                    vTaskDelay(pdMS_TO_TICKS(500));
+                    continue;
+                }
+                if (send_batch(tcp_sock, udp_sock, send_buf, n, n_fields, frame_seq) < 0) {
+                    close(tcp_sock);
+                    tcp_sock = -1;
+                    break;
+                }
+                frame_seq += n;
+                continue;
+            }
+
+            // C. LEER SENSOR ACTIVO
             esp_err_t ret = ESP_FAIL;
-            int json_len = 0;
+            int payload_len = 0;
 
             if (global_config.current_sensor == SENSOR_BMI270) {
                 
@@ -193,9 +418,15 @@ static void sensor_net_task(void *arg) {
                         float rms_z = sqrt(sum_z / samples_taken);
                         float rms_total = sqrt(rms_x*rms_x + rms_y*rms_y + rms_z*rms_z);
 
-                        json_len = snprintf(send_buf, SEND_BUFFER_SIZE,
-                            "{\"sensor\":\"BMI270\", \"type\":\"RMS\", \"rms\":%.3f, \"N\":%d}\n",
-                            rms_total, samples_taken);
+                        if (global_config.data_format == FORMAT_BIN) {
+                            float fields[2] = { rms_total, (float)samples_taken };
+                            payload_len = frame_pack((uint8_t *)send_buf, SEND_BUFFER_SIZE,
+                                FRAME_SENSOR_BMI270_RMS, frame_seq, uptime_ms(), fields, 2);
+                        } else {
+                            payload_len = snprintf(send_buf, SEND_BUFFER_SIZE,
+                                "{\"sensor\":\"BMI270\", \"type\":\"RMS\", \"rms\":%.3f, \"N\":%d, \"seq\":%lu, \"uptime_ms\":%lu}\n",
+                                rms_total, samples_taken, (unsigned long)frame_seq, (unsigned long)uptime_ms());
+                        }
                         ret = ESP_OK; 
                     } else {
                         ret = ESP_FAIL;
@@ -204,44 +435,48 @@ static void sensor_net_task(void *arg) {
                 } else {
                     // --- MODO RAW ---
                     ret = bmi270_read_data(&bmi_data);
-                    if (ret == ESP_OK) {
-                        json_len = snprintf(send_buf, SEND_BUFFER_SIZE,
-                            "{\"sensor\":\"BMI270\", \"type\":\"RAW\", \"ax\":%.2f, \"ay\":%.2f, \"az\":%.2f, \"gx\":%.2f, \"gy\":%.2f, \"gz\":%.2f}\n",
-                            bmi_data.ax, bmi_data.ay, bmi_data.az, bmi_data.gx, bmi_data.gy, bmi_data.gz);
+                    if (ret == ESP_OK && global_config.data_format == FORMAT_BIN) {
+                        float fields[6] = { bmi_data.ax, bmi_data.ay, bmi_data.az,
+                                            bmi_data.gx, bmi_data.gy, bmi_data.gz };
+                        payload_len = frame_pack((uint8_t *)send_buf, SEND_BUFFER_SIZE,
+                            FRAME_SENSOR_BMI270_RAW, frame_seq, uptime_ms(), fields, 6);
+                    } else if (ret == ESP_OK) {
+                        payload_len = snprintf(send_buf, SEND_BUFFER_SIZE,
+                            "{\"sensor\":\"BMI270\", \"type\":\"RAW\", \"ax\":%.2f, \"ay\":%.2f, \"az\":%.2f, \"gx\":%.2f, \"gy\":%.2f, \"gz\":%.2f, \"seq\":%lu, \"uptime_ms\":%lu}\n",
+                            bmi_data.ax, bmi_data.ay, bmi_data.az, bmi_data.gx, bmi_data.gy, bmi_data.gz,
+                            (unsigned long)frame_seq, (unsigned long)uptime_ms());
                     }
                 }
             } 
             else if (global_config.current_sensor == SENSOR_BME688) {
                 ret = bme688_read_data(&bme_data);
                 
-                if (ret == ESP_OK) {
-                    json_len = snprintf(send_buf, SEND_BUFFER_SIZE,
-                        "{\"sensor\":\"BME688\", \"type\":\"RAW\", \"temp\":%.2f, \"press\":%.2f, \"hum\":%.2f, \"gas\":%.2f}\n",
-                        bme_data.temperature, bme_data.pressure, bme_data.humidity, bme_data.gas_resistance);
+                if (ret == ESP_OK && global_config.data_format == FORMAT_BIN) {
+                    float fields[4] = { bme_data.temperature, bme_data.pressure,
+                                        bme_data.humidity, bme_data.gas_resistance };
+                    payload_len = frame_pack((uint8_t *)send_buf, SEND_BUFFER_SIZE,
+                        FRAME_SENSOR_BME688_RAW, frame_seq, uptime_ms(), fields, 4);
+                } else if (ret == ESP_OK) {
+                    payload_len = snprintf(send_buf, SEND_BUFFER_SIZE,
+                        "{\"sensor\":\"BME688\", \"type\":\"RAW\", \"temp\":%.2f, \"press\":%.2f, \"hum\":%.2f, \"gas\":%.2f, \"seq\":%lu, \"uptime_ms\":%lu}\n",
+                        bme_data.temperature, bme_data.pressure, bme_data.humidity, bme_data.gas_resistance,
+                        (unsigned long)frame_seq, (unsigned long)uptime_ms());
                 }
             }
 
-            // C. ENVIAR DATOS
-            if (ret == ESP_OK && json_len > 0) {
+            // D. ENVIAR DATOS
+            if (ret == ESP_OK && payload_len > 0) {
+                frame_seq++;
                 
-                if (global_config.current_protocol == PROTOCOL_UDP) {
-                    wifi_udp_send(udp_sock, send_buf, json_len);
-                } else {
-                    // TCP
-                    if (tcp_sock >= 0) {
-                        int err = send(tcp_sock, send_buf, json_len, 0);
-                        if (err < 0) {
-                            ESP_LOGE(TAG, "Fallo al enviar TCP");
-                            close(tcp_sock);
-                            tcp_sock = -1;
-                            break; 
-                        }
-                    }
+                if (send_payload(tcp_sock, udp_sock, send_buf, payload_len) < 0) {
+                    close(tcp_sock);
+                    tcp_sock = -1;
+                    break; 
                 }
                 
-                // Tasa de envío (10Hz para RAW, RMS ya tiene su propio delay interno)
+                // Tasa de envío (sample_period_ms para RAW, RMS ya tiene su propio delay interno)
                 if (global_config.current_datatype == TYPE_RAW) {
-                    vTaskDelay(pdMS_TO_TICKS(100));
+                    vTaskDelay(pdMS_TO_TICKS(global_config.sample_period_ms));
                 }
             } else {
                 // Si falla la lectura, esperamos un poco
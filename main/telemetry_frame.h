@@ -0,0 +1,103 @@
+#ifndef TELEMETRY_FRAME_H
+#define TELEMETRY_FRAME_H
+
+#include <stdint.h>
+#include <stddef.h>
+#include <string.h>
+
+/*
+ * Trama binaria de telemetría (alternativa compacta al JSON).
+ * Todo en little-endian (nativo del ESP32):
+ *
+ *   [0]  magic      0xA5 (nunca coincide con '{' del JSON)
+ *   [1]  version    FRAME_VERSION
+ *   [2]  sensor_id  frame_sensor_id_t
+ *   [3]  n_fields   cantidad de float32 que siguen
+ *   [4]  seq        uint32, contador monotónico de tramas
+ *   [8]  t_ms       uint32, uptime del dispositivo en ms
+ *   [12] fields     n_fields * float32
+ *
+ * Versión 2 (lote de muestras): misma cabecera de 12 bytes, pero
+ *   [4]  seq        uint32, secuencia de la PRIMERA muestra (la i-ésima es seq + i)
+ *   [8]  count      uint16, cantidad de muestras
+ *   [10] reservado  uint16 (0)
+ *   [12] muestras   count * (t_ms uint32 + n_fields * float32)
+ */
+#define FRAME_MAGIC       0xA5
+#define FRAME_VERSION     1
+#define FRAME_VERSION_BATCH 2
+#define FRAME_HEADER_SIZE 12
+#define FRAME_MAX_FIELDS  8
+
+typedef enum {
+    FRAME_SENSOR_BMI270_RAW = 1,  // ax, ay, az, gx, gy, gz
+    FRAME_SENSOR_BMI270_RMS = 2,  // rms, N
+    FRAME_SENSOR_BME688_RAW = 3,  // temp, press, hum, gas
+} frame_sensor_id_t;
+
+/**
+ * @brief Empaqueta una trama en buf.
+ *
+ * @return int Bytes escritos, o 0 si no cabe en el buffer.
+ */
+static inline int frame_pack(uint8_t *buf, size_t cap, uint8_t sensor_id,
+                             uint32_t seq, uint32_t t_ms,
+                             const float *fields, uint8_t n_fields)
+{
+    size_t len = FRAME_HEADER_SIZE + (size_t)n_fields * sizeof(float);
+    if (n_fields > FRAME_MAX_FIELDS || len > cap) return 0;
+
+    buf[0] = FRAME_MAGIC;
+    buf[1] = FRAME_VERSION;
+    buf[2] = sensor_id;
+    buf[3] = n_fields;
+    memcpy(&buf[4], &seq, sizeof(seq));
+    memcpy(&buf[8], &t_ms, sizeof(t_ms));
+    memcpy(&buf[FRAME_HEADER_SIZE], fields, (size_t)n_fields * sizeof(float));
+    return (int)len;
+}
+
+/**
+ * @brief Escribe la cabecera de una trama de lote (versión 2) con count = 0.
+ *
+ * @return int Bytes escritos (FRAME_HEADER_SIZE), o 0 si no cabe.
+ */
+static inline int frame_batch_begin(uint8_t *buf, size_t cap, uint8_t sensor_id,
+                                    uint8_t n_fields, uint32_t first_seq)
+{
+    if (n_fields > FRAME_MAX_FIELDS || cap < FRAME_HEADER_SIZE) return 0;
+
+    buf[0] = FRAME_MAGIC;
+    buf[1] = FRAME_VERSION_BATCH;
+    buf[2] = sensor_id;
+    buf[3] = n_fields;
+    memcpy(&buf[4], &first_seq, sizeof(first_seq));
+    memset(&buf[8], 0, 4);
+    return FRAME_HEADER_SIZE;
+}
+
+/**
+ * @brief Agrega una muestra a la trama de lote e incrementa count.
+ *
+ * @param len Largo actual de la trama; se actualiza si la muestra cabe.
+ * @return int 1 si se agregó, 0 si no cabe en el buffer.
+ */
+static inline int frame_batch_add(uint8_t *buf, size_t cap, size_t *len,
+                                  uint32_t t_ms, const float *fields)
+{
+    uint8_t n_fields = buf[3];
+    size_t sample_size = sizeof(uint32_t) + (size_t)n_fields * sizeof(float);
+    if (*len + sample_size > cap) return 0;
+
+    memcpy(&buf[*len], &t_ms, sizeof(t_ms));
+    memcpy(&buf[*len + sizeof(t_ms)], fields, (size_t)n_fields * sizeof(float));
+    *len += sample_size;
+
+    uint16_t count;
+    memcpy(&count, &buf[8], sizeof(count));
+    count++;
+    memcpy(&buf[8], &count, sizeof(count));
+    return 1;
+}
+
+#endif // TELEMETRY_FRAME_H